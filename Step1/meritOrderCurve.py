@@ -21,6 +21,10 @@ class MeritOrderCurve:
 
         self.minimum_bids = min(0, np.min(self.prod_marginal_costs))
 
+        # Curves computed once, at the first call of prepare_curves_production/demand
+        self.supply_curve = None
+        self.demand_curve = None
+
         try:
             if len(self.productions) != len(self.prod_marginal_costs):
                 raise ValueError(
@@ -63,6 +67,8 @@ class MeritOrderCurve:
                 None
 
     def prepare_curves_production(self):
+        if self.supply_curve is not None:
+            return self.supply_curve
 
         sorted_indices = np.argsort(self.prod_marginal_costs)
         sorted_productions = self.productions[sorted_indices]
@@ -73,9 +79,12 @@ class MeritOrderCurve:
         sorted_productions = np.insert(sorted_productions, 0, 0)
 
         sorted_costs = np.insert(sorted_costs, 0, sorted_costs[0])
-        return sorted_productions, sorted_costs
+        self.supply_curve = sorted_productions, sorted_costs
+        return self.supply_curve
 
     def prepare_curves_demand(self):
+        if self.demand_curve is not None:
+            return self.demand_curve
 
         sorted_indices = np.argsort(self.demands_marginal_costs)[::-1].copy()
         sorted_productions = self.demands[sorted_indices].copy()
@@ -88,7 +97,8 @@ class MeritOrderCurve:
         )
         sorted_costs = np.concatenate((sorted_costs, np.array([self.minimum_bids])))
 
-        return sorted_productions, sorted_costs
+        self.demand_curve = sorted_productions, sorted_costs
+        return self.demand_curve
 
     def find_intersection_point(self):
         sorted_productions, sorted_productions_costs = self.prepare_curves_production()
@@ -174,3 +184,239 @@ class MeritOrderCurve:
         )
         plt.legend()
         plt.show()
+
+
+def clear_sorted_merit_order(
+    offer_quantities: np.array,
+    offer_prices: np.array,
+    bid_quantities: np.array,
+    bid_prices: np.array,
+):
+    """
+    Clears a copper-plate market hour by hour from offers sorted by increasing
+    price and bids sorted by decreasing price, see clear_merit_order.
+
+    Parameters:
+        offer_quantities, offer_prices (np.array): The sorted offers, of shape (nbHour, nbOffers).
+        bid_quantities, bid_prices (np.array): The sorted bids, of shape (nbHour, nbBids).
+
+    Returns:
+        clearing_price (np.array): The clearing price of each hour, of shape (nbHour,).
+        accepted_offers (np.array): The accepted quantity of each sorted offer, of shape (nbHour, nbOffers).
+        accepted_bids (np.array): The accepted quantity of each sorted bid, of shape (nbHour, nbBids).
+        welfare (np.array): The social welfare of each hour, of shape (nbHour,).
+    """
+    nbHour = offer_quantities.shape[0]
+    supply = np.cumsum(offer_quantities, axis=1)
+    demand = np.concatenate((np.zeros((nbHour, 1)), np.cumsum(bid_quantities, axis=1)), axis=1)
+
+    # Demand willing to pay at least the price of each offer
+    nbBidsAbove = (bid_prices[:, None, :] >= offer_prices[:, :, None]).sum(axis=2)
+    demand_above = np.take_along_axis(demand, nbBidsAbove, axis=1)
+
+    # Traded quantity: largest quantity whose marginal offer is below the marginal bid
+    traded = np.max(np.minimum(supply, demand_above), axis=1, initial=0)
+
+    accepted_offers = np.clip(traded[:, None] - (supply - offer_quantities), 0, offer_quantities)
+    accepted_bids = np.clip(traded[:, None] - demand[:, :-1], 0, bid_quantities)
+
+    # Clearing price: the most expensive accepted offer, or the highest bid not
+    # fully accepted if it is higher (demand setting the price)
+    tolerance = 1e-9 * np.maximum(1, traded)[:, None]
+    marginal_offer = np.max(np.where(accepted_offers > tolerance, offer_prices, -np.inf), axis=1, initial=-np.inf)
+    marginal_bid = np.max(
+        np.where(accepted_bids < bid_quantities - tolerance, bid_prices, -np.inf), axis=1, initial=-np.inf
+    )
+    clearing_price = np.maximum(marginal_offer, marginal_bid)
+    if offer_prices.shape[1] > 0:  # Nothing traded nor bid: cheapest offer
+        clearing_price = np.where(np.isinf(clearing_price), offer_prices[:, 0], clearing_price)
+
+    welfare = np.sum(accepted_bids * bid_prices, axis=1) - np.sum(accepted_offers * offer_prices, axis=1)
+    return clearing_price, accepted_offers, accepted_bids, welfare
+
+
+def clear_merit_order(
+    offer_quantities: np.array,
+    offer_prices: np.array,
+    bid_quantities: np.array,
+    bid_prices: np.array,
+):
+    """
+    Clears a copper-plate market (no network, no inter-temporal constraint) for
+    many hours at once, exactly and without LP solver: the offers are stacked by
+    increasing price, the bids by decreasing price, and the traded quantity is the
+    intersection of the two staircases. It gives the same productions, demands and
+    welfare as the Gurobi clearing (as in step1.py) in a few vector operations.
+    Among equivalent optima (offers and bids at the clearing price), the largest
+    quantity is traded.
+
+    An inelastic demand is a bid at a high price (value of lost load).
+
+    Parameters:
+        offer_quantities (np.array): The offered quantities, of shape (nbHour, nbOffers) or (nbOffers,) for a single hour.
+        offer_prices (np.array): The offer prices (marginal costs), broadcast to the shape of offer_quantities.
+        bid_quantities (np.array): The bid quantities, of shape (nbHour, nbBids) or (nbBids,).
+        bid_prices (np.array): The bid prices, broadcast to the shape of bid_quantities.
+
+    Returns:
+        clearing_price (np.array): The clearing price of each hour. When it is not unique (the
+            staircases cross on a vertical step), the lowest one, set by the marginal accepted
+            offer or by the highest bid not fully accepted.
+        accepted_offers (np.array): The accepted quantity of each offer, in the order of the inputs.
+        accepted_bids (np.array): The accepted quantity of each bid, in the order of the inputs.
+        welfare (np.array): The social welfare of each hour.
+
+        For single-hour (1-D) inputs, the hour dimension is removed from the outputs.
+
+    Raises:
+        ValueError: If the offers and the bids do not have the same number of hours.
+    """
+    single_hour = np.ndim(offer_quantities) == 1 and np.ndim(bid_quantities) == 1
+    offer_quantities = np.atleast_2d(np.asarray(offer_quantities, dtype=float))
+    bid_quantities = np.atleast_2d(np.asarray(bid_quantities, dtype=float))
+    if offer_quantities.shape[0] != bid_quantities.shape[0]:
+        raise ValueError(
+            f"Offers ({offer_quantities.shape[0]} hours) and bids ({bid_quantities.shape[0]} hours) must have the same number of hours."
+        )
+    offer_prices = np.broadcast_to(np.asarray(offer_prices, dtype=float), offer_quantities.shape)
+    bid_prices = np.broadcast_to(np.asarray(bid_prices, dtype=float), bid_quantities.shape)
+
+    offer_order = np.argsort(offer_prices, axis=1, kind="stable")
+    bid_order = np.argsort(-bid_prices, axis=1, kind="stable")
+    clearing_price, sorted_offers, sorted_bids, welfare = clear_sorted_merit_order(
+        np.take_along_axis(offer_quantities, offer_order, axis=1),
+        np.take_along_axis(offer_prices, offer_order, axis=1),
+        np.take_along_axis(bid_quantities, bid_order, axis=1),
+        np.take_along_axis(bid_prices, bid_order, axis=1),
+    )
+
+    # Back to the order of the inputs
+    accepted_offers = np.empty_like(sorted_offers)
+    np.put_along_axis(accepted_offers, offer_order, sorted_offers, axis=1)
+    accepted_bids = np.empty_like(sorted_bids)
+    np.put_along_axis(accepted_bids, bid_order, sorted_bids, axis=1)
+
+    if single_hour:
+        return clearing_price[0], accepted_offers[0], accepted_bids[0], welfare[0]
+    return clearing_price, accepted_offers, accepted_bids, welfare
+
+
+class MeritOrderCurves:
+    """
+    Supply and demand staircases of many hours (24, 8760, ...) computed in one pass.
+
+    The quantities and prices are (hours x units) arrays. The sort permutation is
+    computed once: when the prices do not change across hours (1-D prices, or
+    identical rows), a single argsort is shared by all the hours, and
+    set_quantities updates the curves for new quantities without sorting again.
+
+    Attributes:
+        offer_order, bid_order (np.array): The permutations sorting the offers by increasing price
+            and the bids by decreasing price, of shape (1, nbUnits) when shared by all the hours.
+        sorted_productions, sorted_prod_costs (np.array): The sorted offers, of shape (nbHour, nbOffers).
+        sorted_demands, sorted_demands_costs (np.array): The sorted bids, of shape (nbHour, nbBids).
+    """
+
+    def __init__(
+        self,
+        productions: np.array,
+        prod_marginal_costs: np.array,
+        demands: np.array,
+        demands_marginal_costs: np.array,
+    ):
+        """
+        Parameters:
+            productions (np.array): The offered quantities, of shape (nbHour, nbOffers).
+            prod_marginal_costs (np.array): The offer prices, of shape (nbOffers,) if they are the same every hour, else (nbHour, nbOffers).
+            demands (np.array): The bid quantities, of shape (nbHour, nbBids).
+            demands_marginal_costs (np.array): The bid prices, of shape (nbBids,) or (nbHour, nbBids).
+        """
+        self.offer_order, self.sorted_prod_costs = self.sort_prices(prod_marginal_costs, descending=False)
+        self.bid_order, self.sorted_demands_costs = self.sort_prices(demands_marginal_costs, descending=True)
+        self.set_quantities(productions, demands)
+
+    @staticmethod
+    def sort_prices(prices: np.array, descending: bool):
+        """
+        Sorts the prices of every hour, with a single argsort if they do not change across hours.
+
+        Returns:
+            order (np.array): The sort permutation, of shape (1, nbUnits) if it is shared by all the hours.
+            sorted_prices (np.array): The sorted prices, of the same shape.
+        """
+        prices = np.atleast_2d(np.asarray(prices, dtype=float))
+        if np.all(prices == prices[:1]):
+            prices = prices[:1]
+        order = np.argsort(-prices if descending else prices, axis=1, kind="stable")
+        return order, np.take_along_axis(prices, order, axis=1)
+
+    def set_quantities(self, productions: np.array, demands: np.array):
+        """
+        Sets the quantities of every hour, keeping the sort permutation of the prices.
+
+        Parameters:
+            productions (np.array): The offered quantities, of shape (nbHour, nbOffers).
+            demands (np.array): The bid quantities, of shape (nbHour, nbBids).
+
+        Raises:
+            ValueError: If the productions and the demands do not have the same number of hours.
+        """
+        productions = np.atleast_2d(np.asarray(productions, dtype=float))
+        demands = np.atleast_2d(np.asarray(demands, dtype=float))
+        if productions.shape[0] != demands.shape[0]:
+            raise ValueError(
+                f"Productions ({productions.shape[0]} hours) and demands ({demands.shape[0]} hours) must have the same number of hours."
+            )
+        self.nbHour = productions.shape[0]
+        self.sorted_productions = self.take(productions, self.offer_order)
+        self.sorted_demands = self.take(demands, self.bid_order)
+        self.sorted_prod_costs = np.broadcast_to(self.sorted_prod_costs, self.sorted_productions.shape)
+        self.sorted_demands_costs = np.broadcast_to(self.sorted_demands_costs, self.sorted_demands.shape)
+
+    @staticmethod
+    def take(values: np.array, order: np.array) -> np.array:
+        """
+        Applies a sort permutation, shared by all the hours or hour by hour.
+        """
+        if order.shape[0] == 1:
+            return values[:, order[0]]
+        return np.take_along_axis(values, order, axis=1)
+
+    def supply_curves(self):
+        """
+        Returns the supply staircases of all the hours, as MeritOrderCurve.prepare_curves_production
+        does for one hour: the cumulated productions and the costs, of shape (nbHour, nbOffers + 1).
+        """
+        productions = np.cumsum(self.sorted_productions, axis=1)
+        productions = np.concatenate((np.zeros((self.nbHour, 1)), productions), axis=1)
+        costs = np.concatenate((self.sorted_prod_costs[:, :1], self.sorted_prod_costs), axis=1)
+        return productions, costs
+
+    def demand_curves(self):
+        """
+        Returns the demand staircases of all the hours, as MeritOrderCurve.prepare_curves_demand
+        does for one hour: the cumulated demands and the bids, of shape (nbHour, nbBids + 1).
+        """
+        demands = np.cumsum(self.sorted_demands, axis=1)
+        demands = np.concatenate((demands, demands[:, -1:]), axis=1)
+        minimum_bids = np.minimum(0, np.min(self.sorted_prod_costs, axis=1, keepdims=True))
+        costs = np.concatenate((self.sorted_demands_costs, minimum_bids), axis=1)
+        return demands, costs
+
+    def clear(self):
+        """
+        Clears all the hours on the sorted curves, see clear_merit_order.
+
+        Returns:
+            clearing_price (np.array): The clearing price of each hour, of shape (nbHour,).
+            accepted_offers, accepted_bids (np.array): The accepted quantities, in the order of the inputs.
+            welfare (np.array): The social welfare of each hour.
+        """
+        clearing_price, sorted_offers, sorted_bids, welfare = clear_sorted_merit_order(
+            self.sorted_productions, self.sorted_prod_costs, self.sorted_demands, self.sorted_demands_costs
+        )
+        accepted_offers = np.empty_like(sorted_offers)
+        np.put_along_axis(accepted_offers, np.broadcast_to(self.offer_order, sorted_offers.shape), sorted_offers, axis=1)
+        accepted_bids = np.empty_like(sorted_bids)
+        np.put_along_axis(accepted_bids, np.broadcast_to(self.bid_order, sorted_bids.shape), sorted_bids, axis=1)
+        return clearing_price, accepted_offers, accepted_bids, welfare
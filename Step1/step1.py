@@ -1,9 +1,18 @@
+import os
+import sys
 import gurobipy as gp
 from gurobipy import GRB
 
 import pandas as pd
 import numpy as np
 
+# Modules shared by the steps (utils) are at the root of the repository
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.instrumentation import start_run
+
+# Phases of the run, recorded if INSTRUMENTATION_FILE is set (see utils.instrumentation)
+run_record = start_run("step1")
+
 #########################################################
 # Constants
 #########################################################
@@ -21,12 +30,14 @@ P_MAX = np.array(
 
 D = 1500*4
 bid_price = np.array([9,12,15])
+run_record.end_phase("inputs")
 
 #########################################################
 # Model
 #########################################################
 
 # Create a new model
+run_record.start_phase("step1", profile=True)
 m = gp.Model("Copper-plate single hour")
 
 # Create variables
@@ -43,8 +54,11 @@ objective = m.setObjective(sum(bid_price[i]*d[i] for i in range(3)) - sum(C[i] *
 # Constraint: D - sum(p) = 0
 balance = m.addConstr(-sum(p[i] for i in range(12 + 6)) + sum(d[i] for i in range(3)) == 0, "Generation balance")
 
+run_record.end_phase("build", m)
+
 # Optimize model
 m.optimize()
+run_record.end_phase("solve", m)
 
 #########################################################
 # Some prints
@@ -68,6 +82,16 @@ for j in range(12 + 6):
     )
 print('Demand Supplied: ', demand)
 print('Utility:', utlity)
+run_record.end_phase("extract")
+
+# Same clearing without LP solver, to check the Gurobi results
+from meritOrderCurve import clear_merit_order
+
+merit_order_price, _, merit_order_demand, merit_order_welfare = clear_merit_order(
+    P_MAX, C, np.array([0.5*D,0.4*D,0.1*D]), bid_price
+)
+print(f"Merit-order clearing: price {merit_order_price}, welfare {merit_order_welfare} (Gurobi: {price}, {m.ObjVal})")
+run_record.end_phase("merit_order")
 
 
 import matplotlib.pyplot as plt
@@ -100,4 +124,5 @@ curve = MeritOrderCurve(
     demands_marginal_costs=bid_price
 )
 
-curve.merit_order_curve()
\ No newline at end of file
+curve.merit_order_curve()
+run_record.end_phase("plot")
@@ -1,9 +1,110 @@
 import json
+import numpy as np
 
 
 class GenerationUnits:
-    def __init__(self):
-        self.units = []
+    """
+    Generation units of the system, stored column by column.
+
+    Each attribute is kept in a contiguous NumPy array with one entry per unit and
+    the availability is a (units x hours) matrix, so the model builders can read the
+    whole fleet as vectors: generation_units.cost, generation_units.pmax,
+    generation_units.availability, generation_units.get_max_production(), ...
+
+    generation_units.units[g]["Cost"] still gives the unit by unit (dictionary) view.
+    """
+
+    # Name of the array -> key in the dictionary of a unit
+    columns = {
+        "unit_id": "Id",
+        "node_id": "Id node",
+        "cost": "Cost",
+        "pmax": "PMAX",
+        "pmin": "PMIN",
+        "ramp_up": "Ramp up",
+        "ramp_down": "Ramp down",
+        "prod_init": "Initial production",
+        "up_reserve": "Up reserve",
+        "down_reserve": "Down reserve",
+        "up_reserve_offer": "Up reserve offer",
+        "down_reserve_offer": "Down reserve offer",
+    }
+    integer_columns = ("unit_id", "node_id")
+
+    def __init__(self, capacity: int = 32):
+        self.nbUnits = 0
+        self.data = {
+            name: np.zeros(capacity, dtype=int if name in self.integer_columns else float)
+            for name in self.columns
+        }
+        self.availability_data = np.zeros((capacity, 0))
+        self.unit_types = []
+        self.units_view = None
+
+    def __getattr__(self, name):
+        # Array accessors: generation_units.cost, generation_units.pmax, ...
+        if name in GenerationUnits.columns and "data" in self.__dict__:
+            return self.data[name][: self.nbUnits]
+        raise AttributeError(f"'GenerationUnits' object has no attribute '{name}'")
+
+    @property
+    def availability(self) -> np.array:
+        """Availability of the units, array of shape (nbUnits, nbHour)."""
+        return self.availability_data[: self.nbUnits]
+
+    @property
+    def units(self) -> list:
+        """Dictionary view of the units (built on demand, read only)."""
+        if self.units_view is None:
+            self.units_view = [self.get_unit_dict(i) for i in range(self.nbUnits)]
+        return self.units_view
+
+    def get_unit_dict(self, index: int) -> dict:
+        data = {name: self.data[name][index].item() for name in self.columns}
+        return {
+            "Id": data["unit_id"],
+            "Id node": data["node_id"],
+            "Type": self.unit_types[index],
+            "Cost": data["cost"],
+            "PMAX": data["pmax"],
+            "PMIN": data["pmin"],
+            "Availability": self.availability_data[index],
+            "Ramp up": data["ramp_up"],
+            "Ramp down": data["ramp_down"],
+            "Initial production": data["prod_init"],
+            "Up reserve": data["up_reserve"],
+            "Down reserve": data["down_reserve"],
+            "Up reserve offer": data["up_reserve_offer"],
+            "Down reserve offer": data["down_reserve_offer"],
+        }
+
+    def get_ids(self) -> list:
+        return self.unit_id.tolist()
+
+    def get_max_production(self) -> np.array:
+        """PMAX times availability, array of shape (nbUnits, nbHour)."""
+        return self.pmax[:, None] * self.availability
+
+    def allocate(self, nbUnits: int, nbHour: int):
+        """
+        Makes room for nbUnits units with nbHour hours of availability.
+        """
+        if self.nbUnits == 0 and self.availability_data.shape[1] != nbHour:
+            self.availability_data = np.zeros((self.availability_data.shape[0], nbHour))
+        elif self.availability_data.shape[1] != nbHour:
+            raise ValueError(
+                f"Availability must have {self.availability_data.shape[1]} hours, got {nbHour}."
+            )
+
+        capacity = self.availability_data.shape[0]
+        if nbUnits > capacity:
+            capacity = max(nbUnits, 2 * capacity)
+            for name, array in self.data.items():
+                self.data[name] = np.zeros(capacity, dtype=array.dtype)
+                self.data[name][: self.nbUnits] = array[: self.nbUnits]
+            availability_data = np.zeros((capacity, nbHour))
+            availability_data[: self.nbUnits] = self.availability_data[: self.nbUnits]
+            self.availability_data = availability_data
 
     def add_unit(
         self,
@@ -22,26 +123,83 @@ class GenerationUnits:
         up_reserve_offer: float,
         down_reserve_offer: float,
     ):
+        self.add_units(
+            unit_id=[unit_id],
+            node_id=[node_id],
+            unit_type=[unit_type],
+            cost=[cost],
+            pmax=[pmax],
+            pmin=[pmin],
+            availability=[availability],
+            ramp_up=[ramp_up],
+            ramp_down=[ramp_down],
+            prod_init=[prod_init],
+            up_reserve=[up_reserve],
+            down_reserve=[down_reserve],
+            up_reserve_offer=[up_reserve_offer],
+            down_reserve_offer=[down_reserve_offer],
+        )
 
-        unit = {
-            "Id": unit_id,
-            "Id node": node_id,
-            "Type": unit_type,
-            "Cost": cost,
-            "PMAX": pmax,
-            "PMIN": pmin,
-            "Availability": availability,
-            "Ramp up": ramp_up,
-            "Ramp down": ramp_down,
-            "Initial production": prod_init,
-            "Up reserve": up_reserve,
-            "Down reserve": down_reserve,
-            "Up reserve offer": up_reserve_offer,
-            "Down reserve offer": down_reserve_offer,
-            # "Production":
+    def add_units(
+        self,
+        unit_id: np.array,
+        node_id: np.array,
+        unit_type,
+        cost: np.array,
+        pmax: np.array,
+        pmin: np.array,
+        availability: np.array,
+        ramp_up: np.array,
+        ramp_down: np.array,
+        prod_init: np.array,
+        up_reserve: np.array,
+        down_reserve: np.array,
+        up_reserve_offer: np.array,
+        down_reserve_offer: np.array,
+    ):
+        """
+        Adds several units at once: same parameters as add_unit, given as arrays of
+        shape (nbNewUnits,), availability of shape (nbNewUnits, nbHour).
+        unit_type is either a str shared by all the new units or a list of str.
+        """
+        values = {
+            "unit_id": unit_id,
+            "node_id": node_id,
+            "cost": cost,
+            "pmax": pmax,
+            "pmin": pmin,
+            "ramp_up": ramp_up,
+            "ramp_down": ramp_down,
+            "prod_init": prod_init,
+            "up_reserve": up_reserve,
+            "down_reserve": down_reserve,
+            "up_reserve_offer": up_reserve_offer,
+            "down_reserve_offer": down_reserve_offer,
         }
+        availability = np.atleast_2d(np.asarray(availability, dtype=float))
+        nbNewUnits = availability.shape[0]
+
+        self.allocate(self.nbUnits + nbNewUnits, availability.shape[1])
+        new = slice(self.nbUnits, self.nbUnits + nbNewUnits)
+        for name, value in values.items():
+            self.data[name][new] = value
+        self.availability_data[new] = availability
+        if isinstance(unit_type, str):
+            unit_type = [unit_type] * nbNewUnits
+        self.unit_types.extend(unit_type)
+
+        self.nbUnits += nbNewUnits
+        self.units_view = None
 
-        self.units.append(unit)
+    def add_constructed_unit(self, unit: dict):
+        """
+        Adds a unit given as a dictionary (as in generation_units.units).
+        """
+        self.add_unit(
+            unit_type=unit["Type"],
+            availability=unit["Availability"],
+            **{name: unit[key] for name, key in self.columns.items()},
+        )
 
     def export_to_json(self):
         print("Export generation units data in a json file ...")
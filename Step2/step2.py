@@ -1,8 +1,27 @@
+import os
+import sys
 import pandas as pd
 import gurobipy as gp
 import numpy as np
+import scipy.sparse as sp
 from gurobipy import GRB
 
+# Modules shared by the steps (utils) are at the root of the repository
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.linearProgram import LinearProgram
+from utils.results import get_values, get_duals, get_objective, market_results
+from utils.cache import optimize, result_cache
+from utils.inputStore import load_input_store
+from utils.instrumentation import start_run
+
+# Phases of the run, recorded if INSTRUMENTATION_FILE is set (see utils.instrumentation)
+run_record = start_run("step2")
+
+# Inputs read from the columnar store of inputs/ (converted from the csv files at the first run)
+input_store = load_input_store()
+horizon = input_store.nbRows("load_profile")  # Number of hours of the inputs
+run_record.end_phase("inputs")
+
 # cd C:\Users\julia\OneDrive\DTU\course\S2\46755 - Renewables in Electricity Markets\Assignment1 - git
 
 ################################################################################
@@ -12,7 +31,7 @@ from gurobipy import GRB
 from scripts.generationUnits import GenerationUnits
 
 # Parameter units
-generationUnits_parameters = pd.read_csv("inputs/gen_parameters.csv", sep=";")
+generationUnits_parameters = input_store.table("gen_parameters")
 
 nodes = generationUnits_parameters["Node"].values
 costs = generationUnits_parameters["Ci"].values
@@ -38,7 +57,7 @@ for unit_id in range(nbUnitsConventionnal):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=[1] * 24,
+        availability=[1] * horizon,
         ramp_up=ramp_up[unit_id],
         ramp_down=ramp_down[unit_id],
         prod_init=prod_init[unit_id],
@@ -52,7 +71,7 @@ for unit_id in range(nbUnitsConventionnal):
 # Adding of the Wind Generation Units
 ################################################################################
 
-wind_parameters = pd.read_csv("inputs/wind_parameters.csv", index_col="Unit", sep=";")
+wind_parameters = input_store.table("wind_parameters", index_col="Unit")
 nodes = wind_parameters["Node"].values
 pmax = wind_parameters["Pmax"].values
 pmin = wind_parameters["Pmin"].values
@@ -62,11 +81,10 @@ scenario = "V1"  # scenario : from V1 to V100
 
 nbUnitsWind = wind_parameters.shape[0]
 nbUnits = nbUnitsConventionnal + nbUnitsWind
+wind_availability = input_store.scenarios("scen_zoneW", zones=range(nbUnitsWind), hours=horizon, scenarios=[scenario])[:, :, 0]
 for unit_id in range(nbUnitsWind):
 
-    availability = pd.read_csv(f"inputs/data/scen_zoneW{unit_id}.csv", sep=",")[
-        scenario
-    ].values.tolist()
+    availability = wind_availability[unit_id].tolist()
 
     generation_units.add_unit(
         unit_id=unit_id + nbUnitsConventionnal,
@@ -75,7 +93,7 @@ for unit_id in range(nbUnitsWind):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=availability[:24],
+        availability=availability,
         ramp_up=10000,  # big M, for no constraint on rampu_up
         ramp_down=0,
         prod_init=0,
@@ -94,14 +112,12 @@ for unit_id in range(nbUnitsWind):
 from scripts.loadUnits import LoadUnits
 
 # parameter load
-total_needed_demand = pd.read_csv("inputs/load_profile.csv", sep=";")[
+total_needed_demand = input_store.table("load_profile")[
     "total_demand"
 ].values
 nbHour = total_needed_demand.shape[0]
 
-load_location = pd.read_csv(
-    "inputs/load_location.csv", index_col="load_number", sep=";"
-)
+load_location = input_store.table("load_location", index_col="load_number")
 nodes = load_location["node"].values
 load_percentage = load_location["load_percentage"].values
 
@@ -118,6 +134,7 @@ for unit_id in range(nbLoadUnits):
 
 #load_units.export_to_json()
 
+run_record.end_phase("units")
 
 ################################################################################
 # Adding of the battery
@@ -135,7 +152,29 @@ delta_t = 1  # hour
 
 from scripts.plot_results import plot_results
 
-def step2_multiple_hours(show_plots:bool=False):
+def step2_multiple_hours(show_plots:bool=False, builder:str="scalar", solver:str="gurobi", use_cache:bool=False):
+    """
+    Clears the copper-plate day-ahead market over all the hours.
+
+    Parameters:
+        show_plots (bool): plot the dispatch and the clearing prices.
+        builder (str): "scalar" builds the model variable by variable (the
+            variables and constraints are named, Step5 relies on it), "matrix"
+            builds it from sparse matrices with step2_multiple_hours_matrix.
+        solver (str): "gurobi" or "highs", the latter with the matrix builder only.
+        use_cache (bool): with Gurobi, read the solution from the result cache (utils.cache)
+            if the same market was already cleared (off by default). On a hit the returned
+            model is not solved (no ObjVal, X or Pi, no basis):
+            read its solution with utils.results (get_values, get_duals, get_objective).
+    """
+    if builder == "matrix":
+        return step2_multiple_hours_matrix(show_plots=show_plots, solver=solver, use_cache=use_cache)
+    elif builder != "scalar":
+        raise ValueError(f"Unknown builder '{builder}', use 'scalar' or 'matrix'.")
+    elif solver != "gurobi":
+        raise ValueError("The scalar builder only runs with Gurobi, use builder='matrix'.")
+    run_record.start_phase("step2_multiple_hours", profile=True)
+
     m = gp.Model()
 
     # Variables
@@ -247,60 +286,594 @@ def step2_multiple_hours(show_plots:bool=False):
     ]
     m.addConstr(state_of_charge[0] == value_init )# - (power_injected[0]/efficiency  - power_drawn[0]*efficiency))
     m.addConstr(value_init - state_of_charge[-1] <= 0)
+    run_record.end_phase("build", m)
 
-    m.optimize()
+    optimize(m, result_cache if use_cache else None)
+    run_record.end_phase("solve", m)
 
     ################################################################################
     # Results
     ################################################################################
 
-    clearing_price = [balance_constraint[t].Pi for t in range(nbHour)]
-    clearing_price_values = [
-        price_item.flatten()[0] for price_item in clearing_price
-    ]  # remove the array values
-
-    profit = [
-        [
-            production[t][g].X * (clearing_price[t] - generation_units.units[g]["Cost"])
-            for g in range(nbUnits)
-        ]
-        for t in range(nbHour)
-    ]
-
-    demand_unsatisfied = [
-        total_needed_demand[t] - np.sum(demand_supplied[t][l].X for l in range(nbLoadUnits))
-        for t in range(nbHour)
-    ]
+    # One getAttr call per block of variables or constraints
+    clearing_price_values = get_duals(m, balance_constraint)
+    production_values = get_values(m, production)  # shape (nbHour, nbUnits)
+    demand_supplied_values = get_values(m, demand_supplied)  # shape (nbHour, nbLoadUnits)
+
+    results = market_results(
+        production_values,
+        demand_supplied_values,
+        clearing_price_values,
+        generation_units.cost,
+        total_needed_demand,
+        get_values(m, power_injected),
+        get_values(m, power_drawn),
+        get_values(m, state_of_charge),
+        max_SoC,
+    )
+    profit = results[[f"PU profit {g+1} ($)" for g in range(nbUnits)]].values
+    demand_unsatisfied = results["Demand unsatisfied"].values
 
-    print(f"Optimal objective value: {m.objVal} $")
+    print(f"Optimal objective value: {get_objective(m)} $")
     for t in range(nbHour):
         print('\n')
         for g in range(nbUnits):
             print(
-                f"p_{g+1} for hour {t+1}: production: {round(production[t][g].X,2)} MW, profit: {round(profit[t][g],2)} $"
+                f"p_{g+1} for hour {t+1}: production: {round(production_values[t, g],2)} MW, profit: {round(profit[t, g],2)} $"
             )
         print(f"clearing price for hour {t+1}:", round(clearing_price_values[t],2))
-    print("clearing price:", clearing_price_values,2)
-    print("demand unsatisfied:", demand_unsatisfied,2)
-    print("SoC:", state_of_charge.X)
+    print("clearing price:", clearing_price_values.tolist(),2)
+    print("demand unsatisfied:", demand_unsatisfied.tolist(),2)
+    print("SoC:", get_values(m, state_of_charge))
+    run_record.end_phase("extract")
 
-    results = pd.DataFrame()
-    results["Hour"] = np.arange(nbHour)
-    for g in range(nbUnits):
-        results[f"PU production {g+1} (GW)"] = [production[t][g].X for t in range(nbHour)]
-        results[f"PU profit {g+1} ($)"] = [profit[t][g] for t in range(nbHour)]
-    results["Clearing price"] = clearing_price_values
-    results["Demand"] = total_needed_demand
-    results["Demand satisfied"] = total_needed_demand - demand_unsatisfied
-    results["Demand unsatisfied"] = demand_unsatisfied
-    results["Battery production"] = - power_injected.X + power_drawn.X
-    results["State of charge"] = state_of_charge.X / max_SoC
-    results["Battery profit"] = -results["Clearing price"] * results["Battery production"]
+    if show_plots:
+        plot_results(nbUnits=nbUnits, results=results)
+        run_record.end_phase("plot")
+
+    return m
+
+
+def build_step2_linear_program(nbHour:int=nbHour) -> LinearProgram:
+    """
+    Matrix form of the day-ahead market (see step2_multiple_hours_matrix), independent of the solver.
+
+    The blocks of variables are "production" (nbHour, nbUnits), "demand supplied"
+    (nbHour, nbLoadUnits), "state of charge", "power injected" and "power drawn" (nbHour,),
+    in this order. The blocks of constraints are "GenerationBalance" (one per hour, its duals
+    are the clearing prices), "RampUp", "RampDown" and "Battery".
+
+    nbHour: number of hours of the market, the ones of the inputs by default (fewer hours
+    keep the first ones of the inputs, e.g. for the windows of step2_rolling_horizon).
+    """
+    lp = LinearProgram(sense="max")
+
+    # Parameters of the units as arrays
+    cost = generation_units.cost
+    max_production = generation_units.get_max_production()[:, :nbHour].T  # shape (nbHour, nbUnits)
+    ramp_up_units = generation_units.ramp_up
+    ramp_down_units = generation_units.ramp_down
+    prod_init_units = generation_units.prod_init
+    bid_price = np.array([unit["Bid price"] for unit in load_units.units], dtype=float)
+    needed_demand = np.array([unit["Needed demand"] for unit in load_units.units], dtype=float).T[:nbHour]  # shape (nbHour, nbLoadUnits)
+
+    # Variables
+    id_production = lp.add_variables("production", (nbHour, nbUnits), ub=max_production, obj=-cost)  # generation units have a P_max
+    id_demand = lp.add_variables("demand supplied", (nbHour, nbLoadUnits), ub=needed_demand, obj=bid_price)  # Cannot supply more than necessary
+    id_soc = lp.add_variables("state of charge", (nbHour,), lb=min_SoC, ub=max_SoC)
+    id_injected = lp.add_variables("power injected", (nbHour,), ub=P_max)
+    id_drawn = lp.add_variables("power drawn", (nbHour,), ub=P_max)
+
+    # Constraints
+    hours = sp.identity(nbHour, format="csr")
+
+    # Supplied demand match generation (one row per hour)
+    lp.add_constraints(
+        "GenerationBalance",
+        [
+            (sp.kron(hours, np.ones((1, nbLoadUnits))), id_demand),
+            (hours, id_drawn),
+            (sp.kron(hours, -np.ones((1, nbUnits))), id_production),
+            (-hours, id_injected),
+        ],
+        "=",
+        0,
+    )
+
+    # Ramp-up and ramp-down constraint (one row per hour and unit):
+    # production[t] - production[t-1] <= ramp up, >= - ramp down, with production[-1] = initial production
+    difference = sp.kron(sp.identity(nbHour) - sp.eye(nbHour, k=-1), sp.identity(nbUnits), format="csr")
+    rhs_ramp_up = np.tile(ramp_up_units, nbHour)
+    rhs_ramp_up[:nbUnits] += prod_init_units
+    rhs_ramp_down = -np.tile(ramp_down_units, nbHour)
+    rhs_ramp_down[:nbUnits] += prod_init_units
+    lp.add_constraints("RampUp", [(difference, id_production)], "<", rhs_ramp_up)
+    lp.add_constraints("RampDown", [(difference, id_production)], ">", rhs_ramp_down)
+
+    # Battery constraints: nbHour - 1 rows for the SoC update, then SoC[0] == value_init and SoC[-1] >= value_init
+    update = sp.eye(nbHour - 1, nbHour, k=1)
+    soc = sp.vstack([update - sp.eye(nbHour - 1, nbHour), sp.eye(1, nbHour, k=0), sp.eye(1, nbHour, k=nbHour - 1)])
+    empty = sp.csr_matrix((2, nbHour))
+    lp.add_constraints(
+        "Battery",
+        [
+            (soc, id_soc),
+            (sp.vstack([update * (delta_t / efficiency), empty]), id_injected),
+            (sp.vstack([update * (-delta_t * efficiency), empty]), id_drawn),
+        ],
+        np.array(["="] * nbHour + [">"]),
+        np.concatenate([np.zeros(nbHour - 1), [value_init, value_init]]),
+    )
+    return lp
+
+def build_step2_matrix_model(nbHour:int=nbHour):
+    """
+    Builds, without solving it, the Gurobi model of build_step2_linear_program.
+
+    Returns:
+        m (gp.Model): the model, the battery constraints are in m._battery_constraint,
+            the ramp constraints in m._ramp_up_constraint and m._ramp_down_constraint.
+        x (MVar): all the variables.
+        indices (dict): position in x of "production" (nbHour, nbUnits),
+            "demand supplied" (nbHour, nbLoadUnits), "state of charge",
+            "power injected" and "power drawn" (nbHour,).
+        balance_constraint (MConstr): one balance per hour, its duals are the clearing prices.
+    """
+    lp = build_step2_linear_program(nbHour)
+    m, x, constraints = lp.to_gurobi()
+    m._battery_constraint = constraints["Battery"]
+    m._ramp_up_constraint = constraints["RampUp"]
+    m._ramp_down_constraint = constraints["RampDown"]
+    return m, x, lp.variables, constraints["GenerationBalance"]
+
+
+def step2_matrix_results(
+        solution:np.array,
+        indices:dict,
+        clearing_price_values:np.array,
+        total_demand:np.array=None,
+        battery_capacity:float=None,
+    ) -> pd.DataFrame:
+    """
+    Results of a solved matrix model, with the same columns as in step2_multiple_hours.
+    solution holds the values of all the variables (x.X), clearing_price_values the duals
+    of the balance constraints. total_demand and battery_capacity default to the ones of
+    the input files.
+    """
+    if total_demand is None:
+        total_demand = total_needed_demand
+    if battery_capacity is None:
+        battery_capacity = max_SoC
+    return market_results(
+        solution[indices["production"]],
+        solution[indices["demand supplied"]],
+        clearing_price_values,
+        generation_units.cost,
+        total_demand,
+        solution[indices["power injected"]],
+        solution[indices["power drawn"]],
+        solution[indices["state of charge"]],
+        battery_capacity,
+    )
+
+
+def step2_multiple_hours_matrix(show_plots:bool=False, solver:str="gurobi", use_cache:bool=False):
+    """
+    Matrix form of step2_multiple_hours: same market, same objective value and
+    same clearing prices.
+
+    All the variables are stored in a single vector, ordered as
+    [production (t, g), demand supplied (t, l), state of charge (t),
+    power injected (t), power drawn (t)], and each block of constraints is
+    assembled as a scipy sparse matrix (build_step2_linear_program).
+    The build time therefore does not grow with Python loops over hours and units.
+
+    Parameters:
+        solver (str): "gurobi" (returns the gp.Model) or "highs" (no licence needed,
+            returns the LinearProgramSolution).
+        use_cache (bool): with Gurobi, see step2_multiple_hours.
+    """
+    run_record.start_phase("step2_multiple_hours_matrix", profile=True)
+    if solver == "gurobi":
+        m, x, indices, balance_constraint = build_step2_matrix_model()
+        run_record.end_phase("build", m)
+        optimize(m, result_cache if use_cache else None)
+        run_record.end_phase("solve", m)
+        objective = get_objective(m)
+        results = step2_matrix_results(get_values(m, x), indices, get_duals(m, balance_constraint))
+    else:
+        lp = build_step2_linear_program()
+        run_record.end_phase("build", lp)
+        m = lp.solve(solver)
+        run_record.end_phase("solve", m)
+        objective = m.objective
+        results = step2_matrix_results(m.x, lp.variables, m.get_duals("GenerationBalance"))
+
+    print(f"Optimal objective value: {objective} $")
+    print("clearing price:", results["Clearing price"].values)
+    print("demand unsatisfied:", results["Demand unsatisfied"].values)
+    run_record.end_phase("extract")
 
     if show_plots:
         plot_results(nbUnits=nbUnits, results=results)
+        run_record.end_phase("plot")
 
     return m
 
-step2_multiple_hours(show_plots=True)
 
+################################################################################
+# Reusable market model
+################################################################################
+
+class Step2Market:
+    """
+    Day-ahead market of build_step2_matrix_model, built once and updated in place.
+
+    The setters only change bounds, right-hand sides and objective coefficients,
+    so solve() re-optimises from the basis of the previous solve (warm start)
+    instead of building a new model for every what-if run:
+
+        market = Step2Market()
+        market.set_demand(1.1 * total_needed_demand)
+        market.set_wind_availability(wind_availability)
+        results = market.solve()
+
+    nbHour: number of hours of the market, see build_step2_linear_program.
+    """
+
+    def __init__(self, output_flag:int=0, nbHour:int=nbHour):
+        self.nbHour = nbHour
+        self.m, self.x, self.indices, self.balance_constraint = build_step2_matrix_model(nbHour)
+        self.m.Params.OutputFlag = output_flag
+        self.battery_constraint = self.m._battery_constraint
+        self.ramp_up_constraint = self.m._ramp_up_constraint
+        self.ramp_down_constraint = self.m._ramp_down_constraint
+
+        self.production = self.x[self.indices["production"].ravel()]
+        self.wind_production = self.x[self.indices["production"][:, nbUnitsConventionnal:].ravel()]
+        self.demand_supplied = self.x[self.indices["demand supplied"].ravel()]
+        self.state_of_charge = self.x[self.indices["state of charge"]]
+        self.power_injected = self.x[self.indices["power injected"]]
+        self.power_drawn = self.x[self.indices["power drawn"]]
+
+        self.load_share = np.array([unit["Load percentage"] for unit in load_units.units]) / 100
+        self.total_demand = total_needed_demand[:nbHour].astype(float)
+        self.battery_capacity = max_SoC
+
+    def set_demand(self, demand:np.array):
+        """
+        demand: total demand of shape (nbHour,), shared between the loads as in
+        load_location.csv, or the demand of each load of shape (nbHour, nbLoadUnits).
+        """
+        demand = np.asarray(demand, dtype=float)
+        if demand.ndim == 1:
+            demand = demand[:, None] * self.load_share[None, :]
+        self.demand_supplied.UB = demand.ravel()
+        self.total_demand = demand.sum(axis=1)
+
+    def set_bid_prices(self, bid_prices):
+        """
+        bid_prices: one price for all the loads, one per load (nbLoadUnits,)
+        or one per load and hour (nbHour, nbLoadUnits).
+        """
+        self.demand_supplied.Obj = np.broadcast_to(bid_prices, (self.nbHour, nbLoadUnits)).ravel()
+
+    def set_offer_prices(self, offer_prices:np.array):
+        """
+        offer_prices: production cost of each unit (nbUnits,).
+        """
+        self.production.Obj = -np.tile(offer_prices, self.nbHour)
+
+    def set_wind_availability(self, availability:np.array):
+        """
+        availability: availability of the wind farms, shape (nbUnitsWind, nbHour).
+        """
+        wind_pmax = generation_units.pmax[nbUnitsConventionnal:]
+        self.wind_production.UB = (wind_pmax[:, None] * availability[:, :self.nbHour]).T.ravel()
+
+    def set_battery(self, capacity:float=None, power:float=None, initial_state_of_charge:float=None):
+        """
+        Changes the capacity (MWh), the charging and discharging power (MW) and the
+        initial (and final minimum) state of charge of the battery.
+        """
+        if capacity is not None:
+            self.state_of_charge.UB = capacity
+            self.battery_capacity = capacity
+        if power is not None:
+            self.power_injected.UB = power
+            self.power_drawn.UB = power
+        if initial_state_of_charge is not None:
+            self.battery_constraint[self.nbHour - 1:].RHS = initial_state_of_charge
+
+    def solve(self) -> pd.DataFrame:
+        """
+        Re-optimises the model and returns the results as in step2_multiple_hours.
+        Raises a RuntimeError if the model has no optimal solution (e.g. infeasible).
+        """
+        self.m.optimize()
+        if self.m.Status != GRB.OPTIMAL:
+            raise RuntimeError(f"The market has no optimal solution (status {self.m.Status}).")
+        return step2_matrix_results(
+            self.x.X, self.indices, self.balance_constraint.Pi, self.total_demand, self.battery_capacity
+        )
+
+
+################################################################################
+# Day-ahead solution
+################################################################################
+
+def read_day_ahead_solution(m:gp.Model) -> dict:
+    """
+    Reads the solution of step2_multiple_hours (scalar builder, named variables and constraints) with getAttr.
+
+    Returns:
+        dict: "production" (nbHour, nbUnits), "demand" (supplied demand, (nbHour, nbLoadUnits))
+        and "clearing price" (nbHour,).
+    """
+    production = get_values(m, [
+        [m.getVarByName(f'production of generator {g} at time {t}') for g in range(nbUnits)] for t in range(nbHour)
+    ])
+    demand = get_values(m, [
+        [m.getVarByName(f'Supplied demand to load {l} at time {t}') for l in range(nbLoadUnits)] for t in range(nbHour)
+    ])
+    clearing_price = get_duals(m, [m.getConstrByName(f'GenerationBalance_{t}') for t in range(nbHour)])
+    return {"production": production, "demand": demand, "clearing price": clearing_price}
+
+# Solution of the day-ahead market, kept by get_day_ahead_solution for the process
+day_ahead_solution = None
+
+def get_day_ahead_solution(use_cache:bool=False) -> dict:
+    """
+    Returns the solution of the day-ahead market (see read_day_ahead_solution), for
+    the balancing and reserve steps. The market is cleared at most once per process.
+
+    Parameters:
+        use_cache (bool): read the solution from the result cache (utils.cache), keyed by
+            the whole model, so that the next runs on the same inputs do not clear the
+            market at all, see step2_multiple_hours.
+    """
+    global day_ahead_solution
+    if day_ahead_solution is None:
+        day_ahead_solution = read_day_ahead_solution(step2_multiple_hours(show_plots=False, use_cache=use_cache))
+    return day_ahead_solution
+
+################################################################################
+# Wind scenario sweep
+################################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+
+def read_wind_scenarios(scenarios:list=None):
+    """
+    Reads the wind scenarios of all the wind farms.
+
+    Parameters:
+        scenarios (list of str): columns to read, all of them (V1 to V100) by default.
+
+    Returns:
+        scenarios (list of str)
+        wind_availability (np.array): shape (nbScenarios, nbUnitsWind, nbHour).
+    """
+    if scenarios is None:
+        scenarios = input_store.scenario_names("scen_zoneW")
+    wind_availability = input_store.scenarios(
+        "scen_zoneW", zones=range(nbUnitsWind), hours=nbHour, scenarios=scenarios
+    ).transpose(2, 0, 1)
+    return scenarios, wind_availability
+
+# Built once per worker process by init_sweep_worker
+sweep_market = None
+sweep_wind_availability = None
+
+def init_sweep_worker(wind_availability:np.array):
+    """
+    Builds the market of a worker and keeps the wind scenarios it will clear.
+    """
+    global sweep_market, sweep_wind_availability
+    sweep_market = Step2Market()
+    sweep_wind_availability = wind_availability
+
+def clear_wind_scenario(scenario_index:int):
+    """
+    Clears the day-ahead market of one scenario on the market of the worker:
+    only the upper bounds of the wind production are changed.
+
+    Returns:
+        welfare (float), clearing prices (nbHour,), production (nbHour, nbUnits),
+        demand satisfied (nbHour,), battery production (nbHour,) and state of charge (nbHour,)
+    """
+    sweep_market.set_wind_availability(sweep_wind_availability[scenario_index])
+    sweep_market.m.optimize()
+
+    indices = sweep_market.indices
+    solution = sweep_market.x.X
+    return (
+        sweep_market.m.ObjVal,
+        sweep_market.balance_constraint.Pi,
+        solution[indices["production"]],
+        solution[indices["demand supplied"]].sum(axis=1),
+        solution[indices["power drawn"]] - solution[indices["power injected"]],
+        solution[indices["state of charge"]],
+    )
+
+def step2_scenario_sweep(scenarios:list=None, max_workers:int=None) -> pd.DataFrame:
+    """
+    Clears the day-ahead market of step2_multiple_hours for every wind scenario,
+    in a pool of processes. Each worker builds the model once and only changes
+    the wind availability from one scenario to the next.
+
+    Parameters:
+        scenarios (list of str): scenarios to clear, all of them (V1 to V100) by default.
+        max_workers (int): number of processes, the number of CPUs by default.
+
+    Returns:
+        pd.DataFrame: indexed by (Scenario, Hour), with the social welfare of the
+        scenario, the clearing price, the production of each unit, the demand
+        satisfied, the battery production and the state of charge.
+    """
+    run_record.start_phase("step2_scenario_sweep")
+    scenarios, wind_availability = read_wind_scenarios(scenarios)
+    run_record.end_phase("inputs")
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(scenarios) // (4 * max_workers))
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_sweep_worker,
+        initargs=(wind_availability,),
+    ) as executor:
+        solutions = list(executor.map(clear_wind_scenario, range(len(scenarios)), chunksize=chunksize))
+    run_record.end_phase("solve")
+
+    # shapes (nbScenarios,), (nbScenarios, nbHour), (nbScenarios, nbHour, nbUnits), ...
+    welfare, clearing_price, production, demand_satisfied, battery_production, state_of_charge = (
+        np.array(values) for values in zip(*solutions)
+    )
+
+    columns = {"Social welfare": np.repeat(welfare, nbHour), "Clearing price": clearing_price.ravel()}
+    for g in range(nbUnits):
+        columns[f"PU production {g+1} (GW)"] = production[:, :, g].ravel()
+    columns["Demand satisfied"] = demand_satisfied.ravel()
+    columns["Battery production"] = battery_production.ravel()
+    columns["State of charge"] = state_of_charge.ravel() / max_SoC
+    index = pd.MultiIndex.from_product([scenarios, range(nbHour)], names=["Scenario", "Hour"])
+    results = pd.DataFrame(columns, index=index)
+    run_record.end_phase("extract")
+    return results
+
+################################################################################
+# Rolling horizon
+################################################################################
+
+class RollingWindowMarket(Step2Market):
+    """
+    Step2Market of one window of step2_rolling_horizon.
+
+    The initial conditions are the state at the end of the hour before the window:
+    the ramps of the first hour of the conventional units start from their production
+    in that hour, and the state of charge of the first hour follows the battery actions
+    of the hour from the state of charge carried forward (in Step2Market, the state of
+    charge of the first hour is fixed). The wind farms start from their initial
+    production (0), as their ramp-down limit of 0 would otherwise keep them from
+    following a decreasing availability from one window to the next. At the end of the window, the state of charge must still be at least
+    value_init, so that a window does not empty the battery of the next ones.
+    """
+
+    def __init__(self, window:int=nbHour, output_flag:int=0):
+        super().__init__(output_flag=output_flag, nbHour=window)
+        first_hour = self.battery_constraint[window - 1].item()
+        self.m.chgCoeff(first_hour, self.power_injected[0].item(), delta_t / efficiency)
+        self.m.chgCoeff(first_hour, self.power_drawn[0].item(), -delta_t * efficiency)
+
+    def set_initial_state(self, production:np.array, state_of_charge:float):
+        """
+        production: production of the conventional units (nbUnitsConventionnal,) in the hour before the window.
+        state_of_charge: state of charge of the battery (MWh) at the end of this hour.
+        """
+        self.ramp_up_constraint[:nbUnitsConventionnal].RHS = generation_units.ramp_up[:nbUnitsConventionnal] + production
+        self.ramp_down_constraint[:nbUnitsConventionnal].RHS = production - generation_units.ramp_down[:nbUnitsConventionnal]
+        self.battery_constraint[self.nbHour - 1].item().RHS = state_of_charge
+
+def read_year_profiles(nbHours:int=8760, scenario:str="V1"):
+    """
+    Total demand and wind availability over nbHours hours: the ones of the inputs
+    if they are long enough (e.g. a year of a grid of utils.syntheticGrid), with the
+    given wind scenario. Otherwise, the load profile of the inputs is repeated, with
+    the wind scenarios in turn (V1 the first day, V2 the second day, ...).
+
+    Returns:
+        demand (np.array): shape (nbHours,).
+        wind_availability (np.array): shape (nbUnitsWind, nbHours).
+    """
+    if nbHour >= nbHours:
+        wind_availability = input_store.scenarios(
+            "scen_zoneW", zones=range(nbUnitsWind), hours=nbHours, scenarios=[scenario]
+        )[:, :, 0]
+        return total_needed_demand[:nbHours].astype(float), wind_availability
+
+    nbDays = -(-nbHours // nbHour)
+    demand = np.tile(total_needed_demand.astype(float), nbDays)[:nbHours]
+    daily_availability = input_store.scenarios("scen_zoneW", zones=range(nbUnitsWind), hours=nbHour)  # (nbUnitsWind, nbHour, nbScenarios)
+    day_scenario = np.arange(nbDays) % daily_availability.shape[2]
+    wind_availability = daily_availability[:, :, day_scenario].transpose(0, 2, 1).reshape(nbUnitsWind, -1)[:, :nbHours]
+    return demand, wind_availability
+
+def step2_rolling_horizon(
+        output_file:str="rolling_horizon.csv",
+        demand:np.array=None,
+        wind_availability:np.array=None,
+        nbHours:int=8760,
+        window:int=nbHour,
+        step:int=None,
+        output_flag:int=0,
+    ) -> pd.DataFrame:
+    """
+    Clears the day-ahead market of a long horizon (a year by default) in overlapping windows.
+
+    Each window of `window` hours is cleared by a RollingWindowMarket, built once and
+    re-optimised from the basis of the previous window. Only the first `step` hours of a
+    window are kept: the production of the conventional units and the state of charge of
+    the last of them are the initial conditions of the next window, which starts `step` hours later. The last windows
+    run past the horizon on its first hours. The kept hours are appended to output_file,
+    so that the memory does not grow with the horizon.
+
+    Parameters:
+        output_file (str): csv file (overwritten) of the results, one row per hour with the
+            columns of step2_multiple_hours, the hour of the horizon and the window.
+        demand (np.array): total demand, shape (nbHours,), read_year_profiles by default.
+        wind_availability (np.array): shape (nbUnitsWind, nbHours), read_year_profiles by default.
+        nbHours (int): number of hours of the horizon, without demand.
+        window (int): number of hours of a window, at most the ones of the inputs.
+        step (int): number of hours kept from each window, window // 2 by default.
+
+    Returns:
+        pd.DataFrame: one row per window, with its first hour, its objective value,
+        the solve time (s) and the simplex iterations.
+    """
+    if window > nbHour:
+        raise ValueError(f"A window has at most the {nbHour} hours of the inputs.")
+    step = step or max(window // 2, 1)
+    if not 1 <= step <= window:
+        raise ValueError("The step must be between 1 and the window.")
+    run_record.start_phase("step2_rolling_horizon")
+    if demand is None:
+        demand, default_availability = read_year_profiles(nbHours)
+        wind_availability = default_availability if wind_availability is None else wind_availability
+    demand = np.asarray(demand, dtype=float)
+    nbHours = demand.shape[0]
+    if wind_availability is None:
+        wind_availability = read_year_profiles(nbHours)[1]
+    wind_availability = np.asarray(wind_availability, dtype=float)[:, :nbHours]
+    demand = np.concatenate([demand, np.resize(demand, window)])
+    wind_availability = np.concatenate([wind_availability, np.resize(wind_availability, (nbUnitsWind, window))], axis=1)
+    run_record.end_phase("inputs")
+
+    run_record.start_phase("step2_rolling_horizon", profile=True)
+    market = RollingWindowMarket(window, output_flag)
+    run_record.end_phase("build", market.m)
+
+    production = generation_units.prod_init[:nbUnitsConventionnal].astype(float)
+    state_of_charge = value_init
+    summary = []
+    for window_index, start in enumerate(range(0, nbHours, step)):
+        market.set_demand(demand[start:start + window])
+        market.set_wind_availability(wind_availability[:, start:start + window])
+        market.set_initial_state(production, state_of_charge)
+        try:
+            results = market.solve()
+        except RuntimeError as error:
+            raise RuntimeError(f"The window starting at hour {start} has no optimal solution (status {market.m.Status}).") from error
+
+        kept = min(step, nbHours - start)
+        production = market.production.X.reshape(window, nbUnits)[kept - 1, :nbUnitsConventionnal]
+        state_of_charge = market.state_of_charge.X[kept - 1]
+        results = results.iloc[:kept]
+        results.insert(0, "Window", window_index)
+        results["Hour"] += start
+        results.to_csv(output_file, mode="a" if window_index else "w", header=not window_index, index=False)
+        summary.append((start, market.m.ObjVal, market.m.Runtime, market.m.IterCount))
+    run_record.end_phase("solve", market.m)
+
+    return pd.DataFrame(summary, columns=["Start hour", "Objective", "Solve time (s)", "Iterations"])
+
+if __name__ == "__main__":
+    step2_multiple_hours(show_plots=True)
@@ -0,0 +1,327 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import gurobipy as gp
+from gurobipy import GRB
+
+from step2 import (
+    build_step2_matrix_model,
+    step2_matrix_results,
+    read_wind_scenarios,
+    generation_units,
+    nbHour,
+    nbUnitsConventionnal,
+    nbUnitsWind,
+    nbLoadUnits,
+)
+
+################################################################################
+# Balancing bids (as in Step5)
+################################################################################
+load_curtailment_cost = 400 # Demand curtailment cost: 400$/MWh
+coef_up_regulation = 0.1
+coef_down_regulation = 0.13
+
+################################################################################
+# Second stage
+################################################################################
+
+def build_recourse(indices:dict, nbFirstStage:int) -> dict:
+    """
+    Second stage (real-time balancing) problem of one scenario. Its matrices are
+    the same for all the scenarios, only the wind availability changes:
+
+        min cost @ y
+        W_eq @ y + T_eq @ x == h_eq   (real-time balance, one row per hour)
+        W_in @ y + T_in @ x <= h_in   (up regulation <= P_max - production,
+                                       down regulation <= production,
+                                       load shedding <= supplied demand)
+        lb <= y <= ub
+
+    x are the day-ahead (first stage) variables of build_step2_matrix_model and
+    y = [up regulation (t, g), down regulation (t, g), wind production (t, w),
+    load shedding (t, l)] for the conventional units g and the wind farms w.
+    The upper bound of the wind production is left to the scenarios (np.inf).
+    """
+    hours = np.arange(nbHour)
+    conventional = slice(0, nbUnitsConventionnal)
+    id_production = indices["production"][:, conventional]
+    id_wind_schedule = indices["production"][:, nbUnitsConventionnal:]
+    id_demand = indices["demand supplied"]
+
+    id_up = np.arange(nbHour * nbUnitsConventionnal).reshape(nbHour, nbUnitsConventionnal)
+    id_down = id_up.size + id_up
+    id_wind = 2 * id_up.size + np.arange(nbHour * nbUnitsWind).reshape(nbHour, nbUnitsWind)
+    id_shed = 2 * id_up.size + id_wind.size + np.arange(nbHour * nbLoadUnits).reshape(nbHour, nbLoadUnits)
+    nbSecondStage = id_shed[-1, -1] + 1
+
+    cost = generation_units.cost[conventional]
+    costs = np.zeros(nbSecondStage)
+    costs[id_up] = cost * (1 + coef_up_regulation)
+    costs[id_down] = - cost * (1 - coef_down_regulation)
+    costs[id_shed] = load_curtailment_cost
+
+    lb = np.zeros(nbSecondStage)
+    ub = np.full(nbSecondStage, np.inf)
+    ub[id_up] = generation_units.up_reserve[conventional]
+    ub[id_down] = generation_units.down_reserve[conventional]
+
+    # Real-time balance: up - down + wind + shedding - scheduled wind == 0
+    rows = np.concatenate([
+        np.repeat(hours, nbUnitsConventionnal),
+        np.repeat(hours, nbUnitsConventionnal),
+        np.repeat(hours, nbUnitsWind),
+        np.repeat(hours, nbLoadUnits),
+    ])
+    cols = np.concatenate([id_up.ravel(), id_down.ravel(), id_wind.ravel(), id_shed.ravel()])
+    data = np.concatenate([np.ones(id_up.size), -np.ones(id_down.size), np.ones(id_wind.size + id_shed.size)])
+    W_eq = sp.csr_matrix((data, (rows, cols)), shape=(nbHour, nbSecondStage))
+    rows = np.repeat(hours, nbUnitsWind)
+    T_eq = sp.csr_matrix(
+        (-np.ones(id_wind_schedule.size), (rows, id_wind_schedule.ravel())), shape=(nbHour, nbFirstStage)
+    )
+    h_eq = np.zeros(nbHour)
+
+    # Up regulation, down regulation and load shedding limits, one row per (t, g), (t, g) and (t, l)
+    rows = np.arange(2 * id_up.size + id_shed.size)
+    cols = np.concatenate([id_up.ravel(), id_down.ravel(), id_shed.ravel()])
+    W_in = sp.csr_matrix((np.ones(rows.size), (rows, cols)), shape=(rows.size, nbSecondStage))
+    cols = np.concatenate([id_production.ravel(), id_production.ravel(), id_demand.ravel()])
+    data = np.concatenate([np.ones(id_production.size), -np.ones(id_production.size + id_demand.size)])
+    T_in = sp.csr_matrix((data, (rows, cols)), shape=(rows.size, nbFirstStage))
+    h_in = np.concatenate([
+        generation_units.get_max_production()[conventional, :nbHour].T.ravel(),
+        np.zeros(id_production.size + id_demand.size),
+    ])
+
+    return {
+        "W_eq": W_eq, "T_eq": T_eq, "h_eq": h_eq,
+        "W_in": W_in, "T_in": T_in, "h_in": h_in,
+        "cost": costs, "lb": lb, "ub": ub,
+        "wind": id_wind,
+    }
+
+def wind_upper_bounds(wind_availability:np.array) -> np.array:
+    """
+    Upper bounds of the real-time wind production, shape (nbScenarios, nbHour * nbUnitsWind).
+    """
+    wind_pmax = generation_units.pmax[nbUnitsConventionnal:]
+    return (wind_pmax[None, :, None] * wind_availability).transpose(0, 2, 1).reshape(len(wind_availability), -1)
+
+def sample_scenarios(nbScenarios:int=None, seed:int=None) -> list:
+    """
+    All the scenarios (V1 to V100), or nbScenarios of them drawn without replacement.
+    """
+    scenarios, _ = read_wind_scenarios()
+    if nbScenarios is None:
+        return scenarios
+    rng = np.random.default_rng(seed)
+    return sorted(rng.choice(scenarios, size=nbScenarios, replace=False).tolist(), key=lambda s: int(s[1:]))
+
+def build_first_stage():
+    """
+    Day-ahead model of build_step2_matrix_model, where the wind farms can sell up
+    to their capacity: the wind availability is only known in the second stage.
+    """
+    m, x, indices, balance_constraint = build_step2_matrix_model()
+    x[indices["production"][:, nbUnitsConventionnal:].ravel()].UB = np.tile(
+        generation_units.pmax[nbUnitsConventionnal:], nbHour
+    )
+    return m, x, indices, balance_constraint
+
+################################################################################
+# Extensive form
+################################################################################
+
+def step2_stochastic_extensive(scenarios:list=None):
+    """
+    Two-stage stochastic day-ahead clearing, solved as one LP (extensive form).
+
+    The day-ahead dispatch is the first stage and each wind scenario (equally
+    likely) has its own real-time balancing as second stage. The blocks of the
+    scenarios are stacked with sparse Kronecker products, without Python loops
+    over the scenarios.
+
+    Returns:
+        m (gp.Model): the solved model.
+        results (pd.DataFrame): day-ahead results, as in step2_multiple_hours.
+        real_time_prices (pd.DataFrame): balancing prices, one row per scenario.
+    """
+    scenarios, wind_availability = read_wind_scenarios(scenarios)
+    nbScenarios = len(scenarios)
+    probability = 1 / nbScenarios
+
+    m, x, indices, balance_constraint = build_first_stage()
+    recourse = build_recourse(indices, x.shape[0])
+    nbSecondStage = recourse["cost"].size
+
+    ub = np.tile(recourse["ub"], (nbScenarios, 1))
+    ub[:, recourse["wind"].ravel()] = wind_upper_bounds(wind_availability)
+    y = m.addMVar(
+        shape=(nbScenarios * nbSecondStage,),
+        lb=np.tile(recourse["lb"], nbScenarios),
+        ub=ub.ravel(),
+        obj=- probability * np.tile(recourse["cost"], nbScenarios),  # expected balancing cost
+        name="y",
+        vtype=GRB.CONTINUOUS,
+    )
+
+    scenario_blocks = sp.identity(nbScenarios, format="csr")
+    all_scenarios = sp.csr_matrix(np.ones((nbScenarios, 1)))
+    real_time_balance = m.addConstr(
+        sp.kron(scenario_blocks, recourse["W_eq"], format="csr") @ y
+        + sp.kron(all_scenarios, recourse["T_eq"], format="csr") @ x
+        == np.tile(recourse["h_eq"], nbScenarios),
+        name="real_time_balance",
+    )
+    m.addConstr(
+        sp.kron(scenario_blocks, recourse["W_in"], format="csr") @ y
+        + sp.kron(all_scenarios, recourse["T_in"], format="csr") @ x
+        <= np.tile(recourse["h_in"], nbScenarios),
+        name="real_time_limits",
+    )
+
+    m.optimize()
+
+    results = step2_matrix_results(x.X, indices, balance_constraint.Pi)
+    real_time_prices = pd.DataFrame(
+        - real_time_balance.Pi.reshape(nbScenarios, nbHour) / probability, index=scenarios
+    )
+    return m, results, real_time_prices
+
+################################################################################
+# L-shaped (Benders) decomposition
+################################################################################
+
+def step2_stochastic_benders(scenarios:list=None, tolerance:float=1e-6, max_iterations:int=200):
+    """
+    Same problem as step2_stochastic_extensive, solved by a multi-cut L-shaped
+    (Benders) decomposition for when the extensive form gets too large.
+
+    The master problem is the day-ahead model with one variable per scenario for
+    its balancing cost. At each iteration, the second stage of every scenario is
+    solved on a single reused model (only the right-hand sides and the wind bounds
+    change), then an optimality cut (or a feasibility cut, from a phase 1 problem,
+    when the day-ahead dispatch cannot be balanced) is added per scenario.
+    Stops when the relative gap between the master and the best feasible
+    dispatch is below tolerance.
+
+    Returns:
+        m (gp.Model): the master problem.
+        results (pd.DataFrame): day-ahead results, as in step2_multiple_hours.
+        real_time_prices (pd.DataFrame): balancing prices, one row per scenario.
+    """
+    scenarios, wind_availability = read_wind_scenarios(scenarios)
+    nbScenarios = len(scenarios)
+    probability = 1 / nbScenarios
+
+    m, x, indices, balance_constraint = build_first_stage()
+    recourse = build_recourse(indices, x.shape[0])
+    W_eq, T_eq, h_eq = recourse["W_eq"], recourse["T_eq"], recourse["h_eq"]
+    W_in, T_in, h_in = recourse["W_in"], recourse["T_in"], recourse["h_in"]
+    wind_ub = wind_upper_bounds(wind_availability)
+    nbSecondStage = recourse["cost"].size
+
+    # The balancing cost is at least the value of all the down regulation
+    lowest_cost = np.sum(recourse["cost"][recourse["cost"] < 0] * recourse["ub"][recourse["cost"] < 0])
+    balancing_cost = m.addMVar(shape=(nbScenarios,), lb=lowest_cost, obj=-probability, name="balancing_cost")
+    m.Params.OutputFlag = 0
+
+    # Second stage, reused for all the scenarios
+    sub = gp.Model()
+    sub.Params.OutputFlag = 0
+    sub.Params.DualReductions = 0  # infeasible and unbounded must be told apart
+    y = sub.addMVar(shape=(nbSecondStage,), lb=recourse["lb"], ub=recourse["ub"], obj=recourse["cost"])
+    sub_balance = sub.addMConstr(W_eq, y, "=", h_eq)
+    sub_limits = sub.addMConstr(W_in, y, "<", h_in)
+    sub_wind = y[recourse["wind"].ravel()]
+
+    # Phase 1: same constraints with artificial variables, minimise their sum
+    phase1 = gp.Model()
+    phase1.Params.OutputFlag = 0
+    y1 = phase1.addMVar(shape=(nbSecondStage,), lb=recourse["lb"], ub=recourse["ub"])
+    artificial_pos = phase1.addMVar(shape=(nbHour,), obj=1)
+    artificial_neg = phase1.addMVar(shape=(nbHour,), obj=1)
+    artificial_in = phase1.addMVar(shape=(h_in.size,), obj=1)
+    phase1_balance = phase1.addConstr(W_eq @ y1 + artificial_pos - artificial_neg == h_eq)
+    phase1_limits = phase1.addConstr(W_in @ y1 - artificial_in <= h_in)
+    phase1_wind = y1[recourse["wind"].ravel()]
+
+    best_lower_bound = -np.inf
+    real_time_prices = np.zeros((nbScenarios, nbHour))
+    for iteration in range(1, max_iterations + 1):
+        m.optimize()
+        x_hat = x.X
+        cost_hat = balancing_cost.X
+        upper_bound = m.ObjVal
+
+        sub_balance.RHS = h_eq - T_eq @ x_hat
+        sub_limits.RHS = h_in - T_in @ x_hat
+        cost = np.zeros(nbScenarios)
+        optimality_cuts, feasibility_cuts = [], []
+        for s in range(nbScenarios):
+            sub_wind.UB = wind_ub[s]
+            sub.optimize()
+            if sub.Status == GRB.OPTIMAL:
+                cost[s] = sub.ObjVal
+                real_time_prices[s] = sub_balance.Pi
+                # d(cost)/dx, as the first stage only enters the right-hand sides
+                gradient = - (T_eq.T @ sub_balance.Pi + T_in.T @ sub_limits.Pi)
+                if cost_hat[s] < cost[s] - tolerance * max(1, abs(cost[s])):
+                    optimality_cuts.append((s, gradient, cost[s] - gradient @ x_hat))
+            else:
+                phase1_balance.RHS = h_eq - T_eq @ x_hat
+                phase1_limits.RHS = h_in - T_in @ x_hat
+                phase1_wind.UB = wind_ub[s]
+                phase1.optimize()
+                gradient = - (T_eq.T @ phase1_balance.Pi + T_in.T @ phase1_limits.Pi)
+                feasibility_cuts.append((gradient, phase1.ObjVal - gradient @ x_hat))
+
+        if not feasibility_cuts:
+            lower_bound = upper_bound + probability * np.sum(cost_hat - cost)
+            best_lower_bound = max(best_lower_bound, lower_bound)
+            if upper_bound - best_lower_bound <= tolerance * max(1, abs(upper_bound)):
+                break
+
+        # cost[s] >= cost(x_hat) + gradient @ (x - x_hat)
+        if optimality_cuts:
+            ids, gradients, rhs = zip(*optimality_cuts)
+            m.addConstr(
+                balancing_cost[np.array(ids)] - sp.csr_matrix(np.array(gradients)) @ x >= np.array(rhs)
+            )
+        # phase 1 value(x_hat) + gradient @ (x - x_hat) <= 0
+        if feasibility_cuts:
+            gradients, rhs = zip(*feasibility_cuts)
+            m.addConstr(sp.csr_matrix(np.array(gradients)) @ x <= - np.array(rhs))
+
+    print(
+        f"L-shaped decomposition: {iteration} iterations, objective {upper_bound}, "
+        f"gap {upper_bound - best_lower_bound}"
+    )
+
+    results = step2_matrix_results(x.X, indices, balance_constraint.Pi)
+    real_time_prices = pd.DataFrame(real_time_prices, index=scenarios)
+    return m, results, real_time_prices
+
+def step2_stochastic(nbScenarios:int=None, seed:int=None, method:str="extensive"):
+    """
+    Two-stage stochastic day-ahead clearing over the wind scenarios.
+
+    Parameters:
+        nbScenarios (int): number of scenarios drawn (uniformly, without replacement)
+            among V1 to V100, all of them by default.
+        seed (int): seed of the draw.
+        method (str): "extensive" (one LP, step2_stochastic_extensive) or
+            "benders" (L-shaped decomposition, step2_stochastic_benders).
+    """
+    scenarios = sample_scenarios(nbScenarios, seed)
+    if method == "extensive":
+        return step2_stochastic_extensive(scenarios)
+    elif method == "benders":
+        return step2_stochastic_benders(scenarios)
+    raise ValueError(f"Unknown method '{method}', use 'extensive' or 'benders'.")
+
+if __name__ == "__main__":
+    m, results, real_time_prices = step2_stochastic()
+    print(f"Expected social welfare: {m.ObjVal} $")
+    print("Day-ahead prices:", results["Clearing price"].values)
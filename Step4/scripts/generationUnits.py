@@ -1,15 +1,120 @@
 import json
+import numpy as np
 
 
 class GenerationUnits:
-    def __init__(self):
+    """
+    Represents the generation units of the system, stored column by column.
+
+    Each attribute is kept in a contiguous NumPy array with one entry per unit, and the availability is stored as a (units x hours) matrix. Model builders can therefore read the whole fleet as vectors (generation_units.cost, generation_units.pmax, generation_units.availability, ...), while generation_units.units[g]["Cost"] still gives the unit by unit dictionary view.
+
+    Attributes:
+        nbUnits (int): The number of generation units stored.
+        data (dict of np.array): One array per attribute (see `columns`), with some spare capacity at the end.
+        availability_data (np.array): The availability of the units, of shape (capacity, nbHour).
+        unit_types (list of str): The type of each generation unit.
+    """
+
+    # Name of the array -> key in the dictionary of a unit
+    columns = {
+        "unit_id": "Id",
+        "node_id": "Id node",
+        "cost": "Cost",
+        "pmax": "PMAX",
+        "pmin": "PMIN",
+        "ramp_up": "Ramp up",
+        "ramp_down": "Ramp down",
+        "prod_init": "Initial production",
+    }
+    integer_columns = ("unit_id", "node_id")
+
+    def __init__(self, capacity: int = 32):
         """
         Initializes the GenerationUnits class.
 
-        Attributes:
-            units (list): A list to store information about each generation unit.
+        Parameters:
+            capacity (int): The number of units for which memory is allocated up front, doubled whenever it is exceeded.
+        """
+        self.nbUnits = 0
+        self.data = {
+            name: np.zeros(capacity, dtype=int if name in self.integer_columns else float)
+            for name in self.columns
+        }
+        self.availability_data = np.zeros((capacity, 0))
+        self.unit_types = []
+        self.units_view = None
+
+    def __getattr__(self, name):
+        # Array accessors: generation_units.cost, generation_units.pmax, ...
+        if name in GenerationUnits.columns and "data" in self.__dict__:
+            return self.data[name][: self.nbUnits]
+        raise AttributeError(f"'GenerationUnits' object has no attribute '{name}'")
+
+    @property
+    def availability(self) -> np.array:
+        """
+        Returns the availability of the units, an array of shape (nbUnits, nbHour).
+        """
+        return self.availability_data[: self.nbUnits]
+
+    @property
+    def units(self) -> list:
+        """
+        Returns the units as a list of dictionaries (built on demand, read only).
+
+        Each generation unit is represented as a dictionary with keys corresponding to its attributes (Id, Id node, Type, Cost, PMAX, PMIN, Availability, Ramp up, Ramp down, and Initial production) and their respective values.
         """
-        self.units = []
+        if self.units_view is None:
+            self.units_view = [self.get_unit_dict(i) for i in range(self.nbUnits)]
+        return self.units_view
+
+    def get_unit_dict(self, index: int) -> dict:
+        """
+        Returns the generation unit stored at position index as a dictionary.
+        """
+        data = {name: self.data[name][index].item() for name in self.columns}
+        return {
+            "Id": data["unit_id"],
+            "Id node": data["node_id"],
+            "Type": self.unit_types[index],
+            "Cost": data["cost"],
+            "PMAX": data["pmax"],
+            "PMIN": data["pmin"],
+            "Availability": self.availability_data[index],
+            "Ramp up": data["ramp_up"],
+            "Ramp down": data["ramp_down"],
+            "Initial production": data["prod_init"],
+        }
+
+    def get_max_production(self) -> np.array:
+        """
+        Returns PMAX times availability, an array of shape (nbUnits, nbHour).
+        """
+        return self.pmax[:, None] * self.availability
+
+    def allocate(self, nbUnits: int, nbHour: int):
+        """
+        Makes room for nbUnits units with nbHour hours of availability.
+
+        Raises:
+            ValueError: If nbHour differs from the number of hours of the units already stored.
+        """
+        if self.nbUnits == 0 and self.availability_data.shape[1] != nbHour:
+            self.availability_data = np.zeros((self.availability_data.shape[0], nbHour))
+        elif self.availability_data.shape[1] != nbHour:
+            raise ValueError(
+                f"Availability must have {self.availability_data.shape[1]} hours, got {nbHour}."
+            )
+
+        capacity = self.availability_data.shape[0]
+        if nbUnits > capacity:
+            capacity = max(nbUnits, 2 * capacity)
+            for name, array in self.data.items():
+                self.data[name] = np.zeros(capacity, dtype=array.dtype)
+                self.data[name][: self.nbUnits] = array[: self.nbUnits]
+            availability_data = np.zeros((capacity, nbHour))
+            availability_data[: self.nbUnits] = self.availability_data[: self.nbUnits]
+            self.availability_data = availability_data
 
     def add_unit(
         self,
@@ -25,7 +130,7 @@ class GenerationUnits:
         prod_init: float,
     ):
         """
-        Adds a new generation unit to the units list.
+        Adds a new generation unit.
 
         Parameters:
             unit_id (int): The unique identifier for the generation unit.
@@ -38,32 +143,78 @@ class GenerationUnits:
             ramp_up (float): The rate at which the unit can increase its power output.
             ramp_down (float): The rate at which the unit can decrease its power output.
             prod_init (float): The initial production level of the unit.
+        """
+        self.add_units(
+            unit_id=[unit_id],
+            node_id=[node_id],
+            unit_type=[unit_type],
+            cost=[cost],
+            pmax=[pmax],
+            pmin=[pmin],
+            availability=[availability],
+            ramp_up=[ramp_up],
+            ramp_down=[ramp_down],
+            prod_init=[prod_init],
+        )
+
+    def add_units(
+        self,
+        unit_id: np.array,
+        node_id: np.array,
+        unit_type,
+        cost: np.array,
+        pmax: np.array,
+        pmin: np.array,
+        availability: np.array,
+        ramp_up: np.array,
+        ramp_down: np.array,
+        prod_init: np.array,
+    ):
+        """
+        Adds several generation units at once.
 
-        Each generation unit is represented as a dictionary with keys corresponding to its attributes (Id, Id node, Type, Cost, PMAX, PMIN, Availability, Ramp up, Ramp down, and Initial production) and their respective values.
+        Parameters:
+            Same as `add_unit`, given as arrays of shape (nbNewUnits,), except:
+            unit_type (str or list of str): The type shared by all the new units, or the type of each of them.
+            availability (np.array): The availability of the new units, of shape (nbNewUnits, nbHour).
         """
-        unit = {
-            "Id": unit_id,
-            "Id node": node_id,
-            "Type": unit_type,
-            "Cost": cost,
-            "PMAX": pmax,
-            "PMIN": pmin,
-            "Availability": availability,
-            "Ramp up": ramp_up,
-            "Ramp down": ramp_down,
-            "Initial production": prod_init,
+        values = {
+            "unit_id": unit_id,
+            "node_id": node_id,
+            "cost": cost,
+            "pmax": pmax,
+            "pmin": pmin,
+            "ramp_up": ramp_up,
+            "ramp_down": ramp_down,
+            "prod_init": prod_init,
         }
+        availability = np.atleast_2d(np.asarray(availability, dtype=float))
+        nbNewUnits = availability.shape[0]
+
+        self.allocate(self.nbUnits + nbNewUnits, availability.shape[1])
+        new = slice(self.nbUnits, self.nbUnits + nbNewUnits)
+        for name, value in values.items():
+            self.data[name][new] = value
+        self.availability_data[new] = availability
+        if isinstance(unit_type, str):
+            unit_type = [unit_type] * nbNewUnits
+        self.unit_types.extend(unit_type)
 
-        self.units.append(unit)
+        self.nbUnits += nbNewUnits
+        self.units_view = None
 
     def add_constructed_unit(self, unit: dict):
         """
-        Adds a generation unit that has already been defined elsewhere to the units list.
+        Adds a generation unit that has already been defined elsewhere.
 
         Parameters:
-            unit (dict): A dictionary representing a generation unit with all necessary attributes (as defined in `add_unit` method).
+            unit (dict): A dictionary representing a generation unit with all necessary attributes (as in `units`).
         """
-        self.units.append(unit)
+        self.add_unit(
+            unit_type=unit["Type"],
+            availability=unit["Availability"],
+            **{name: unit[key] for name, key in self.columns.items()},
+        )
 
     def export_to_json(self):
         """
@@ -86,9 +237,9 @@ class GenerationUnits:
 
     def get_ids(self):
         """
-        Retrieves the unique identifiers (Ids) of all generation units stored in the units list.
+        Retrieves the unique identifiers (Ids) of all generation units.
 
         Returns:
             A list of integers representing the Ids of all generation units.
         """
-        return [unit["Id"] for unit in self.units]
+        return self.unit_id.tolist()
@@ -0,0 +1,143 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+
+from scripts.nodes import Nodes
+from scripts.ptdf import compute_incidence_matrix
+
+
+class DCPowerFlow:
+    """
+    DC power flow of a network, for any number of injection vectors.
+
+    The bus susceptance matrix is assembled once (sparse) and its reduced matrix, without the reference node, is factorized once (sparse LU). The voltage angles of each injection vector are then a back-substitution on the factorization, and the line flows a sparse product, so that the flows of all the hours and scenarios of a market are computed at once, without the dense PTDF matrix.
+
+    Attributes:
+        nbNode (int): The number of nodes.
+        nbLines (int): The number of lines.
+        reference_node (int): The index (starting at 0) of the reference (slack) node, whose angle is 0.
+        capacities (np.array): The capacities of the lines (nbLines,), or None if they are not given.
+        line_susceptance (sp.csr_matrix): The matrix (nbLines x nbNode) giving the line flows from the voltage angles.
+        bus_susceptance (sp.csr_matrix): The bus susceptance matrix (nbNode x nbNode), giving the net injections from the voltage angles.
+
+    Methods:
+        from_nodes: Creates the power flow of the transmission lines of a Nodes instance.
+        angles: Computes the voltage angles of injection vectors.
+        flows: Computes the line flows of injection vectors.
+        overloads: Computes the flows above the capacities of the lines.
+    """
+
+    def __init__(
+        self,
+        from_nodes: np.array,
+        to_nodes: np.array,
+        susceptances: np.array,
+        nbNode: int,
+        reference_node: int = 0,
+        first_node_id: int = 1,
+        capacities: np.array = None,
+    ):
+        """
+        Assembles and factorizes the bus susceptance matrix of the network.
+
+        Parameters:
+            from_nodes (np.array): The ids of the nodes where the lines originate.
+            to_nodes (np.array): The ids of the nodes where the lines terminate.
+            susceptances (np.array): The susceptances of the lines.
+            nbNode (int): The number of nodes.
+            reference_node (int): The index (starting at 0) of the reference (slack) node.
+            first_node_id (int): The id of the first node (1 for the csv files, 0 in Python convention).
+            capacities (np.array): The capacities of the lines, the default of overloads.
+        """
+        self.nbNode = nbNode
+        self.nbLines = len(from_nodes)
+        self.reference_node = reference_node
+        self.capacities = None if capacities is None else np.asarray(capacities, dtype=float)
+
+        incidence = compute_incidence_matrix(from_nodes, to_nodes, nbNode, first_node_id)
+        self.line_susceptance = sp.csr_matrix(sp.diags(np.asarray(susceptances, dtype=float)) @ incidence)
+        self.bus_susceptance = sp.csr_matrix(incidence.T @ self.line_susceptance)
+
+        self._others = np.delete(np.arange(nbNode), reference_node)
+        self._factorization = splu(self.bus_susceptance[self._others][:, self._others].tocsc())
+
+    @classmethod
+    def from_nodes(cls, nodes: Nodes, reference_node: int = 0):
+        """
+        Creates the power flow of the transmission lines of the nodes.
+
+        A line is stored at both of its nodes (its from_node being the node where it is stored): it is kept once, from the node with the smallest id. The lines are ordered by this node, and their capacities are kept.
+
+        Parameters:
+            nodes (Nodes): The nodes, with their transmission lines, their ids starting at 1.
+            reference_node (int): The index (starting at 0) of the reference (slack) node.
+
+        Returns:
+            DCPowerFlow: The power flow of the network.
+        """
+        lines = [
+            transmissionLine
+            for node in nodes.nodes
+            for transmissionLine in node["Transmission line"]
+            if transmissionLine.from_node < transmissionLine.to_node
+        ]
+        return cls(
+            from_nodes=np.array([line.from_node for line in lines], dtype=int),
+            to_nodes=np.array([line.to_node for line in lines], dtype=int),
+            susceptances=np.array([line.susceptance for line in lines], dtype=float),
+            nbNode=len(nodes.nodes),
+            reference_node=reference_node,
+            capacities=np.array([line.capacity for line in lines], dtype=float),
+        )
+
+    def angles(self, injections: np.array) -> np.array:
+        """
+        Computes the voltage angles of injection vectors.
+
+        Parameters:
+            injections (np.array): The net injections (generation - demand) at the nodes, of shape (..., nbNode), e.g. (nbHour, nbNode) or (nbScenarios, nbHour, nbNode). The reference node takes the imbalance of a vector which does not sum to 0.
+
+        Returns:
+            np.array: The voltage angles, of shape (..., nbNode). The angle of the reference node is 0.
+        """
+        injections = np.asarray(injections, dtype=float)
+        if injections.shape[-1] != self.nbNode:
+            raise ValueError(f"The injections must have {self.nbNode} columns (one per node).")
+        vectors = injections.reshape(-1, self.nbNode)
+
+        angles = np.zeros(vectors.shape)
+        if len(vectors) > 0:
+            angles[:, self._others] = self._factorization.solve(np.ascontiguousarray(vectors[:, self._others].T)).T
+        return angles.reshape(injections.shape)
+
+    def flows(self, injections: np.array) -> np.array:
+        """
+        Computes the line flows of injection vectors, counted positive from the from node to the to node of each line.
+
+        Parameters:
+            injections (np.array): The net injections at the nodes, of shape (..., nbNode), see angles.
+
+        Returns:
+            np.array: The line flows, of shape (..., nbLines).
+        """
+        angles = self.angles(injections)
+        flows = self.line_susceptance @ angles.reshape(-1, self.nbNode).T
+        return flows.T.reshape(angles.shape[:-1] + (self.nbLines,))
+
+    def overloads(self, injections: np.array, capacities: np.array = None, tolerance: float = 1e-6) -> np.array:
+        """
+        Computes the flows above the capacities of the lines, in either direction.
+
+        Parameters:
+            injections (np.array): The net injections at the nodes, of shape (..., nbNode), see angles.
+            capacities (np.array): The capacities of the lines, of shape (nbLines,), self.capacities by default.
+            tolerance (float): The flow (MW) above a capacity which is not an overload.
+
+        Returns:
+            np.array: |flow| - capacity where it is above tolerance, 0 elsewhere, of shape (..., nbLines).
+        """
+        capacities = self.capacities if capacities is None else np.asarray(capacities, dtype=float)
+        if capacities is None:
+            raise ValueError("The capacities of the lines are not known, give them to overloads.")
+        excess = np.abs(self.flows(injections)) - capacities
+        return np.where(excess > tolerance, excess, 0)
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+
+
+def read_transmission_lines(path: str = "inputs/transmission_parameters.csv"):
+    """
+    Reads the transmission lines of the network.
+
+    Parameters:
+        path (str or pd.DataFrame): The csv file with the columns from, to, reactance and capacity, or its table.
+
+    Returns:
+        tuple of np.array: The from nodes and to nodes of the lines (ids as in the file, starting at 1), their susceptances (1 / reactance) and their capacities.
+    """
+    transmission_data = path if isinstance(path, pd.DataFrame) else pd.read_csv(path, sep=";")
+    from_nodes = transmission_data["from"].values
+    to_nodes = transmission_data["to"].values
+    susceptances = 1 / transmission_data["reactance"].values
+    capacities = transmission_data["capacity"].values
+    return from_nodes, to_nodes, susceptances, capacities
+
+
+def compute_incidence_matrix(
+    from_nodes: np.array, to_nodes: np.array, nbNode: int, first_node_id: int = 1
+) -> sp.csr_matrix:
+    """
+    Builds the line-node incidence matrix of the network.
+
+    Parameters:
+        from_nodes (np.array): The ids of the nodes where the lines originate.
+        to_nodes (np.array): The ids of the nodes where the lines terminate.
+        nbNode (int): The number of nodes.
+        first_node_id (int): The id of the first node (1 for the csv files, 0 in Python convention).
+
+    Returns:
+        sp.csr_matrix: A matrix of shape (nbLines, nbNode) with +1 at the from node and -1 at the to node of each line.
+    """
+    nbLines = len(from_nodes)
+    lines = np.arange(nbLines)
+    rows = np.concatenate([lines, lines])
+    cols = np.concatenate([from_nodes, to_nodes]) - first_node_id
+    data = np.concatenate([np.ones(nbLines), -np.ones(nbLines)])
+    return sp.csr_matrix((data, (rows, cols)), shape=(nbLines, nbNode))
+
+
+def compute_ptdf(
+    from_nodes: np.array,
+    to_nodes: np.array,
+    susceptances: np.array,
+    nbNode: int,
+    reference_node: int = 0,
+    first_node_id: int = 1,
+) -> np.array:
+    """
+    Computes the Power Transfer Distribution Factors (PTDF) of a DC network.
+
+    PTDF[l, n] is the flow on line l (counted positive from its from node to its to node) when 1 MW is injected at node n and withdrawn at the reference node. The reduced bus susceptance matrix is factorized once (sparse LU) and solved for all the lines at once.
+
+    Parameters:
+        from_nodes (np.array): The ids of the nodes where the lines originate.
+        to_nodes (np.array): The ids of the nodes where the lines terminate.
+        susceptances (np.array): The susceptances of the lines.
+        nbNode (int): The number of nodes.
+        reference_node (int): The index (starting at 0) of the reference (slack) node.
+        first_node_id (int): The id of the first node (1 for the csv files, 0 in Python convention).
+
+    Returns:
+        np.array: The PTDF matrix, of shape (nbLines, nbNode). The column of the reference node is zero.
+    """
+    incidence = compute_incidence_matrix(from_nodes, to_nodes, nbNode, first_node_id)
+    line_susceptance = sp.diags(susceptances) @ incidence  # flows = line_susceptance @ angles
+    bus_susceptance = incidence.T @ line_susceptance
+
+    others = np.delete(np.arange(nbNode), reference_node)
+    factorization = splu(bus_susceptance[others][:, others].tocsc())
+
+    # The reduced bus susceptance matrix is symmetric: PTDF = Bf B^-1 = (B^-1 Bf^T)^T
+    ptdf = np.zeros((len(from_nodes), nbNode))
+    ptdf[:, others] = factorization.solve(line_susceptance[:, others].T.toarray()).T
+    return ptdf
@@ -1,8 +1,27 @@
+import os
+import sys
 import pandas as pd
 import gurobipy as gp
 import numpy as np
+import scipy.sparse as sp
 from gurobipy import GRB
 
+# Modules shared by the steps (utils) are at the root of the repository
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.linearProgram import LinearProgram
+from utils.results import get_values, get_duals, get_objective
+from utils.cache import optimize, result_cache
+from utils.inputStore import load_input_store
+from utils.instrumentation import start_run
+
+# Phases of the run, recorded if INSTRUMENTATION_FILE is set (see utils.instrumentation)
+run_record = start_run("step4")
+
+# Inputs read from the columnar store of inputs/ (converted from the csv files at the first run)
+input_store = load_input_store()
+horizon = input_store.nbRows("load_profile")  # Number of hours of the inputs
+run_record.end_phase("inputs")
+
 ################################################################################
 # Creation of Conventionnal Generation Units
 ################################################################################
@@ -10,7 +29,7 @@ from gurobipy import GRB
 from scripts.generationUnits import GenerationUnits
 
 # parameter unit
-generationUnits_parameters = pd.read_csv("inputs/gen_parameters.csv", sep=";")
+generationUnits_parameters = input_store.table("gen_parameters")
 
 nodes = generationUnits_parameters["Node"].values
 costs = generationUnits_parameters["Ci"].values
@@ -36,7 +55,7 @@ for unit_id in range(nbUnitsConventionnal):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=[1] * 24,  # 100% availability for each hour
+        availability=[1] * horizon,  # 100% availability for each hour
         ramp_up=ramp_up[unit_id],
         ramp_down=ramp_down[unit_id],
         prod_init=prod_init[unit_id],
@@ -46,7 +65,7 @@ for unit_id in range(nbUnitsConventionnal):
 # Adding of the Wind Generation Units
 ################################################################################
 
-wind_parameters = pd.read_csv("inputs/wind_parameters.csv", index_col="Unit", sep=";")
+wind_parameters = input_store.table("wind_parameters", index_col="Unit")
 nodes = wind_parameters["Node"].values
 pmax = wind_parameters["Pmax"].values
 pmin = wind_parameters["Pmin"].values
@@ -56,11 +75,10 @@ scenario = "V1"  # scenario : from V1 to V100
 
 nbUnitsWind = wind_parameters.shape[0]
 nbUnits = nbUnitsConventionnal + nbUnitsWind
+wind_availability = input_store.scenarios("scen_zoneW", zones=range(nbUnitsWind), hours=horizon, scenarios=[scenario])[:, :, 0]
 for unit_id in range(nbUnitsWind):
 
-    availability = pd.read_csv(f"inputs/data/scen_zoneW{unit_id}.csv", sep=",")[
-        scenario
-    ].values.tolist()
+    availability = wind_availability[unit_id].tolist()
 
     generation_units.add_unit(
         unit_id=unit_id + nbUnitsConventionnal,
@@ -69,13 +87,12 @@ for unit_id in range(nbUnitsWind):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=availability[:24],
+        availability=availability,
         ramp_up=10000,  # big M, for no constraint on rampu_up
         ramp_down=0,
         prod_init=0,
     )
 
-generation_units.export_to_json()
 
 ################################################################################
 # Creation of Loads Units
@@ -84,14 +101,12 @@ generation_units.export_to_json()
 from scripts.loadUnits import LoadUnits
 
 # parameter load
-total_needed_demand = pd.read_csv("inputs/load_profile.csv", sep=";")[
+total_needed_demand = input_store.table("load_profile")[
     "total_demand"
 ].values
 nbHour = total_needed_demand.shape[0]
 
-load_location = pd.read_csv(
-    "inputs/load_location.csv", index_col="load_number", sep=";"
-)
+load_location = input_store.table("load_location", index_col="load_number")
 nodes = load_location["node"].values
 load_percentage = load_location["load_percentage"].values
 
@@ -106,7 +121,7 @@ for unit_id in range(nbLoadUnits):
         total_needed_demand=total_needed_demand,
     )
 
-load_units.export_to_json()
+run_record.end_phase("units")
 
 ################################################################################
 # Create the Nodes
@@ -116,7 +131,8 @@ from scripts.nodes import Nodes
 from scripts.transmissionLine import TransmissionLine
 
 nodes = Nodes()
-nbNode = 24
+transmission_data = input_store.table("transmission_parameters")
+nbNode = int(max(transmission_data["from"].max(), transmission_data["to"].max()))
 
 for id_node in range(1, nbNode + 1):
 
@@ -142,7 +158,6 @@ for id_node in range(1, nbNode + 1):
     # We add the transmission line
     # print(" Transmission lines:")
     transmission_lines = []
-    transmission_data = pd.read_csv("inputs/transmission_parameters.csv", sep=";")
     mask = (transmission_data["from"] == id_node) | (transmission_data["to"] == id_node)
     node_transmission_data = transmission_data.loc[mask]
 
@@ -171,6 +186,17 @@ for id_node in range(1, nbNode + 1):
         loadUnits=node_load_units,
         transmissionLines=transmission_lines,
     )
+run_record.end_phase("nodes")
+
+################################################################################
+# DC power flow
+################################################################################
+
+from scripts.powerFlow import DCPowerFlow
+
+# The susceptance matrix is factorized once: the flows of any dispatch are then a back-substitution
+power_flow = DCPowerFlow.from_nodes(nodes)
+run_record.end_phase("power_flow")
 
 ################################################################################
 # Adding of the battery
@@ -183,210 +209,499 @@ P_max = 150  # MW
 delta_t = 1  # hour
 
 ################################################################################
-# Model
+# Results
 ################################################################################
 
-m = gp.Model()
-
-# Variables
-production = m.addMVar(
-    shape=(nbHour, nbUnits), lb=0, name="power_generation", vtype=GRB.CONTINUOUS
-)
-demand_supplied = m.addMVar(
-    shape=(nbHour, nbLoadUnits), lb=0, name=f"demand_supplied", vtype=GRB.CONTINUOUS
-)
-state_of_charge = m.addMVar(
-    shape=(nbHour,),
-    lb=min_SoC,
-    ub=max_SoC,
-    name=f"state_of_charge",
-    vtype=GRB.CONTINUOUS,
-)
-power_injected = m.addMVar(
-    shape=(nbHour,),
-    lb=0,
-    ub=P_max,
-    name=f"power_injected",
-    vtype=GRB.CONTINUOUS,
-)
-power_drawn = m.addMVar(
-    shape=(nbHour,),
-    lb=0,
-    ub=P_max,
-    name=f"power_drawn",
-    vtype=GRB.CONTINUOUS,
-)
-voltage_angle = m.addMVar(
-    shape=(nbHour, nbNode), name=f"voltage_angle", vtype=GRB.CONTINUOUS
-)
-
-# Objective function
-objective = gp.quicksum(
-    demand_supplied[t, l] * load_units.units[l]["Bid price"]
-    for t in range(nbHour)
-    for l in range(nbLoadUnits)
-) - gp.quicksum(
-    production[t, g] * generation_units.units[g]["Cost"]
-    for t in range(nbHour)
-    for g in range(nbUnits)
-)
-m.setObjective(objective, GRB.MAXIMIZE)
-
-# Constraints
-
-# generation unitsP have a _max
-max_prod_constraint = [
-    m.addConstr(
-        production[t, g]
-        <= generation_units.units[g]["PMAX"]
-        * generation_units.units[g]["Availability"][t]
+from scripts.plot_results import plot_results, plot_nodes
+
+battery_node = 7  # id of the node where the battery is located
+
+def nodal_injections(
+    production: np.array,
+    demand_supplied: np.array,
+    power_injected: np.array,
+    power_drawn: np.array,
+):
+    """
+    Computes the net injections (generation - demand) at the nodes of a dispatch, for power_flow.
+
+    Parameters:
+        production (np.array): The production of the generation units, of shape (..., nbUnits).
+        demand_supplied (np.array): The supplied demand of the load units, of shape (..., nbLoadUnits).
+        power_injected, power_drawn (np.array): The battery variables, of shape (...,).
+
+    Returns:
+        np.array: The net injections, of shape (..., nbNode), e.g. (nbHour, nbNode) or (nbScenarios, nbHour, nbNode).
+    """
+    unit_nodes = generation_units.node_id - 1
+    load_nodes = np.array([unit["Id node"] for unit in load_units.units]) - 1
+    generation = sp.csr_matrix((np.ones(nbUnits), (np.arange(nbUnits), unit_nodes)), shape=(nbUnits, nbNode))
+    load = sp.csr_matrix((np.ones(nbLoadUnits), (np.arange(nbLoadUnits), load_nodes)), shape=(nbLoadUnits, nbNode))
+
+    production = np.asarray(production, dtype=float)
+    demand_supplied = np.asarray(demand_supplied, dtype=float)
+    injections = (generation.T @ production.reshape(-1, nbUnits).T).T - (load.T @ demand_supplied.reshape(-1, nbLoadUnits).T).T
+    injections = injections.reshape(production.shape[:-1] + (nbNode,))
+    injections[..., battery_node - 1] += np.asarray(power_injected) - np.asarray(power_drawn)
+    return injections
+
+def nodal_results(
+    production: np.array,
+    demand_supplied: np.array,
+    state_of_charge: np.array,
+    power_injected: np.array,
+    power_drawn: np.array,
+    lmp: np.array,
+):
+    """
+    Gathers the results of a nodal market clearing in a DataFrame.
+
+    Parameters:
+        production (np.array): The production of the generation units, of shape (nbHour, nbUnits).
+        demand_supplied (np.array): The supplied demand of the load units, of shape (nbHour, nbLoadUnits).
+        state_of_charge, power_injected, power_drawn (np.array): The battery variables, of shape (nbHour,).
+        lmp (np.array): The locational marginal prices, of shape (nbHour, nbNode).
+
+    Returns:
+        pd.DataFrame: One row per hour. The generation units are paid the price of their node, "Clearing price" is the price at the battery node.
+            "Max line loading" is the largest |flow| / capacity of the lines (DC power flow of the dispatch), above 1 if a line is overloaded.
+    """
+    unit_nodes = generation_units.node_id - 1
+    profit = production * (lmp[:, unit_nodes] - generation_units.cost)
+    demand_unsatisfied = total_needed_demand[:nbHour] - demand_supplied.sum(axis=1)
+
+    columns = {"Hour": np.arange(nbHour)}
+    for g in range(nbUnits):
+        columns[f"PU production {g+1} (GW)"] = production[:, g]
+        columns[f"PU profit {g+1} ($)"] = profit[:, g]
+    for n in range(nbNode):
+        columns[f"LMP node {n+1}"] = lmp[:, n]
+    columns["Clearing price"] = lmp[:, battery_node - 1]
+    columns["Demand"] = total_needed_demand[:nbHour]
+    columns["Demand satisfied"] = total_needed_demand[:nbHour] - demand_unsatisfied
+    columns["Demand unsatisfied"] = demand_unsatisfied
+    columns["Battery production"] = power_injected - power_drawn
+    columns["State of charge"] = state_of_charge / max_SoC
+    # power_injected is a discharge in the balance: the battery is paid for it and pays for power_drawn
+    columns["Battery profit"] = columns["Clearing price"] * columns["Battery production"]
+    flows = power_flow.flows(nodal_injections(production, demand_supplied, power_injected, power_drawn))
+    columns["Max line loading"] = (np.abs(flows) / power_flow.capacities).max(axis=1)
+    return pd.DataFrame(columns)
+
+################################################################################
+# Model: voltage angle formulation
+################################################################################
+
+def step4_nodal_angle(show_plots: bool = False, use_cache: bool = False):
+    """
+    Clears the nodal market with one voltage angle per hour and node (DC power flow).
+
+    Parameters:
+        use_cache (bool): read the solution from the result cache (utils.cache) if the same market
+            was already cleared (off by default). On a hit the returned model is not solved (no
+            ObjVal, X or Pi, no basis): read its solution with
+            utils.results (get_values, get_duals, get_objective).
+
+    Returns:
+        m (gp.Model): The solved model.
+        lmp (np.array): The locational marginal prices (duals of the nodal balances), of shape (nbHour, nbNode).
+        results (pd.DataFrame): See nodal_results.
+    """
+    run_record.start_phase("step4_nodal_angle", profile=True)
+    m = gp.Model()
+
+    # Variables
+    production = m.addMVar(
+        shape=(nbHour, nbUnits), lb=0, name="power_generation", vtype=GRB.CONTINUOUS
     )
-    for g in range(nbUnits)
-    for t in range(nbHour)
-]
-
-# Cannot supply more than necessary
-demand_supplied_constraint = [
-    m.addConstr(demand_supplied[t, l] <= load_units.units[l]["Needed demand"][t])
-    for l in range(nbLoadUnits)
-    for t in range(nbHour)
-]
-
-print("AHHHHHHHHHHHHHHHHHHHHHHHHHHHHHHH","\n\n")
-print(nodes.get_ids_load(2))
-
-# Supplied demand match generation
-balance_constraint = [
-    m.addConstr(
-        sum(demand_supplied[t, l] for l in nodes.get_ids_load(n))
-        - gp.quicksum(production[t, g] for g in nodes.get_ids_generation(n))
-        - (power_injected[t] - power_drawn[t]) * (n == 7)
-        + sum(
-            nodes.get_susceptances(n, to_node)
-            * (voltage_angle[t, n] - voltage_angle[t, to_node])
-            for to_node in nodes.get_to_node(n)
-        )
-        == 0
+    demand_supplied = m.addMVar(
+        shape=(nbHour, nbLoadUnits), lb=0, name=f"demand_supplied", vtype=GRB.CONTINUOUS
+    )
+    state_of_charge = m.addMVar(
+        shape=(nbHour,),
+        lb=min_SoC,
+        ub=max_SoC,
+        name=f"state_of_charge",
+        vtype=GRB.CONTINUOUS,
+    )
+    power_injected = m.addMVar(
+        shape=(nbHour,),
+        lb=0,
+        ub=P_max,
+        name=f"power_injected",
+        vtype=GRB.CONTINUOUS,
+    )
+    power_drawn = m.addMVar(
+        shape=(nbHour,),
+        lb=0,
+        ub=P_max,
+        name=f"power_drawn",
+        vtype=GRB.CONTINUOUS,
+    )
+    voltage_angle = m.addMVar(
+        shape=(nbHour, nbNode), lb=-GRB.INFINITY, name=f"voltage_angle", vtype=GRB.CONTINUOUS
     )
-    for t in range(nbHour)
-    for n in range(nbNode)
-]
-
-# Ramp-up and ramp-down constraint
-ramp_up_constraint = []
-ramp_down_constraint = []
-for g in range(nbUnits):
-    for t in range(nbHour):
-        if t == 0:  # Apply the special condition for t=0
-            ramp_up_constraint.append(
-                m.addConstr(
-                    production[t, g]
-                    <= generation_units.units[g]["Initial production"]
-                    + generation_units.units[g]["Ramp up"],
+
+    # Objective function
+    objective = gp.quicksum(
+        demand_supplied[t, l] * load_units.units[l]["Bid price"]
+        for t in range(nbHour)
+        for l in range(nbLoadUnits)
+    ) - gp.quicksum(
+        production[t, g] * generation_units.units[g]["Cost"]
+        for t in range(nbHour)
+        for g in range(nbUnits)
+    )
+    m.setObjective(objective, GRB.MAXIMIZE)
+
+    # Constraints
+
+    # generation unitsP have a _max
+    max_prod_constraint = [
+        m.addConstr(
+            production[t, g]
+            <= generation_units.units[g]["PMAX"]
+            * generation_units.units[g]["Availability"][t]
+        )
+        for g in range(nbUnits)
+        for t in range(nbHour)
+    ]
+
+    # Cannot supply more than necessary
+    demand_supplied_constraint = [
+        m.addConstr(demand_supplied[t, l] <= load_units.units[l]["Needed demand"][t])
+        for l in range(nbLoadUnits)
+        for t in range(nbHour)
+    ]
+
+    # Supplied demand match generation (node ids start at 1, voltage_angle columns at 0)
+    balance_constraint = [
+        [
+            m.addConstr(
+                sum(demand_supplied[t, l] for l in nodes.get_ids_load(n))
+                - gp.quicksum(production[t, g] for g in nodes.get_ids_generation(n))
+                - (power_injected[t] - power_drawn[t]) * (n == battery_node)
+                + sum(
+                    nodes.get_susceptances(n, to_node)
+                    * (voltage_angle[t, n - 1] - voltage_angle[t, to_node - 1])
+                    for to_node in nodes.get_to_node(n)
                 )
+                == 0
             )
-            ramp_down_constraint.append(
-                m.addConstr(
-                    production[t, g]
-                    >= generation_units.units[g]["Initial production"]
-                    - generation_units.units[g]["Ramp down"],
+            for n in range(1, nbNode + 1)
+        ]
+        for t in range(nbHour)
+    ]
+
+    # Ramp-up and ramp-down constraint
+    ramp_up_constraint = []
+    ramp_down_constraint = []
+    for g in range(nbUnits):
+        for t in range(nbHour):
+            if t == 0:  # Apply the special condition for t=0
+                ramp_up_constraint.append(
+                    m.addConstr(
+                        production[t, g]
+                        <= generation_units.units[g]["Initial production"]
+                        + generation_units.units[g]["Ramp up"],
+                    )
                 )
-            )
-        else:  # Apply the regular ramp-down constraint for t>0
-            ramp_up_constraint.append(
-                m.addConstr(
-                    production[t, g]
-                    <= production[t - 1, g] + generation_units.units[g]["Ramp up"],
+                ramp_down_constraint.append(
+                    m.addConstr(
+                        production[t, g]
+                        >= generation_units.units[g]["Initial production"]
+                        - generation_units.units[g]["Ramp down"],
+                    )
                 )
-            )
-            ramp_down_constraint.append(
-                m.addConstr(
-                    production[t, g]
-                    >= production[t - 1, g] - generation_units.units[g]["Ramp down"],
+            else:  # Apply the regular ramp-down constraint for t>0
+                ramp_up_constraint.append(
+                    m.addConstr(
+                        production[t, g]
+                        <= production[t - 1, g] + generation_units.units[g]["Ramp up"],
+                    )
+                )
+                ramp_down_constraint.append(
+                    m.addConstr(
+                        production[t, g]
+                        >= production[t - 1, g] - generation_units.units[g]["Ramp down"],
+                    )
                 )
-            )
 
-# Battery constraints
-actualise_SoC = [
-    m.addConstr(
-        state_of_charge[t]
-        == state_of_charge[t-1] + (- power_injected[t]/efficiency  + power_drawn[t]*efficiency)* delta_t
-    )
-    for t in range(1,nbHour)
-]
-m.addConstr(state_of_charge[0] == value_init - (power_injected[0]/efficiency  - power_drawn[0]*efficiency))
-m.addConstr(value_init - state_of_charge[-1] <= 0)
+    # Battery constraints
+    actualise_SoC = [
+        m.addConstr(
+            state_of_charge[t]
+            == state_of_charge[t-1] + (- power_injected[t]/efficiency  + power_drawn[t]*efficiency)* delta_t
+        )
+        for t in range(1,nbHour)
+    ]
+    m.addConstr(state_of_charge[0] == value_init - (power_injected[0]/efficiency  - power_drawn[0]*efficiency))
+    m.addConstr(value_init - state_of_charge[-1] <= 0)
 
+    # Node constraints
+    power_flow_constraint_init = [
+        m.addConstr(voltage_angle[t, 0] == 0) for t in range(nbHour)
+    ]
 
+    power_flow_constraint_lower_limit = [
+        m.addConstrs(
+            -nodes.get_capacity(n, to_node)
+            <= nodes.get_susceptances(n, to_node)
+            * (voltage_angle[t, n - 1] - voltage_angle[t, to_node - 1])
+            for to_node in nodes.get_to_node(n)
+        )
+        for n in range(1, nbNode + 1)
+        for t in range(nbHour)
+    ]
+    power_flow_constraint_upper_limit = [
+        m.addConstrs(
+            nodes.get_susceptances(n, to_node)
+            * (voltage_angle[t, n - 1] - voltage_angle[t, to_node - 1])
+            <= nodes.get_capacity(n, to_node)
+            for to_node in nodes.get_to_node(n)
+        )
+        for n in range(1, nbNode + 1)
+        for t in range(nbHour)
+    ]
+    run_record.end_phase("build", m)
 
+    optimize(m, result_cache if use_cache else None)
+    run_record.end_phase("solve", m)
 
-# Node constraints
-power_flow_constraint_init = [
-    m.addConstr(voltage_angle[t, 0] == 0) for t in range(nbHour)
-]
+    lmp = get_duals(m, balance_constraint).reshape(nbHour, nbNode)
 
-power_flow_constraint_lower_limit = [
-    m.addConstrs(
-        -nodes.get_capacity(n, to_node)
-        <= nodes.get_susceptances(n, to_node)
-        * (voltage_angle[t, n - 1] - voltage_angle[t, to_node - 1])
-        for to_node in nodes.get_to_node(n)
-    )
-    for n in range(nbNode + 1)
-    for t in range(nbHour)
-]
-power_flow_constraint_upper_limit = [
-    m.addConstrs(
-        nodes.get_susceptances(n, to_node)
-        * (voltage_angle[t, n - 1] - voltage_angle[t, to_node - 1])
-        <= nodes.get_capacity(n, to_node)
-        for to_node in nodes.get_to_node(n)
+    results = nodal_results(
+        *(get_values(m, variable) for variable in (production, demand_supplied, state_of_charge, power_injected, power_drawn)),
+        lmp,
     )
-    for n in range(1, nbNode + 1)
-    for t in range(nbHour)
-]
+    run_record.end_phase("extract")
+    if show_plots:
+        plot_results(nbUnits=nbUnits, results=results)
+        run_record.end_phase("plot")
 
-m.addConstr(voltage_angle[t, 0] == 0)
-
-
-m.optimize()
+    return m, lmp, results
 
 ################################################################################
-# Results
+# Model: PTDF formulation
 ################################################################################
 
-clearing_price = [balance_constraint[t].Pi for t in range(nbHour)]
-clearing_price_values = [
-    price_item.flatten()[0] for price_item in clearing_price
-]  # remove the array values
+from scripts.ptdf import read_transmission_lines, compute_ptdf
 
-profit = [
-    [
-        production[t][g].X * (clearing_price[t] - generation_units.units[g]["Cost"])
-        for g in range(nbUnits)
+run_record.start_phase()
+line_from, line_to, line_susceptance, line_capacity = read_transmission_lines(transmission_data)
+nbLines = len(line_from)
+reference_node = 0  # node 1, as voltage_angle[t, 0] == 0 in the angle formulation
+ptdf = compute_ptdf(line_from, line_to, line_susceptance, nbNode, reference_node=reference_node)
+run_record.end_phase("ptdf")
+
+def build_nodal_ptdf_linear_program(line_limits: bool = True):
+    """
+    Builds the PTDF formulation of the nodal market (see step4_nodal_ptdf) as a LinearProgram, independent of the solver.
+
+    Parameters:
+        line_limits (bool): Whether to add the line limits, as the "flow_upper_limit" and "flow_lower_limit" blocks of constraints (rows ordered by hour, then line).
+
+    Returns:
+        lp (LinearProgram): The program. Its blocks of variables are "production", "demand_supplied", "state_of_charge", "power_injected" and "power_drawn", the duals of its "balance" constraints are the system prices.
+        flow_terms (list of tuple): (matrix, indices) pairs giving the flows of all the lines at all the hours (nbHour * nbLines rows).
+    """
+    lp = LinearProgram(sense="max")
+
+    bid_price = np.array([unit["Bid price"] for unit in load_units.units])
+    needed_demand = np.array([unit["Needed demand"] for unit in load_units.units]).T[:nbHour]
+    load_nodes = np.array([unit["Id node"] for unit in load_units.units]) - 1
+    unit_nodes = generation_units.node_id - 1
+
+    # Variables (the upper bounds hold the P_max and needed demand constraints)
+    production = lp.add_variables(
+        "production", (nbHour, nbUnits), ub=generation_units.get_max_production().T[:nbHour], obj=-generation_units.cost
+    )
+    demand_supplied = lp.add_variables("demand_supplied", (nbHour, nbLoadUnits), ub=needed_demand, obj=bid_price)
+    state_of_charge = lp.add_variables("state_of_charge", (nbHour,), lb=min_SoC, ub=max_SoC)
+    power_injected = lp.add_variables("power_injected", (nbHour,), ub=P_max)
+    power_drawn = lp.add_variables("power_drawn", (nbHour,), ub=P_max)
+
+    # Supplied demand match generation over the whole system
+    hours = sp.identity(nbHour, format="csr")
+    lp.add_constraints(
+        "balance",
+        [
+            (sp.kron(hours, np.ones((1, nbLoadUnits))), demand_supplied),
+            (hours, power_drawn),
+            (sp.kron(hours, -np.ones((1, nbUnits))), production),
+            (-hours, power_injected),
+        ],
+        "=",
+        0,
+    )
+
+    # Line flows: PTDF @ net injections, hour by hour (block diagonal sparse matrices)
+    flow_battery = sp.kron(hours, sp.csr_matrix(ptdf[:, [battery_node - 1]]), format="csr")  # (nbLines, 1) blocks
+    flow_terms = [
+        (sp.kron(hours, sp.csr_matrix(ptdf[:, unit_nodes]), format="csr"), production),
+        (-sp.kron(hours, sp.csr_matrix(ptdf[:, load_nodes]), format="csr"), demand_supplied),
+        (flow_battery, power_injected),
+        (-flow_battery, power_drawn),
     ]
-    for t in range(nbHour)
-]
-
-demand_unsatisfied = [
-    total_needed_demand[t] - np.sum(demand_supplied[t][l].X for l in range(nbLoadUnits))
-    for t in range(nbHour)
-]
-
-results = pd.DataFrame()
-results["Hour"] = np.arange(nbHour)
-for g in range(nbUnits):
-    results[f"PU production {g+1} (GW)"] = [production[t][g].X for t in range(nbHour)]
-    results[f"PU profit {g+1} ($)"] = [profit[t][g] for t in range(nbHour)]
-results["Clearing price"] = clearing_price_values
-results["Demand"] = total_needed_demand
-results["Demand satisfied"] = total_needed_demand - demand_unsatisfied
-results["Demand unsatisfied"] = demand_unsatisfied
-results["Battery production"] = power_injected.X-power_drawn.X
-results["State of charge"] = state_of_charge.X / max_SoC
-results["Battery profit"] = - results["Clearing price"] * results["Battery production"]
+    if line_limits:
+        capacity = np.tile(line_capacity, nbHour)  # rows are (hour, line), hour major
+        lp.add_constraints("flow_upper_limit", flow_terms, "<", capacity)
+        lp.add_constraints("flow_lower_limit", flow_terms, ">", -capacity)
+
+    # Ramp-up and ramp-down constraint: production[t] - production[t-1], with production[-1] = initial production
+    difference = sp.kron(sp.identity(nbHour) - sp.eye(nbHour, k=-1), sp.identity(nbUnits), format="csr")
+    rhs_ramp_up = np.tile(generation_units.ramp_up, nbHour)
+    rhs_ramp_up[:nbUnits] += generation_units.prod_init
+    rhs_ramp_down = -np.tile(generation_units.ramp_down, nbHour)
+    rhs_ramp_down[:nbUnits] += generation_units.prod_init
+    lp.add_constraints("ramp_up", [(difference, production)], "<", rhs_ramp_up)
+    lp.add_constraints("ramp_down", [(difference, production)], ">", rhs_ramp_down)
+
+    # Battery constraints: SoC[t] == SoC[t-1] + (- injected[t] / efficiency + drawn[t] * efficiency) * delta_t,
+    # starting from value_init, and the last SoC >= value_init
+    lp.add_constraints(
+        "battery",
+        [
+            (sp.identity(nbHour) - sp.eye(nbHour, k=-1), state_of_charge),
+            (hours * (delta_t / efficiency), power_injected),
+            (hours * (-delta_t * efficiency), power_drawn),
+        ],
+        "=",
+        np.concatenate([[value_init], np.zeros(nbHour - 1)]),
+    )
+    lp.add_constraints("final_state_of_charge", [(sp.eye(1, nbHour, k=nbHour - 1), state_of_charge)], ">", value_init)
+
+    return lp, flow_terms
+
+def step4_nodal_ptdf(
+    show_plots: bool = False,
+    lazy_line_limits: bool = False,
+    flow_tolerance: float = 1e-6,
+    solver: str = "gurobi",
+    use_cache: bool = False,
+):
+    """
+    Clears the nodal market with the PTDF (DC power flow) formulation.
+
+    There is no voltage angle variable: the hourly balance is system wide and the line flows are
+    PTDF @ net nodal injections, limited by the line capacities through sparse matrix constraints
+    (see build_nodal_ptdf_linear_program).
+
+    With lazy_line_limits, the model is first solved without any line limit. The flows are then
+    checked against the capacities (flow_tolerance in MW), only the violated limits are added and
+    the model is re-solved from the previous basis, until no limit is violated. The number of solves
+    and of line limit constraints are printed and stored in m._line_limit_iterations and
+    m._line_limit_constraints.
+
+    Parameters:
+        solver (str): "gurobi" or "highs" (no licence needed, without lazy line limits).
+        use_cache (bool): with Gurobi and without lazy line limits, see step4_nodal_angle.
+
+    Returns:
+        m (gp.Model or LinearProgramSolution): The solved model (Gurobi) or the solution (other solvers).
+        lmp (np.array): The locational marginal prices, of shape (nbHour, nbNode):
+            the system price minus the congestion component PTDF.T @ (duals of the line limits).
+        results (pd.DataFrame): See nodal_results.
+    """
+    if lazy_line_limits and solver != "gurobi":
+        raise ValueError("Lazy line limits re-solve the model in place, they need solver='gurobi'.")
+    run_record.start_phase("step4_nodal_ptdf", profile=True)
+
+    lp, flow_terms = build_nodal_ptdf_linear_program(line_limits=not lazy_line_limits)
+    all_rows = np.arange(nbHour * nbLines)
+    capacity = np.tile(line_capacity, nbHour)  # rows are (hour, line), hour major
+    line_duals = np.zeros(nbHour * nbLines)
+
+    if solver != "gurobi":
+        run_record.end_phase("build", lp)
+        m = lp.solve(solver)
+        run_record.end_phase("solve", m)
+        solution = m.x
+        system_price = m.get_duals("balance")
+        line_duals += m.get_duals("flow_upper_limit") + m.get_duals("flow_lower_limit")
+    else:
+        m, x, constraints = lp.to_gurobi()
+        run_record.end_phase("build", m)
+        if lazy_line_limits:
+            m.optimize()
+        else:
+            optimize(m, result_cache if use_cache else None)
+
+        line_limits = []  # (rows, constraint) for each block of line limits in the model
+        if not lazy_line_limits:
+            line_limits.append((all_rows, constraints["flow_upper_limit"]))
+            line_limits.append((all_rows, constraints["flow_lower_limit"]))
+        else:
+
+            def flow(rows):
+                return sum(matrix[rows] @ x[indices.ravel()] for matrix, indices in flow_terms)
+
+            m.Params.Method = 1  # dual simplex: restarts from the previous basis when limits are added
+            iterations = 1
+            while True:
+                flows = sum(matrix @ x.X[indices.ravel()] for matrix, indices in flow_terms)
+                upper_violated = np.flatnonzero(flows > capacity + flow_tolerance)
+                lower_violated = np.flatnonzero(flows < -capacity - flow_tolerance)
+                if upper_violated.size == 0 and lower_violated.size == 0:
+                    break
+
+                if upper_violated.size > 0:
+                    constraint = m.addConstr(flow(upper_violated) <= capacity[upper_violated])
+                    line_limits.append((upper_violated, constraint))
+                if lower_violated.size > 0:
+                    constraint = m.addConstr(flow(lower_violated) >= -capacity[lower_violated])
+                    line_limits.append((lower_violated, constraint))
+                m.optimize()
+                iterations += 1
+
+            m._line_limit_iterations = iterations
+            m._line_limit_constraints = sum(rows.size for rows, _ in line_limits)
+            print(
+                f"Lazy line limits: {iterations} solves, {m._line_limit_constraints} line limit"
+                f" constraints out of {2 * nbHour * nbLines}"
+            )
+        run_record.end_phase("solve", m)
 
-from scripts.plot_results import plot_results, plot_nodes
+        solution = get_values(m, x)
+        system_price = get_duals(m, constraints["balance"])
+        for rows, constraint in line_limits:
+            line_duals[rows] += get_duals(m, constraint)
 
-plot_results(nbUnits=nbUnits, results=results)
+    # A MW injected at node n changes the flows by ptdf[:, n]
+    lmp = system_price[:, None] - line_duals.reshape(nbHour, nbLines) @ ptdf
+
+    results = nodal_results(
+        *(solution[lp.variables[name]] for name in ("production", "demand_supplied", "state_of_charge", "power_injected", "power_drawn")),
+        lmp,
+    )
+    run_record.end_phase("extract")
+    if show_plots:
+        plot_results(nbUnits=nbUnits, results=results)
+        run_record.end_phase("plot")
+
+    return m, lmp, results
+
+def compare_nodal_formulations(tolerance: float = 1e-4, lazy_line_limits: bool = False):
+    """
+    Cross-checks the PTDF formulation (with lazy line limits or not) against the voltage angle formulation.
+
+    Prints the size of both LPs, the gap between their objective values and the largest LMP difference.
+
+    Returns:
+        bool: True if the objective values and the LMPs agree within tolerance.
+    """
+    m_angle, lmp_angle, _ = step4_nodal_angle()
+    m_ptdf, lmp_ptdf, _ = step4_nodal_ptdf(lazy_line_limits=lazy_line_limits)
+
+    objective_gap = abs(get_objective(m_angle) - get_objective(m_ptdf))
+    lmp_gap = np.max(np.abs(lmp_angle - lmp_ptdf))
+    print(f"Angle formulation: {m_angle.NumVars} variables, {m_angle.NumConstrs} constraints")
+    print(f"PTDF formulation:  {m_ptdf.NumVars} variables, {m_ptdf.NumConstrs} constraints")
+    print(f"Objective gap: {objective_gap}, largest LMP difference: {lmp_gap}")
+    return objective_gap <= tolerance * max(1, abs(get_objective(m_angle))) and lmp_gap <= tolerance
+
+if __name__ == "__main__":
+    generation_units.export_to_json()
+    load_units.export_to_json()
+    m, lmp, results = step4_nodal_angle(show_plots=True)
 # plot_nodes(nodes=nodes)
@@ -0,0 +1,316 @@
+import multiprocessing
+import os
+import time
+
+import gurobipy as gp
+import numpy as np
+import pandas as pd
+from gurobipy import GRB
+
+
+class ZoneSubproblem:
+    """
+    Local dispatch of one zone in the decomposition of the zonal market by ADMM (see solve_admm).
+
+    The zone clears its generators, loads and battery over the hours, and exports to each of
+    its neighbours a flow (MW, negative for an import) within the capacity between the zones.
+    It maximises its welfare minus the price of its exports and a quadratic penalty (rho / 2)
+    around the flows targeted by the coordinator. The model is built once: only the objective
+    changes from one iteration to the next.
+
+    Attributes :
+        - data (dict), the zone, see the parameters of solve_admm
+        - m (gp.Model), the local model
+        - balance (MConstr), balance of the zone at each hour, its dual is the price of the zone
+    """
+
+    def __init__(self, data:dict, rho:float, env:gp.Env=None):
+        self.data = data
+        max_production = data["max production"]
+        demand = data["demand"]
+        capacity = np.broadcast_to(data["capacity"], (demand.shape[0], len(data["neighbours"])))
+        nbHour, nbGenerators = max_production.shape
+
+        self.m = gp.Model(env=env)
+        self.production = self.m.addMVar(max_production.shape, lb=0, ub=max_production, name="power_generation")
+        self.demand_supplied = self.m.addMVar(demand.shape, lb=0, ub=demand, name="demand_supplied")
+        self.flows = self.m.addMVar(capacity.shape, lb=-capacity, ub=capacity, name="flow_interzonal")
+
+        balance = gp.MLinExpr.zeros((nbHour,))
+        if demand.shape[1] > 0:
+            balance += self.demand_supplied.sum(axis=1)
+        if nbGenerators > 0:
+            balance -= self.production.sum(axis=1)
+            ramp_up, ramp_down, prod_init = data["ramp up"], data["ramp down"], data["prod init"]
+            self.m.addConstr(self.production[0] <= prod_init + ramp_up, name="ramp_up_ini")
+            self.m.addConstr(self.production[0] >= prod_init - ramp_down, name="ramp_down_ini")
+            self.m.addConstr(self.production[1:] - self.production[:-1] <= ramp_up, name="ramp_up_constraint")
+            self.m.addConstr(self.production[1:] - self.production[:-1] >= -ramp_down, name="ramp_down_constraint")
+        if capacity.shape[1] > 0:
+            balance += self.flows.sum(axis=1)
+
+        battery = data["battery"]
+        if battery is not None:
+            efficiency, delta_t, value_init = battery["efficiency"], battery["delta_t"], battery["value_init"]
+            state_of_charge = self.m.addMVar((nbHour,), lb=battery["min_SoC"], ub=battery["max_SoC"], name="state_of_charge")
+            power_injected = self.m.addMVar((nbHour,), lb=0, ub=battery["P_max"], name="power_injected")
+            power_drawn = self.m.addMVar((nbHour,), lb=0, ub=battery["P_max"], name="power_drawn")
+            self.m.addConstr(
+                state_of_charge[1:]
+                == state_of_charge[:-1] + (-power_injected[1:] / efficiency + power_drawn[1:] * efficiency) * delta_t,
+                name="battery",
+            )
+            self.m.addConstr(state_of_charge[0] + power_injected[0] / efficiency - power_drawn[0] * efficiency == value_init)
+            self.m.addConstr(state_of_charge[-1] >= value_init)
+            balance -= power_injected - power_drawn
+
+        self.balance = self.m.addConstr(balance == 0, name="balance_constraint")
+        self.set_rho(rho)
+
+    def set_rho(self, rho:float):
+        """
+        Sets the weight of the quadratic penalty, and the welfare of the zone in the objective.
+        """
+        self.rho = rho
+        penalty = (self.flows * self.flows).sum() if self.flows.size > 0 else gp.QuadExpr()
+        self.m.setObjective(-rho / 2 * penalty, GRB.MAXIMIZE)
+        self.demand_supplied.Obj = np.broadcast_to(self.data["bid price"], self.demand_supplied.shape)
+        self.production.Obj = -np.broadcast_to(self.data["cost"], self.production.shape)
+
+    def solve(self, prices:np.array, targets:np.array, rho:float) -> dict:
+        """
+        Solves the zone with the prices (dual of the flow consistency) and the target flows of
+        its neighbours, both of shape (nbHour, number of neighbours).
+
+        Returns:
+            dict: "flows" (nbHour, number of neighbours), "prices" (the duals of the balance,
+                nbHour,), "production" and "demand" (total in the zone, nbHour,), "welfare" and
+                "runtime" (s).
+        """
+        if rho != self.rho:
+            self.set_rho(rho)
+        if self.flows.size > 0:
+            self.flows.Obj = rho * targets - prices
+        self.m.optimize()
+        if self.m.Status != GRB.OPTIMAL:
+            raise RuntimeError(f"The subproblem of zone {self.data['zone'] + 1} is not solved (status {self.m.Status}).")
+
+        production = self.production.X
+        demand_supplied = self.demand_supplied.X
+        return {
+            "flows": self.flows.X,
+            "prices": self.balance.Pi,
+            "production": production.sum(axis=1),
+            "demand": demand_supplied.sum(axis=1),
+            "welfare": float((demand_supplied * self.data["bid price"]).sum() - (production * self.data["cost"]).sum()),
+            "runtime": self.m.Runtime,
+        }
+
+
+def _new_env() -> gp.Env:
+    """
+    Gurobi environment of the subproblems of a process: silent, one thread per subproblem.
+    """
+    env = gp.Env(empty=True)
+    env.setParam("OutputFlag", 0)
+    env.setParam("Threads", 1)
+    env.start()
+    return env
+
+
+def _serve_zones(connection, zones_data:list, rho:float):
+    """
+    Worker process: builds the subproblems of its zones, then solves them at every message
+    of the coordinator (rho, {zone: (prices, targets)}) until None.
+    """
+    try:
+        env = _new_env()
+        subproblems = {data["zone"]: ZoneSubproblem(data, rho, env) for data in zones_data}
+        connection.send("ready")
+    except Exception as error:
+        connection.send(error)
+        return
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        rho, inputs = message
+        try:
+            connection.send({z: subproblems[z].solve(*inputs[z], rho) for z in subproblems})
+        except Exception as error:
+            connection.send(error)
+    env.dispose()
+
+
+class ZoneWorkers:
+    """
+    The subproblems of the zones, spread over worker processes (round robin), or solved in the
+    current process if processes is 0.
+    """
+
+    def __init__(self, zones_data:list, rho:float, processes:int=None):
+        if processes is None:
+            processes = min(len(zones_data), os.cpu_count() or 1)
+        self.connections, self.processes = [], []
+        self.subproblems = {}
+        if processes == 0:
+            self.env = _new_env()
+            self.subproblems = {data["zone"]: ZoneSubproblem(data, rho, self.env) for data in zones_data}
+            return
+
+        for worker in range(processes):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve_zones, args=(child, zones_data[worker::processes], rho), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+        for connection in self.connections:
+            self._receive(connection)
+
+    def _receive(self, connection):
+        reply = connection.recv()
+        if isinstance(reply, Exception):
+            self.close()
+            raise reply
+        return reply
+
+    def solve(self, rho:float, inputs:dict) -> dict:
+        """
+        Solves all the zones in parallel, inputs: {zone: (prices, targets)}.
+        """
+        if not self.connections:
+            return {z: subproblem.solve(*inputs[z], rho) for z, subproblem in self.subproblems.items()}
+        for connection in self.connections:
+            connection.send((rho, inputs))
+        results = {}
+        for connection in self.connections:
+            results.update(self._receive(connection))
+        return results
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+        self.connections, self.processes = [], []
+
+
+def solve_admm(
+    zones_data:list,
+    rho:float=0.1,
+    tolerance:float=0.1,
+    price_tolerance:float=0.01,
+    max_iterations:int=1000,
+    relaxation:float=1.6,
+    adaptive_iterations:int=50,
+    processes:int=None,
+    verbose:bool=False,
+):
+    """
+    Clears the zonal market by ADMM: every zone solves its own dispatch (ZoneSubproblem), in
+    parallel processes, and the coordinator makes the flows of the neighbouring zones consistent
+    (the export of a zone to another is the import of the other).
+
+    At each iteration, the target flow between two zones is the average of their two views,
+    (f_ab - f_ba) / 2 (over-relaxed), and the price of the exchange moves by rho times the half
+    mismatch (f_ab + f_ba) / 2. In the first iterations, rho is balanced (doubled if the mismatch
+    is 10 times the change of the targets, halved in the opposite case), then kept. At
+    convergence, the prices of the zones (duals of their balance) are the ones of the monolithic
+    market.
+
+    Parameters:
+        zones_data (list of dict): One dict per zone (in the order of the zones): "zone" (its
+            index), "cost" (nbGenerators,), "max production" (nbHour, nbGenerators), "ramp up",
+            "ramp down" and "prod init" (nbGenerators,), "bid price" (nbLoads,), "demand"
+            (nbHour, nbLoads), "neighbours" (indices of the zones it is linked to), "capacity"
+            (one per neighbour, MW) and "battery" (None, or a dict of "min_SoC", "max_SoC",
+            "value_init", "P_max", "efficiency" and "delta_t").
+        rho (float): The initial weight of the quadratic penalty ($/MW²).
+        tolerance (float): The largest mismatch of the flows at convergence (MW).
+        price_tolerance (float): The largest change of the target flows at convergence, times rho ($/MWh).
+        max_iterations (int): The maximum number of iterations.
+        relaxation (float): The over-relaxation of the targets, between 1 (none) and 2.
+        adaptive_iterations (int): The number of iterations in which rho is balanced.
+        processes (int): The number of worker processes, one per zone up to the number of cores
+            by default, 0 to solve the zones in the current process.
+        verbose (bool): Print the residuals at each iteration.
+
+    Returns:
+        dict: "prices" (nbHour, nbZones), "flows" (nbHour, nbZones, nbZones, from a zone to
+            another), "production" and "demand" (nbHour, nbZones), "welfare", "converged" and
+            "iterations", a pd.DataFrame of the residuals, rho and the times of each iteration.
+    """
+    nbZones = len(zones_data)
+    nbHour = zones_data[0]["demand"].shape[0]
+    neighbours = [np.asarray(data["neighbours"], dtype=int) for data in zones_data]
+
+    exchange_prices = np.zeros((nbHour, nbZones, nbZones))
+    targets = np.zeros((nbHour, nbZones, nbZones))
+    flows = np.zeros((nbHour, nbZones, nbZones))
+    prices = np.zeros((nbHour, nbZones))
+    production = np.zeros((nbHour, nbZones))
+    demand = np.zeros((nbHour, nbZones))
+    iterations = []
+    converged = False
+
+    workers = ZoneWorkers(zones_data, rho, processes)
+    try:
+        for iteration in range(1, max_iterations + 1):
+            start = time.perf_counter()
+            inputs = {z: (exchange_prices[:, z, neighbours[z]], targets[:, z, neighbours[z]]) for z in range(nbZones)}
+            results = workers.solve(rho, inputs)
+
+            previous_prices = prices.copy()
+            for z, result in results.items():
+                flows[:, z, neighbours[z]] = result["flows"]
+                prices[:, z] = result["prices"]
+                production[:, z] = result["production"]
+                demand[:, z] = result["demand"]
+            welfare = sum(result["welfare"] for result in results.values())
+
+            mismatch = flows + flows.transpose(0, 2, 1)
+            new_targets = relaxation * (flows - flows.transpose(0, 2, 1)) / 2 + (1 - relaxation) * targets
+            primal_residual = np.abs(mismatch).max()
+            dual_residual = rho * np.abs(new_targets - targets).max()
+            exchange_prices += relaxation * rho * mismatch / 2
+            targets = new_targets
+
+            iterations.append(
+                {
+                    "Iteration": iteration,
+                    "Primal residual (MW)": primal_residual,
+                    "Dual residual ($/MWh)": dual_residual,
+                    "Price change ($/MWh)": np.abs(prices - previous_prices).max(),
+                    "Rho": rho,
+                    "Welfare": welfare,
+                    "Subproblems time (s)": sum(result["runtime"] for result in results.values()),
+                    "Time (s)": time.perf_counter() - start,
+                }
+            )
+            if verbose:
+                print(f"Iteration {iteration}: primal residual {primal_residual:.4g} MW, dual residual {dual_residual:.4g} $/MWh, rho {rho:g}")
+            if primal_residual <= tolerance and dual_residual <= price_tolerance:
+                converged = True
+                break
+
+            if iteration > adaptive_iterations:
+                continue
+            if primal_residual / tolerance > 10 * dual_residual / price_tolerance:
+                rho *= 2
+            elif dual_residual / price_tolerance > 10 * primal_residual / tolerance:
+                rho /= 2
+    finally:
+        workers.close()
+
+    return {
+        "prices": prices,
+        "flows": flows,
+        "production": production,
+        "demand": demand,
+        "welfare": welfare,
+        "converged": converged,
+        "iterations": pd.DataFrame(iterations),
+    }
@@ -0,0 +1,112 @@
+import hashlib
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+
+# Sparse LU factorizations of the reduced bus susceptance matrix, and zonal PTDFs, by topology
+_factorizations = {}
+_zonal_ptdfs = {}
+
+def _key(*arrays) -> str:
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.dtype, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def generation_shift_keys(zone_labels:np.array, node_weights:np.array) -> np.array:
+    """
+    Generation shift keys (GSK): how a change of the net position of a zone is shared between its nodes.
+
+    Parameters:
+        zone_labels (np.array): The zone of each node (nbNode,), from 0 (-1 for a node in no zone).
+        node_weights (np.array): The weight of each node (nbNode,), e.g. the capacity of its generators.
+            The nodes of a zone without weight share its net position equally.
+
+    Returns:
+        np.array: The GSK matrix (nbNode x nbZones), each column sums to 1.
+    """
+    nbZones = int(zone_labels.max()) + 1
+    in_zone = zone_labels >= 0
+    gsk = np.zeros((len(zone_labels), nbZones))
+    gsk[np.flatnonzero(in_zone), zone_labels[in_zone]] = np.asarray(node_weights, dtype=float)[in_zone]
+    empty = gsk.sum(axis=0) == 0
+    gsk[:, empty] = (zone_labels[:, None] == np.flatnonzero(empty)[None, :]).astype(float)
+    return gsk / gsk.sum(axis=0)
+
+def compute_zonal_ptdf(
+    from_nodes:np.array,
+    to_nodes:np.array,
+    susceptances:np.array,
+    gsk:np.array,
+    reference_node:int=0,
+) -> np.array:
+    """
+    Computes the zonal PTDF of a DC network: PTDF[l, z] is the flow on line l (from its from node to
+    its to node) when the net position of zone z increases by 1 MW, shared between its nodes as in
+    the GSK, and the reference node balances it. The flows of balanced net positions (summing to 0)
+    do not depend on the reference node.
+
+    The nodal PTDF is never formed: the reduced bus susceptance matrix is factorized (sparse LU) and
+    solved for the nbZones columns of the GSK only. The factorization is kept for the topology, and
+    the zonal PTDF for the topology and the GSK, so that they are computed once per process.
+
+    Parameters:
+        from_nodes (np.array): The nodes where the lines originate (starting at 0).
+        to_nodes (np.array): The nodes where the lines terminate (starting at 0).
+        susceptances (np.array): The susceptances of the lines.
+        gsk (np.array): The generation shift keys (nbNode x nbZones), see generation_shift_keys.
+        reference_node (int): The reference (slack) node.
+
+    Returns:
+        np.array: The zonal PTDF matrix (nbLines x nbZones).
+    """
+    from_nodes = np.asarray(from_nodes, dtype=int)
+    to_nodes = np.asarray(to_nodes, dtype=int)
+    susceptances = np.asarray(susceptances, dtype=float)
+    nbNode, nbLines = gsk.shape[0], len(from_nodes)
+    topology = _key(from_nodes, to_nodes, susceptances, np.array([nbNode, reference_node]))
+    key = topology + _key(gsk)
+    if key in _zonal_ptdfs:
+        return _zonal_ptdfs[key]
+
+    # Line-node incidence matrix: +1 at the from node and -1 at the to node of each line
+    lines = np.arange(nbLines)
+    incidence = sp.csr_matrix(
+        (np.concatenate([np.ones(nbLines), -np.ones(nbLines)]), (np.concatenate([lines, lines]), np.concatenate([from_nodes, to_nodes]))),
+        shape=(nbLines, nbNode),
+    )
+    line_susceptance = sp.diags(susceptances) @ incidence  # flows = line_susceptance @ angles
+    others = np.delete(np.arange(nbNode), reference_node)
+    if topology not in _factorizations:
+        bus_susceptance = incidence.T @ line_susceptance
+        _factorizations[topology] = splu(bus_susceptance[others][:, others].tocsc())
+
+    angles = np.zeros((nbNode, gsk.shape[1]))
+    angles[others] = _factorizations[topology].solve(np.ascontiguousarray(gsk[others]))
+    _zonal_ptdfs[key] = line_susceptance @ angles
+    return _zonal_ptdfs[key]
+
+def critical_branches(
+    zonal_ptdf:np.array,
+    from_zones:np.array,
+    to_zones:np.array,
+    threshold:float=0.05,
+) -> np.array:
+    """
+    Selects the critical branches of the flow-based domain: the lines between two zones, and the
+    lines within a zone whose largest zone-to-zone PTDF (difference of two zonal PTDFs, the flow of
+    a 1 MW exchange between the two zones) is at least threshold.
+
+    Parameters:
+        zonal_ptdf (np.array): The zonal PTDF matrix (nbLines x nbZones).
+        from_zones, to_zones (np.array): The zones of the from and to nodes of the lines.
+        threshold (float): The smallest zone-to-zone PTDF of a critical branch (0 for all the lines).
+
+    Returns:
+        np.array: The indices of the critical branches.
+    """
+    zone_to_zone = zonal_ptdf.max(axis=1) - zonal_ptdf.min(axis=1)
+    return np.flatnonzero((from_zones != to_zones) | (zone_to_zone >= threshold))
@@ -46,9 +46,16 @@ class GenerationUnit:
 class GenerationUnits:
     def __init__(self):
         self.units = []
+        self.units_by_id = {}  # unit_id -> GenerationUnit, kept in sync by add_unit
     
     def add_unit(self, unit : GenerationUnit):
         self.units.append(unit)
+        self.units_by_id.setdefault(unit.unit_id, unit)
+
+    def remove_unit(self, unit_id:int):
+        unit = self.units_by_id.pop(unit_id)
+        self.units.remove(unit)
+        return unit
 
     def export_to_json(self):
         """
@@ -60,10 +67,10 @@ class GenerationUnits:
             outfile.write(json_object)
 
     def get_unit(self, unit_id:int):
-        for unit in self.units:
-            if unit.unit_id == unit_id:
-                return unit
-        print('No load found in LoadUnits.get_unit()')
+        unit = self.units_by_id.get(unit_id)
+        if unit is None:
+            print('No unit found in GenerationUnits.get_unit()')
+        return unit
 
     def get_cost(self, unit_id):
         unit = self.get_unit(unit_id=unit_id)
@@ -34,9 +34,16 @@ class LoadUnit:
 class LoadUnits:
     def __init__(self):
         self.units = []
+        self.units_by_id = {}  # unit_id -> LoadUnit, kept in sync by add_unit
     
     def add_unit(self, unit:LoadUnit):
         self.units.append(unit)
+        self.units_by_id.setdefault(unit.unit_id, unit)
+
+    def remove_unit(self, unit_id:int):
+        unit = self.units_by_id.pop(unit_id)
+        self.units.remove(unit)
+        return unit
 
     def export_to_json(self):
         dictionary = {f"Load unit {unit.unit_id}": unit.transform_to_dict() for unit in self.units}
@@ -48,10 +55,10 @@ class LoadUnits:
         return [unit.unit_id for unit in self.units]
 
     def get_unit(self, unit_id:int):
-        for unit in self.units:
-            if unit.unit_id == unit_id:
-                return unit
-        print('No load found in LoadUnits.get_unit()')
+        unit = self.units_by_id.get(unit_id)
+        if unit is None:
+            print('No load found in LoadUnits.get_unit()')
+        return unit
 
     def get_bid_price(self, unit_id):
         unit = self.get_unit(unit_id=unit_id)
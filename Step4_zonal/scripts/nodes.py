@@ -34,6 +34,7 @@ class Nodes:
     
     def __init__(self, list_ids:list):
         self.nodes = []
+        self.nodes_by_id = {}  # id_node -> Node, kept in sync by add_node
         for id in list_ids:
             node = Node(
                 id,
@@ -41,19 +42,25 @@ class Nodes:
                 LoadUnits(),
                 TransmissionLines()
             )
-            self.nodes.append(node)
+            self.add_node(node)
 
     def add_node(self,node:Node):
         self.nodes.append(node)
+        self.nodes_by_id.setdefault(node.id_node, node)
+
+    def remove_node(self, id_node:int):
+        node = self.nodes_by_id.pop(id_node)
+        self.nodes.remove(node)
+        return node
     
     def get_ids_node(self):
         return [node.id_node for node in self.nodes]
     
     def get_node(self, id_node:int):
-        for node in self.nodes:
-            if node.id_node == id_node:
-                return node
-        print('No node found in Nodes.get_node()')
+        node = self.nodes_by_id.get(id_node)
+        if node is None:
+            print('No node found in Nodes.get_node()')
+        return node
     
     def get_ids_load(self, id_node:int):
         node = self.get_node(id_node)
@@ -11,17 +11,16 @@ class TransmissionLine:
 class TransmissionLines:
     def __init__(self):
         self.transmissionLines = []
+        self.transmissionLines_by_nodes = {}  # (from_node, to_node) -> TransmissionLine
     
     def add_constructed_transmissionLine(self,transmissionLine:TransmissionLine):
         self.transmissionLines.append(transmissionLine)
+        self.transmissionLines_by_nodes.setdefault(
+            (transmissionLine.from_node, transmissionLine.to_node), transmissionLine
+        )
     
     def get_transmissionLine(self, from_node:int, to_node:int):
-
-        for transmissionLine in self.transmissionLines:
-            if transmissionLine.from_node == from_node:
-                if transmissionLine.to_node == to_node:
-                    return transmissionLine
-        #print('No TransmissionLine found in TransmissionLines.get_transmissionLine()')
+        return self.transmissionLines_by_nodes.get((from_node, to_node))
     
 
         
\ No newline at end of file
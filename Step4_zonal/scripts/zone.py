@@ -1,8 +1,69 @@
+import numpy as np
+import scipy.sparse as sp
+
 from scripts.nodes import Nodes
 from scripts.loadUnits import LoadUnits
 from scripts.generationUnits import GenerationUnits
 from scripts.transmissionLines import TransmissionLines
 
+class InterzonalCapacities:
+    """
+    Capacity of the transmission lines between each pair of zones, shared by the zones.
+
+    The matrix is built once from the lines and the zone of each node, in one pass over the
+    lines: a line between two zones adds its capacity to the two entries of these zones. The
+    lines of each node are kept in a sparse incidence table, so that moving a node to another
+    zone only updates its own lines.
+
+    Attributes :
+        - from_nodes, to_nodes, capacities (np.array), one value per line
+        - labels (np.array), zone of each node (-1 for a node in no zone)
+        - matrix (np.array), capacity between each pair of zones (nbZones x nbZones, 0 on the diagonal)
+    """
+
+    def __init__(self, from_nodes, to_nodes, capacities, labels, nbZones:int=None):
+        self.from_nodes = np.asarray(from_nodes, dtype=int)
+        self.to_nodes = np.asarray(to_nodes, dtype=int)
+        self.capacities = np.asarray(capacities, dtype=float)
+        self.labels = np.array(labels, dtype=int)
+        nbLines = len(self.capacities)
+        nbZones = nbZones if nbZones is not None else int(self.labels.max()) + 1
+
+        # Incidence table: the lines of each node, in a row of a sparse (nbNodes x nbLines) matrix
+        self.incidence = sp.csr_matrix(
+            (np.ones(2 * nbLines), (np.concatenate([self.from_nodes, self.to_nodes]), np.tile(np.arange(nbLines), 2))),
+            shape=(len(self.labels), nbLines),
+        )
+        self.matrix = np.zeros((nbZones, nbZones))
+        self._add_lines(np.arange(nbLines), 1)
+
+    def _add_lines(self, lines:np.array, sign:int):
+        """
+        Adds (sign 1) or removes (sign -1) the capacity of lines to the matrix, with the current labels.
+        """
+        from_zones = self.labels[self.from_nodes[lines]]
+        to_zones = self.labels[self.to_nodes[lines]]
+        between = (from_zones >= 0) & (to_zones >= 0) & (from_zones != to_zones)
+        capacities = sign * self.capacities[lines][between]
+        np.add.at(self.matrix, (from_zones[between], to_zones[between]), capacities)
+        np.add.at(self.matrix, (to_zones[between], from_zones[between]), capacities)
+
+    def get_capacity(self, from_zone:int, to_zone:int) -> float:
+        return self.matrix[from_zone, to_zone]
+
+    def set_zone(self, id_node:int, zone:int):
+        """
+        Moves a node to a zone (-1 for no zone), updating the capacity of its lines only.
+        """
+        if self.labels[id_node] == zone:
+            return
+        if zone >= self.matrix.shape[0]:
+            self.matrix = np.pad(self.matrix, (0, zone + 1 - self.matrix.shape[0]))
+        lines = self.incidence.indices[self.incidence.indptr[id_node]:self.incidence.indptr[id_node + 1]]
+        self._add_lines(lines, -1)
+        self.labels[id_node] = zone
+        self._add_lines(lines, 1)
+
 class Zone:
     """
     Represents all the nodes within a zone in a power system network.
@@ -11,19 +72,42 @@ class Zone:
         - transmissionLines (list of TransmissionLine), list of the transmission lines which are linked to the zone (i.e. to one of the node of the zone)
         - generationUnits (GenerationUnits), GenerationUnits which are linked to the zone
         - loadUnits (LoadUnits), LoadUnits which are linked to the zone
+        - zone_id (int), index of the zone in the capacities between the zones
+        - interzonalCapacities (InterzonalCapacities), capacities between the zones, shared by the zones (None to compute them from the nodes)
     """
 
-    def __init__(self, list_ids:list):
+    def __init__(self, list_ids:list, zone_id:int=None, interzonalCapacities:InterzonalCapacities=None):
         self.nodes = Nodes(list_ids)
         self.transmissionLines = TransmissionLines()
         self.generationUnits = GenerationUnits()
         self.loadUnits = LoadUnits()
+        self.zone_id = zone_id
+        self.interzonalCapacities = interzonalCapacities
+        if interzonalCapacities is not None:
+            for id_node in list_ids:
+                interzonalCapacities.set_zone(id_node, zone_id)
 
     def add_node(self, node: Nodes):
         """
         Add a node which already exists
         """
         self.nodes.add_node(node)
+        if self.interzonalCapacities is not None:
+            self.interzonalCapacities.set_zone(node.id_node, self.zone_id)
+
+    def move_node(self, id_node:int, to_zone):
+        """
+        Move a node of the zone to another zone, with its generation and load units and the
+        capacities between the zones.
+        """
+        node = self.nodes.remove_node(id_node)
+        to_zone.add_node(node)
+        for unit in node.generationUnits.units:
+            if unit.unit_id in self.generationUnits.units_by_id:
+                to_zone.generationUnits.add_unit(self.generationUnits.remove_unit(unit.unit_id))
+        for unit in node.loadUnits.units:
+            if unit.unit_id in self.loadUnits.units_by_id:
+                to_zone.loadUnits.add_unit(self.loadUnits.remove_unit(unit.unit_id))
 
     def get_id_loads(self):
         """
@@ -59,18 +143,20 @@ class Zone:
 
     def add_generationUnits(self):
         """
-        Complete self.generationUnits with the GenerationUnits located at the zone nodes
+        Rebuild self.generationUnits from the GenerationUnits located at the zone nodes
         """
 
+        self.generationUnits = GenerationUnits()
         for node in self.nodes.nodes:
             for unit in node.generationUnits.units:
                 self.generationUnits.add_unit(unit)
 
     def add_loadUnits(self):
         """
-        Complete self.loadUnits with the LoadUnits located at the zone nodes
+        Rebuild self.loadUnits from the LoadUnits located at the zone nodes
         """
 
+        self.loadUnits = LoadUnits()
         for node in self.nodes.nodes:
             for unit in node.loadUnits.units:
                 self.loadUnits.add_unit(unit)
@@ -81,13 +167,15 @@ class Zone:
 
         Inputs: the other zone
         """
-        
-        max_capacity = 0 
-        for from_id in self.get_id_nodes():
-            for to_id in to_zone.get_id_nodes():
-                try:
-                    max_capacity += self.nodes.get_transmissionLine(from_id,to_id).capacity
-                except:
-                    pass
+        if self.interzonalCapacities is not None and to_zone.interzonalCapacities is self.interzonalCapacities:
+            return self.interzonalCapacities.get_capacity(self.zone_id, to_zone.zone_id)
+
+        # Zones without shared capacities: sum of the lines from the nodes of the zone to the other zone
+        to_ids = set(to_zone.get_id_nodes())
+        max_capacity = 0
+        for node in self.nodes.nodes:
+            for transmission_line in node.transmissionLines.transmissionLines:
+                if transmission_line.to_node in to_ids:
+                    max_capacity += transmission_line.capacity
         return max_capacity
 
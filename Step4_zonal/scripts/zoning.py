@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.cluster.vq import kmeans2
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import eigsh
+
+from scripts.nodes import Nodes
+from scripts.zone import Zone, InterzonalCapacities
+
+def network_graph(transmission_data:pd.DataFrame, nbNode:int=None, weight:str="susceptance") -> sp.csr_matrix:
+    """
+    Weighted adjacency matrix of the network, symmetric (nbNode x nbNode).
+
+    Parameters:
+        transmission_data (pd.DataFrame): The lines, "from" and "to" (node ids starting at 0),
+            "reactance" and "capacity", as in transmission_parameters.csv.
+        nbNode (int): The number of nodes, the largest node id + 1 by default.
+        weight (str): The weight of a line, "susceptance" (1 / reactance: the nodes the most
+            coupled electrically are in the same zone) or "capacity".
+    """
+    if weight not in ("susceptance", "capacity"):
+        raise ValueError('weight must be "susceptance" or "capacity".')
+    from_nodes = transmission_data["from"].values.astype(int)
+    to_nodes = transmission_data["to"].values.astype(int)
+    nbNode = nbNode if nbNode is not None else int(max(from_nodes.max(), to_nodes.max())) + 1
+    weights = 1 / transmission_data["reactance"].values if weight == "susceptance" else transmission_data["capacity"].values
+    adjacency = sp.csr_matrix((weights.astype(float), (from_nodes, to_nodes)), shape=(nbNode, nbNode))
+    adjacency = adjacency + adjacency.T
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+    return adjacency
+
+def _connect_zones(adjacency:sp.csr_matrix, labels:np.array) -> np.array:
+    """
+    Makes every zone connected: the parts of a zone cut from its largest part join the
+    neighbouring zone to which they are the most linked.
+    """
+    labels = labels.copy()
+    nbZones = labels.max() + 1
+    for _ in range(nbZones):
+        changed = False
+        for zone in range(nbZones):
+            zone_nodes = np.flatnonzero(labels == zone)
+            nbParts, parts = connected_components(adjacency[zone_nodes][:, zone_nodes], directed=False)
+            if nbParts <= 1:
+                continue
+            largest = np.bincount(parts).argmax()
+            for part in range(nbParts):
+                if part == largest:
+                    continue
+                part_nodes = zone_nodes[parts == part]
+                links = adjacency[part_nodes].tocoo()
+                to_zones = labels[links.col]
+                others = to_zones != zone
+                if not others.any():  # isolated from the rest of the grid
+                    continue
+                labels[part_nodes] = np.bincount(to_zones[others], weights=links.data[others], minlength=nbZones).argmax()
+                changed = True
+        if not changed:
+            break
+    return labels
+
+def spectral_zones(
+    transmission_data:pd.DataFrame,
+    nbZones:int=3,
+    nbNode:int=None,
+    weight:str="susceptance",
+    nbRestarts:int=10,
+    seed:int=0,
+) -> np.array:
+    """
+    Splits the nodes into nbZones zones by spectral clustering of the network graph.
+
+    The nodes are embedded with the eigenvectors of the nbZones smallest eigenvalues of the
+    normalised Laplacian of the graph (sparse, solved by shift-invert), normalised by row, then
+    clustered by k-means (best of nbRestarts). A part of a zone cut from the rest of the zone
+    joins its most linked neighbouring zone, so that every zone is connected.
+
+    Parameters:
+        transmission_data (pd.DataFrame): The lines, see network_graph.
+        nbZones (int): The number of zones.
+        nbNode (int): The number of nodes, see network_graph.
+        weight (str): The weight of the lines, see network_graph.
+        nbRestarts (int): The number of runs of k-means, from different random centers.
+        seed (int): The seed of k-means.
+
+    Returns:
+        np.array: The zone of each node (nbNode,), from 0 to nbZones - 1, the zones being
+            numbered in the order of their first node.
+    """
+    adjacency = network_graph(transmission_data, nbNode, weight)
+    nbNode = adjacency.shape[0]
+    if not 1 <= nbZones < nbNode:
+        raise ValueError(f"The number of zones must be between 1 and {nbNode - 1}.")
+    if nbZones == 1:
+        return np.zeros(nbNode, dtype=int)
+
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    scale = sp.diags(np.where(degree > 0, 1 / np.sqrt(np.where(degree > 0, degree, 1)), 0))
+    laplacian = sp.identity(nbNode, format="csc") - scale @ adjacency @ scale
+    if nbNode <= 200:
+        _, vectors = np.linalg.eigh(laplacian.toarray())
+        embedding = vectors[:, :nbZones]
+    else:
+        _, embedding = eigsh(laplacian.tocsc(), k=nbZones, sigma=-1e-3, which="LM")
+    embedding = embedding / np.maximum(np.linalg.norm(embedding, axis=1, keepdims=True), 1e-12)
+
+    rng = np.random.default_rng(seed)
+    best_labels, best_inertia = None, np.inf
+    for _ in range(nbRestarts):
+        centroids, labels = kmeans2(embedding, nbZones, minit="++", seed=rng)
+        inertia = ((embedding - centroids[labels]) ** 2).sum()
+        if inertia < best_inertia and len(np.unique(labels)) == nbZones:
+            best_labels, best_inertia = labels, inertia
+    if best_labels is None:
+        raise ValueError(f"The grid cannot be split into {nbZones} zones.")
+
+    labels = _connect_zones(adjacency, best_labels)
+    _, first_nodes = np.unique(labels, return_index=True)
+    order = np.unique(labels)[np.argsort(first_nodes)]
+    renumber = np.empty(nbZones, dtype=int)
+    renumber[order] = np.arange(len(order))
+    return renumber[labels]
+
+def create_zones(nodes:Nodes, labels:np.array, interzonalCapacities:InterzonalCapacities=None) -> list:
+    """
+    Creates the Zone objects of a zoning (e.g. of spectral_zones), with their nodes, lines and units.
+
+    Parameters:
+        nodes (Nodes): All the nodes, with their units and lines.
+        labels (np.array): The zone of each node, from 0 (-1 for a node in no zone).
+        interzonalCapacities (InterzonalCapacities): The capacities between the zones, shared by the zones.
+
+    Returns:
+        list of Zone: The zones, in the order of their labels.
+    """
+    zones = [Zone([], zone_id=zone_id, interzonalCapacities=interzonalCapacities) for zone_id in range(int(labels.max()) + 1)]
+    for node in nodes.nodes:
+        if labels[node.id_node] >= 0:
+            zones[labels[node.id_node]].add_node(node)
+    for zone in zones:
+        zone.add_transmissionLines()
+        zone.add_generationUnits()
+        zone.add_loadUnits()
+    return zones
+
+def write_zones(labels:np.array, path:str="zones.csv"):
+    """
+    Writes a zoning as zones.csv (node;zone, numbered from 1 as in the other csv files), read by Step4_zonal with the inputs.
+    """
+    nodes = np.flatnonzero(labels >= 0)
+    pd.DataFrame({"node": nodes + 1, "zone": labels[nodes] + 1}).to_csv(path, sep=";", index=False)
@@ -1,14 +1,33 @@
+import os
+import sys
 import pandas as pd
 import gurobipy as gp
 import numpy as np
-from gurobipy import GRB
+import scipy.sparse as sp
+
+# Modules shared by the steps (utils) are at the root of the repository
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.linearProgram import LinearProgram
+from utils.results import get_values, get_duals
+from utils.cache import optimize, result_cache
+from utils.inputStore import load_input_store
+from utils.instrumentation import start_run
+
+# Phases of the run, recorded if INSTRUMENTATION_FILE is set (see utils.instrumentation)
+run_record = start_run("step4_zonal")
+
+# Inputs read from the columnar store of inputs/ (converted from the csv files at the first run)
+input_store = load_input_store()
+horizon = input_store.nbRows("load_profile")  # Number of hours of the inputs
+run_record.end_phase("inputs")
 
 ################################################################################
 # Initialisaiton of nodes
 ################################################################################
 from scripts.nodes import Nodes
 
-nbNode = [i for i in range(24)]
+transmission_nodes = np.concatenate([input_store.column("transmission_parameters", column) for column in ("from", "to")])
+nbNode = [i for i in range(int(transmission_nodes.max()))]
 nodes = Nodes(list_ids=nbNode)
 
 ################################################################################
@@ -18,7 +37,7 @@ nodes = Nodes(list_ids=nbNode)
 from scripts.generationUnits import GenerationUnits,GenerationUnit
 
 # parameter unit
-generationUnits_parameters = pd.read_csv("../inputs/gen_parameters.csv", sep=";")
+generationUnits_parameters = input_store.table("gen_parameters")
 nodes_ids = generationUnits_parameters["Node"].values - 1
 costs = generationUnits_parameters["Ci"].values
 pmax = generationUnits_parameters["Pmax"].values
@@ -41,7 +60,7 @@ for unit_id in range(nbUnitsConventionnal):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=[1] * 24,  # 100% availability for each hour
+        availability=[1] * horizon,  # 100% availability for each hour
         ramp_up=ramp_up[unit_id],
         ramp_down=ramp_down[unit_id],
         prod_init=prod_init[unit_id],
@@ -53,7 +72,7 @@ for unit_id in range(nbUnitsConventionnal):
 # Adding of the Wind Generation Units
 ################################################################################
 
-wind_parameters = pd.read_csv("../inputs/wind_parameters.csv", index_col="Unit", sep=";")
+wind_parameters = input_store.table("wind_parameters", index_col="Unit")
 nodes_ids = wind_parameters["Node"].values - 1
 pmax = wind_parameters["Pmax"].values
 pmin = wind_parameters["Pmin"].values
@@ -63,11 +82,10 @@ scenario = "V1"  # scenario : from V1 to V100
 
 nbUnitsWind = wind_parameters.shape[0]
 nbUnits = nbUnitsConventionnal + nbUnitsWind
+wind_availability = input_store.scenarios("scen_zoneW", zones=range(nbUnitsWind), hours=horizon, scenarios=[scenario])[:, :, 0]
 for id in range(nbUnitsWind):
 
-    availability = pd.read_csv(f"../inputs/data/scen_zoneW{id}.csv", sep=",")[
-        scenario
-    ].values.tolist()
+    availability = wind_availability[id].tolist()
 
     node_id = nodes_ids[id]
     generationUnit = GenerationUnit(
@@ -77,7 +95,7 @@ for id in range(nbUnitsWind):
         cost=costs[id],
         pmax=pmax[id],
         pmin=pmin[id],
-        availability=availability[:24],
+        availability=availability,
         ramp_up=10000,  # big M, for no constraint on rampu_up
         ramp_down=0,
         prod_init=0,
@@ -92,10 +110,10 @@ for id in range(nbUnitsWind):
 from scripts.loadUnits import LoadUnits, LoadUnit
 
 # parameter load
-total_needed_demand = pd.read_csv("../inputs/load_profile.csv", sep=";")["total_demand"].values
+total_needed_demand = input_store.table("load_profile")["total_demand"].values
 nbHour = total_needed_demand.shape[0]
 
-load_location = pd.read_csv("../inputs/load_location.csv", index_col="load_number", sep=";")
+load_location = input_store.table("load_location", index_col="load_number")
 nodes_ids = load_location["node"].values - 1
 load_percentage = load_location["load_percentage"].values
 
@@ -113,13 +131,14 @@ for unit_id in range(nbLoadUnits):
     )
     nodes.add_loadUnit(id_node=node_id,loadUnit=loadUnit)
     loadUnits.add_unit(loadUnit)
+run_record.end_phase("units")
 
 ################################################################################
 # Creation of Transmission Lines
 ################################################################################
 from scripts.transmissionLines import TransmissionLine
 
-transmission_data = pd.read_csv("../inputs/transmission_parameters.csv", sep=";")
+transmission_data = input_store.table("transmission_parameters")
 transmission_data["from"] += - 1
 transmission_data["to"] += - 1
 
@@ -147,44 +166,33 @@ for node in nodes.nodes:
 # Create the Zones
 ################################################################################
 
-from scripts.zone import Zone
-
-# Python convention
-node_ids_zone1 = [2, 13, 14, 15, 16, 17, 20, 21, 23]  # Id of the nodes in zone 1
-node_ids_zone2 = [5, 9, 11, 12, 18, 19, 22]  # Id of the nodes in zone 2
-node_ids_zone3 = [0, 1, 3, 4, 6, 7, 8, 10]  # Id of the nodes in zone 3
-
-zone1 = Zone([])
-zone2 = Zone([])
-zone3 = Zone([])
-
-for node in nodes.nodes:
-
-    if node.id_node in node_ids_zone1:
-        zone1.add_node(node)
-        print(f"Add node {node.id_node + 1 } in zone 1")
-    elif node.id_node in node_ids_zone2:
-        zone2.add_node(node)
-        print(f"Add node {node.id_node + 1} in zone 2")
-    elif node.id_node in node_ids_zone3:
-        zone3.add_node(node)
-        print(f"Add node {node.id_node + 1} in zone 3")
-    else:
-        print("Is not in a zone ?")
-
-zone1.add_transmissionLines()
-zone1.add_generationUnits()
-zone1.add_loadUnits()
-
-zone2.add_transmissionLines()
-zone2.add_generationUnits()
-zone2.add_loadUnits()
-
-zone3.add_transmissionLines()
-zone3.add_generationUnits()
-zone3.add_loadUnits()
-
-zones = [zone1, zone2, zone3]
+from scripts.zone import InterzonalCapacities
+from scripts.zoning import spectral_zones, create_zones
+
+nbZones = 3  # Number of zones, when they are computed (grids other than the 24-bus system without zones.csv)
+
+# Zone of each node (Python convention)
+zone_labels = np.full(len(nodes.nodes), -1)
+if input_store.has_table("zones"):
+    # Zones given with the inputs (zones.csv, node and zone ids starting at 1 as in the other csv files)
+    zone_data = input_store.table("zones")
+    zone_labels[zone_data["node"].values - 1] = zone_data["zone"].values - 1
+elif len(nodes.nodes) == 24:
+    node_ids_zone1 = [2, 13, 14, 15, 16, 17, 20, 21, 23]  # Id of the nodes in zone 1
+    node_ids_zone2 = [5, 9, 11, 12, 18, 19, 22]  # Id of the nodes in zone 2
+    node_ids_zone3 = [0, 1, 3, 4, 6, 7, 8, 10]  # Id of the nodes in zone 3
+    for zone_id, node_ids_zone in enumerate([node_ids_zone1, node_ids_zone2, node_ids_zone3]):
+        zone_labels[node_ids_zone] = zone_id
+else:
+    # Zones of the network graph (spectral clustering, see scripts/zoning.py)
+    zone_labels = spectral_zones(transmission_data, nbZones, len(nodes.nodes))
+
+# Capacities between the zones, from the zone of each node (updated if a node changes zone)
+interzonal_capacities = InterzonalCapacities(
+    transmission_data["from"], transmission_data["to"], transmission_data["capacity"], zone_labels
+)
+zones = create_zones(nodes, zone_labels, interzonal_capacities)
+run_record.end_phase("zones")
 
 ################################################################################
 # Adding of the battery
@@ -196,227 +204,443 @@ value_init = max_SoC / 2
 P_max = 150  # MW
 delta_t = 1  # hour
 
+################################################################################
+# Flow-based domain
+################################################################################
+from scripts.flowBased import generation_shift_keys, compute_zonal_ptdf, critical_branches
+
+def flow_based_domain(threshold:float=0.05, reliability_margin:float=0.0):
+    """
+    Flow-based domain of the zones (see build_model with coupling="flow-based"): the flows on the
+    critical branches are the zonal PTDF times the net positions of the zones, within their
+    remaining available margins (RAM). The GSK of a zone is proportional to the capacity of the
+    conventional units at its nodes. The zonal PTDF is computed once per topology and zoning.
+
+    Parameters:
+        threshold (float): The smallest zone-to-zone PTDF of a critical branch within a zone (see critical_branches).
+        reliability_margin (float): The share of the capacity of the critical branches kept for the uncertainties.
+
+    Returns:
+        zonal_ptdf (np.array): The zonal PTDF of the critical branches (nbCriticalBranches x nbZones).
+        ram (np.array): Their remaining available margins (nbCriticalBranches,).
+        branches (np.array): Their indices in transmission_data.
+    """
+    zone_labels = interzonal_capacities.labels
+    conventional_units = [unit for unit in generationUnits.units if unit.unit_type == "conventionnal"]
+    node_weights = np.bincount(
+        [unit.node_id for unit in conventional_units], weights=[unit.pmax for unit in conventional_units], minlength=len(nodes.nodes)
+    )
+    gsk = generation_shift_keys(zone_labels, node_weights)
+
+    from_nodes = transmission_data["from"].values
+    to_nodes = transmission_data["to"].values
+    zonal_ptdf = compute_zonal_ptdf(from_nodes, to_nodes, 1 / transmission_data["reactance"].values, gsk)
+    branches = critical_branches(zonal_ptdf, zone_labels[from_nodes], zone_labels[to_nodes], threshold)
+    ram = transmission_data["capacity"].values[branches] * (1 - reliability_margin)
+    return zonal_ptdf[branches], ram, branches
+
 ################################################################################
 # Model
 ################################################################################
 
-def run_model():
-    m = gp.Model()
-
-    # Variables
-    production = m.addMVar(shape=(nbHour, nbUnits), lb=0, name="power_generation", vtype=GRB.CONTINUOUS)
-    demand_supplied = m.addMVar(shape=(nbHour, nbLoadUnits), lb=0, name=f"demand_supplied", vtype=GRB.CONTINUOUS)
-    state_of_charge = m.addMVar(
-        shape=(nbHour,),
-        lb=min_SoC,
-        ub=max_SoC,
-        name=f"state_of_charge",
-        vtype=GRB.CONTINUOUS,
+def build_zonal_linear_program(coupling:str="atc", threshold:float=0.05, reliability_margin:float=0.0, battery_zone:int=2):
+    """
+    Builds the zonal day-ahead market as a LinearProgram, independent of the solver.
+
+    With coupling="atc", the flow between two zones is limited by the sum of the capacities of
+    the lines between them. With coupling="flow-based", the net positions of the zones (their
+    exports) are limited by the flows they induce on the critical branches of the network,
+    loop flows included (see flow_based_domain, for threshold and reliability_margin); the
+    flows between the zones are then the commercial exchanges.
+
+    Parameters:
+        battery_zone (int): Index of the zone of the battery (the third zone).
+
+    Returns:
+        LinearProgram: The program. Its blocks of variables are "production" (nbHour, nbUnits),
+            "demand_supplied" (nbHour, nbLoadUnits), "state_of_charge", "power_injected",
+            "power_drawn" (nbHour,) and "flow_interzonal" (nbHour, nbZones, nbZones); the maximum
+            production and demand, the battery power and capacity and the ATC limits are bounds.
+            The duals of its "balance" constraints (rows ordered by zone, then hour) are the prices
+            of the zones. With the flow-based coupling, "critical_branch_max" and "critical_branch_min"
+            are the limits of the critical branches (rows ordered by hour, then branch).
+    """
+    if coupling not in ("atc", "flow-based"):
+        raise ValueError('coupling must be "atc" or "flow-based".')
+    nbZones = len(zones)
+    lp = LinearProgram(sense="max")
+
+    # Zone of each unit (-1 for the units at a node in no zone, which are not in the market)
+    unit_zone = np.full(nbUnits, -1)
+    load_zone = np.full(nbLoadUnits, -1)
+    for z, zone in enumerate(zones):
+        unit_zone[zone.get_id_generators()] = z
+        load_zone[zone.get_id_loads()] = z
+    generators = np.flatnonzero(unit_zone >= 0)
+    loads = np.flatnonzero(load_zone >= 0)
+    in_market = unit_zone >= 0
+    load_in_market = load_zone >= 0
+    generation_zones = sp.csr_matrix((np.ones(len(generators)), (unit_zone[generators], generators)), shape=(nbZones, nbUnits))
+    load_zones = sp.csr_matrix((np.ones(len(loads)), (load_zone[loads], loads)), shape=(nbZones, nbLoadUnits))
+
+    cost = np.array([generationUnits.get_cost(g) for g in range(nbUnits)], dtype=float)
+    max_production = np.array(
+        [generationUnits.get_pmax(g) * np.asarray(generationUnits.get_availability(g), dtype=float)[:nbHour] for g in range(nbUnits)]
+    ).T
+    bid_price = np.array([loadUnits.get_bid_price(l) for l in range(nbLoadUnits)], dtype=float)
+    needed_demand = np.array([loadUnits.get_total_needed_demand(l)[:nbHour] for l in range(nbLoadUnits)], dtype=float).T
+
+    # Flows between the zones: none within a zone, limited by the ATC between two zones
+    flow_bound = np.full((nbZones, nbZones), np.inf)
+    if coupling == "atc":
+        for z, zone_z in enumerate(zones):
+            for notz, notzone_z in enumerate(zones):
+                if z != notz:
+                    flow_bound[z, notz] = zone_z.compute_capacity_between_zones(notzone_z)
+                    print(f"Max capacity between zone {z+1} and zone {notz+1}", flow_bound[z, notz])
+    np.fill_diagonal(flow_bound, 0)
+
+    # Variables (the upper bounds hold the P_max and needed demand constraints)
+    production = lp.add_variables(
+        "production", (nbHour, nbUnits), ub=np.where(in_market, max_production, np.inf), obj=-cost * in_market
     )
-    power_injected = m.addMVar(
-        shape=(nbHour,),
-        lb=0,
-        ub=P_max,
-        name=f"power_injected",
-        vtype=GRB.CONTINUOUS,
+    demand_supplied = lp.add_variables(
+        "demand_supplied", (nbHour, nbLoadUnits), ub=np.where(load_in_market, needed_demand, np.inf), obj=bid_price * load_in_market
     )
-    power_drawn = m.addMVar(
-        shape=(nbHour,),
-        lb=0,
-        ub=P_max,
-        name=f"power_drawn",
-        vtype=GRB.CONTINUOUS,
+    state_of_charge = lp.add_variables("state_of_charge", (nbHour,), lb=min_SoC, ub=max_SoC)
+    power_injected = lp.add_variables("power_injected", (nbHour,), ub=P_max)
+    power_drawn = lp.add_variables("power_drawn", (nbHour,), ub=P_max)
+    flow_interzonal = lp.add_variables(
+        "flow_interzonal", (nbHour, nbZones, nbZones), lb=-flow_bound, ub=flow_bound  # a negative flow is an import
     )
-    flow_interzonal = m.addMVar(
-        shape=(nbHour, len(zones), len(zones)),
-        name=f"flow_interzonal",
-        vtype=GRB.CONTINUOUS,
+
+    # Supplied demand match generation in each zone, rows (zone, hour)
+    hours = sp.identity(nbHour, format="csr")
+    battery = sp.kron(sp.csr_matrix(np.eye(nbZones)[:, [battery_zone]]) if battery_zone < nbZones else sp.csr_matrix((nbZones, 1)), hours)
+    lp.add_constraints(
+        "balance",
+        [
+            (sp.kron(load_zones, hours), demand_supplied.T),
+            (-sp.kron(generation_zones, hours), production.T),
+            (-battery, power_injected),
+            (battery, power_drawn),
+            (sp.kron(sp.identity(nbZones * nbHour), np.ones((1, nbZones))), flow_interzonal.transpose(1, 0, 2)),
+        ],
+        "=",
+        0,
     )
 
-    # Objective function
-    objective = gp.quicksum(
-        gp.quicksum( gp.quicksum(
-            demand_supplied[t, l] * zone.loadUnits.get_bid_price(l)
-            for l in zone.get_id_loads()
-        )
-        for zone in zones
-    ) 
-    - gp.quicksum(
-        sum(
-            production[t, g] * zone.generationUnits.get_cost(g)
-            for g in zone.get_id_generators()
-        )
-        for zone in zones
+    # Ramp-up and ramp-down constraints of the units of the market, rows (unit, hour)
+    ramp = sp.kron(sp.identity(len(generators)), sp.identity(nbHour) - sp.eye(nbHour, k=-1), format="csr")
+    first_hour = (np.arange(nbHour) == 0)[None, :]
+    prod_init = np.array([generationUnits.get_prod_init(g) for g in generators], dtype=float)[:, None]
+    ramp_up = np.array([generationUnits.get_ramp_up(g) for g in generators], dtype=float)[:, None]
+    ramp_down = np.array([generationUnits.get_ramp_down(g) for g in generators], dtype=float)[:, None]
+    lp.add_constraints("ramp_up", [(ramp, production[:, generators].T)], "<", (ramp_up + prod_init * first_hour).ravel())
+    lp.add_constraints("ramp_down", [(ramp, production[:, generators].T)], ">", (-ramp_down + prod_init * first_hour).ravel())
+
+    # Battery constraints
+    charge = sp.identity(nbHour, format="csr")[1:]
+    lp.add_constraints(
+        "battery",
+        [
+            ((sp.identity(nbHour) - sp.eye(nbHour, k=-1)).tocsr()[1:], state_of_charge),
+            (charge * delta_t / efficiency, power_injected),
+            (-charge * delta_t * efficiency, power_drawn),
+        ],
+        "=",
+        0,
+    )
+    first = sp.csr_matrix(np.eye(1, nbHour))
+    lp.add_constraints(
+        "initial_state_of_charge",
+        [(first, state_of_charge), (first / efficiency, power_injected), (-first * efficiency, power_drawn)],
+        "=",
+        value_init,
     )
-    for t in range(nbHour)
+    lp.add_constraints("final_state_of_charge", [(sp.csr_matrix(np.eye(1, nbHour, nbHour - 1)), state_of_charge)], ">", value_init)
+
+    # The flow from zone z to zone notz is the opposite of the flow from notz to z
+    upper = np.triu_indices(nbZones, k=1)
+    pairs = sp.identity(nbHour * len(upper[0]), format="csr")
+    lp.add_constraints(
+        "flow_antisymmetry",
+        [(pairs, flow_interzonal[:, upper[0], upper[1]]), (pairs, flow_interzonal[:, upper[1], upper[0]])],
+        "=",
+        0,
     )
-    m.setObjective(objective, GRB.MAXIMIZE)
 
-    # Constraints
+    # Flow-based constraints: flows on the critical branches induced by the net positions,
+    # the net position of zone z being the sum of flow_interzonal[t, z, :]
+    if coupling == "flow-based":
+        zonal_ptdf, ram, branches = flow_based_domain(threshold, reliability_margin)
+        print(f"Flow-based domain: {len(branches)} critical branches")
+        aggregation = sp.kron(sp.identity(nbZones), np.ones((1, nbZones)), format="csr")
+        branch_flows = [(sp.kron(hours, sp.csr_matrix(zonal_ptdf) @ aggregation, format="csr"), flow_interzonal)]
+        lp.add_constraints("critical_branch_max", branch_flows, "<", np.tile(ram, nbHour))
+        lp.add_constraints("critical_branch_min", branch_flows, ">", -np.tile(ram, nbHour))
+
+    return lp
+
+def build_model(coupling:str="atc", threshold:float=0.05, reliability_margin:float=0.0):
+    """
+    Builds, without solving it, the Gurobi model of build_zonal_linear_program.
+
+    Returns:
+        m (gp.Model): the model.
+        variables (dict): "production", "demand supplied", "state of charge",
+            "power injected", "power drawn" and "flow interzonal" MVars, in the shapes of
+            build_zonal_linear_program.
+        constraints (dict): the MConstr of each block of build_zonal_linear_program.
+    """
+    lp = build_zonal_linear_program(coupling, threshold, reliability_margin)
+    m, x, constraints = lp.to_gurobi()
+    variables = {
+        name.replace("_", " "): x[indices.ravel()].reshape(indices.shape) for name, indices in lp.variables.items()
+    }
+    return m, variables, constraints
+
+def run_model(
+    m:gp.Model=None,
+    variables:dict=None,
+    constraints:dict=None,
+    use_cache:bool=False,
+    coupling:str="atc",
+    solver:str="gurobi",
+):
+    """
+    Clears the zonal day-ahead market: builds the model (unless given, e.g. by
+    ZonalMarket, with the coupling of build_model), optimizes it and prints the
+    prices, productions, demands and flows.
+
+    With use_cache (off by default), the solution is read from the result cache
+    (utils.cache) if the same market was already cleared; the returned model is then
+    not solved: read its solution with utils.results.
+
+    Parameters:
+        solver (str): "gurobi" or "highs" (no licence needed, without a given model nor the cache).
+
+    Returns:
+        m (gp.Model or LinearProgramSolution): The solved model (Gurobi) or the solution (other solvers).
+        tuple of pd.DataFrame: See zonal_results.
+    """
+    run_record.start_phase("run_model", profile=True)
+    if solver != "gurobi":
+        if m is not None:
+            raise ValueError("A given model is solved with Gurobi, use solver='gurobi'.")
+        lp = build_zonal_linear_program(coupling)
+        run_record.end_phase("build", lp)
+        m = lp.solve(solver)
+        run_record.end_phase("solve", m)
+        values = {name: m.get_values(name) for name in ("production", "demand_supplied", "flow_interzonal")}
+        prices = m.get_duals("balance").reshape(len(zones), nbHour).T
+    else:
+        if m is None:
+            m, variables, constraints = build_model(coupling)
+        run_record.end_phase("build", m)
+        optimize(m, result_cache if use_cache else None)
+        run_record.end_phase("solve", m)
+        values = {
+            name.replace(" ", "_"): get_values(m, variables[name]) for name in ("production", "demand supplied", "flow interzonal")
+        }
+        prices = get_duals(m, constraints["balance"]).reshape(len(zones), nbHour).T
+
+    prices_df, production_demand_df, flows_between_zones_df = zonal_results(
+        prices, values["production"], values["demand_supplied"], values["flow_interzonal"]
+    )
 
-    # generation unitsP have a P_max
-    max_prod_constraint = [
-        m.addConstr(
-            production[t, g]
-            <= zone.generationUnits.get_pmax(g)
-            * zone.generationUnits.get_availability(g)[t],
-            name=f"max_prod_constraint_{t}_{g}"
-        )
-        for t in range(nbHour)
-        for zone in zones
-        for g in zone.get_id_generators()
-    ]
+    # Affichage des DataFrames
+    print("Prix dans les zones:")
+    print(prices_df)
+    print("\nProduction et demande dans chaque zone:")
+    print(production_demand_df)
+    print("\nFlux entre les zones:")
+    print(flows_between_zones_df)
+    run_record.end_phase("extract")
 
+    return m,prices_df, production_demand_df, flows_between_zones_df
 
-    # Cannot supply more than necessary
-    max_demand_supplied_constraint = [
-        m.addConstr(
-            demand_supplied[t, l] <= zone.loadUnits.get_total_needed_demand(l)[t],
-            name=f"max_demand_supplied_constraint_{t}_{l}"
-        )
-        for t in range(nbHour)
-        for zone in zones
-        for l in zone.get_id_loads()
-    ]
-
-    # Supplied demand match generation
-    balance_constraint = []
-    for z, zone in zip(range(len(zones)), zones):
-        liste = []
-        for t in range(nbHour):
-            constraint = m.addConstr(
-                sum(demand_supplied[t, l] for l in zone.get_id_loads())
-                - gp.quicksum(production[t, g] for g in zone.get_id_generators())
-                - (power_injected[t] - power_drawn[t]) * (z == 2)
-                + sum(flow_interzonal[t, z, notz] for notz in range(len(zones)))
-                == 0,
-                name=f"balance_constraint_{z}_{t}"
-            )
-            liste.append(constraint)
-        balance_constraint.append(liste)
-
-    # Ramp-up and ramp-down constraint
-    ramp_up_constraint = []
-    ramp_down_constraint = []
-    for zi, zoneZ in zip(range(len(zones)), zones):  # for each zones:
-        for g in zoneZ.get_id_generators():
-            for t in range(nbHour):
-                if t == 0:  # Apply the special condition for t=0
-                    ramp_up_constraint.append(
-                        m.addConstr(
-                            production[t, g]
-                            <= zoneZ.generationUnits.get_prod_init(g)
-                            + zoneZ.generationUnits.get_ramp_up(g),
-                            name=f"ramp_up_ini_{t}_{g}_{zi}",
-                        )
-                    )
-                    ramp_down_constraint.append(
-                        m.addConstr(
-                            production[t, g]
-                            >= zoneZ.generationUnits.get_prod_init(g)
-                            - zoneZ.generationUnits.get_ramp_down(g),
-                            name=f"ramp_down_ini_{t}_{g}_{zi}",
-                        )
-                    )
-                else:  # Apply the regular ramp-down constraint for t>0
-                    ramp_up_constraint.append(
-                        m.addConstr(
-                            production[t, g]
-                            <= production[t - 1, g]
-                            + zoneZ.generationUnits.get_ramp_up(g),
-                            name=f"ramp_up_constraint_{zi}_{t}_{g}"
-                        )
-                    )
-                    ramp_down_constraint.append(
-                        m.addConstr(
-                            production[t, g]
-                            >= production[t - 1, g]
-                            - zoneZ.generationUnits.get_ramp_down(g),
-                            name=f"ramp_down_constraint_{zi}_{t}_{g}"
-                        )
-                    )
+def zonal_results(prices:np.array, production:np.array, demand_supplied:np.array, flow_interzonal:np.array):
+    """
+    Gathers the solution of the zonal market in DataFrames.
+
+    Parameters:
+        prices (np.array): The prices of the zones (duals of the balances), of shape (nbHour, nbZones).
+        production (np.array): The production of the generation units, of shape (nbHour, nbUnits).
+        demand_supplied (np.array): The supplied demand of the load units, of shape (nbHour, nbLoadUnits).
+        flow_interzonal (np.array): The flows between the zones, of shape (nbHour, nbZones, nbZones).
+
+    Returns:
+        tuple of pd.DataFrame: The prices in the zones, the production and demand in each zone, and the flows between the zones.
+    """
+    # Production et demande dans chaque zone
+    production_demand = np.stack(
+        [
+            np.column_stack([production[:, zone.get_id_generators()].sum(axis=1) for zone in zones]),
+            np.column_stack([demand_supplied[:, zone.get_id_loads()].sum(axis=1) for zone in zones]),
+        ],
+        axis=2,
+    )
 
-    # Battery constraints
-    actualise_SoC = [
-        m.addConstr(
-            state_of_charge[t]
-            == state_of_charge[t-1] + (- power_injected[t]/efficiency  + power_drawn[t]*efficiency)* delta_t, name=f"battery_{t}"
-        )
-        for t in range(1,nbHour)
-    ]
-    m.addConstr(state_of_charge[0] == value_init - (power_injected[0]/efficiency  - power_drawn[0]*efficiency))
-    m.addConstr(value_init - state_of_charge[-1] <= 0)
-
-    # Flow between zone constraints
-    for z, zone_z in zip(range(len(zones)), zones):
-        for notz, notzone_z in zip(range(len(zones)), zones):
-            if z != notz:
-                capacity = zone_z.compute_capacity_between_zones(notzone_z)
-                print(f"Max capacity between zone {z+1} and zone {notz+1}", capacity)
-                for t in range(nbHour):
-                    m.addConstr(flow_interzonal[t, z, notz] <= capacity)
-                    m.addConstr(flow_interzonal[t, z, notz] >= - capacity)
-                    m.addConstr(flow_interzonal[t, z, notz] == - flow_interzonal[t, notz, z])
-            else:
-                for t in range(nbHour):
-                    m.addConstr(flow_interzonal[t, z, notz] == 0)
-                    m.addConstr(flow_interzonal[t, notz, z] == 0)
-
-    m.optimize()
-
-    ################################################################################
-    # Results
-    ################################################################################
-
-    import numpy as np
-
-    # Arrays pour stocker les données
-    prices = np.zeros((nbHour, len(zones)))  # Prix dans les trois zones
-    production_demand = np.zeros((nbHour, len(zones), 2))  # Production et demande dans chaque zone
-    flows_between_zones = np.zeros((nbHour, len(zones), len(zones)))  # Flux entre les trois zones
-
-    # Récupération des données après optimisation
-    for zone_id in range(len(zones)):
-        for t in range(nbHour):
-            # Prix dans la zone actuelle
-            prices[t, zone_id] = balance_constraint[zone_id][t].Pi
-            
-            # Production dans la zone actuelle
-            production_demand[t, zone_id, 0] = sum(production[t, g].X for g in zones[zone_id].get_id_generators())
-            
-            # Demande dans la zone actuelle
-            production_demand[t, zone_id, 1] = sum(demand_supplied[t, l].X for l in zones[zone_id].get_id_loads())
-            
-            # Flux entre les zones
-            for notzone_id in range(len(zones)):
-                if zone_id != notzone_id:
-                    flows_between_zones[t, zone_id, notzone_id] = flow_interzonal[t, zone_id, notzone_id].X
-
-    # Création des DataFrames à partir des arrays
-    import pandas as pd
+    # Flux entre les zones (hors diagonale)
+    flows_between_zones = flow_interzonal * (1 - np.eye(len(zones)))[None, :, :]
 
     # DataFrame pour les prix dans les zones
     prices_df = pd.DataFrame(prices, columns=[f"Zone_{zone_id+1}" for zone_id in range(len(zones))])
 
     # DataFrame pour la production et la demande dans chaque zone
     production_demand_df = pd.DataFrame(
-        production_demand.reshape(-1, 6),
-        columns=["Production_Zone_1", "Demand_Zone_1", "Production_Zone_2", "Demand_Zone_2", "Production_Zone_3", "Demand_Zone_3"]
+        production_demand.reshape(-1, 2 * len(zones)),
+        columns=[f"{quantity}_Zone_{zone_id+1}" for zone_id in range(len(zones)) for quantity in ("Production", "Demand")]
     )
 
     # DataFrame pour les flux entre les zones
-    flows_between_zones_df = pd.DataFrame(flows_between_zones.reshape(-1, 9))
+    flows_between_zones_df = pd.DataFrame(flows_between_zones.reshape(-1, len(zones) ** 2))
+
+    return prices_df, production_demand_df, flows_between_zones_df
+
+class ZonalMarket:
+    """
+    Zonal market of build_model, built once and updated in place.
+
+    The setters only change bounds, right-hand sides and objective coefficients,
+    so solve() re-optimizes from the basis of the previous solve (warm start)
+    instead of building the model again for every what-if run.
+    """
+
+    def __init__(self, output_flag:int=0, coupling:str="atc"):
+        self.m, self.variables, self.constraints = build_model(coupling)
+        self.m.Params.OutputFlag = output_flag
+        self.loads = [l for zone in zones for l in zone.get_id_loads()]  # loads in the market
+
+    def set_demand(self, demand:np.array):
+        """
+        Changes the needed demand: total demand of shape (nbHour,), shared between the loads
+        as in load_location.csv, or the demand of each load of shape (nbHour, nbLoadUnits).
+        """
+        demand = np.asarray(demand, dtype=float)
+        if demand.ndim == 1:
+            share = np.array([loadUnits.get_unit(l).load_percentage for l in range(nbLoadUnits)]) / 100
+            demand = demand[:, None] * share[None, :]
+        self.variables["demand supplied"][:, self.loads].UB = demand[:, self.loads]
+
+    def set_bid_prices(self, bid_prices):
+        """
+        Changes the bid prices: one price for all the loads, one per load (nbLoadUnits,)
+        or one per load and hour (nbHour, nbLoadUnits).
+        """
+        self.variables["demand supplied"][:, self.loads].Obj = np.broadcast_to(bid_prices, (nbHour, nbLoadUnits))[:, self.loads]
+
+    def set_wind_availability(self, availability:np.array):
+        """
+        Changes the availability of the wind farms, array of shape (nbUnitsWind, nbHour).
+        """
+        wind_pmax = np.array([generationUnits.get_pmax(nbUnitsConventionnal + w) for w in range(nbUnitsWind)])
+        self.variables["production"][:, nbUnitsConventionnal:].UB = (wind_pmax[:, None] * np.asarray(availability)[:, :nbHour]).T
+
+    def set_battery(self, capacity:float=None, power:float=None, initial_state_of_charge:float=None):
+        """
+        Changes the capacity (MWh), the charging and discharging power (MW) and the
+        initial (and final minimum) state of charge of the battery.
+        """
+        if capacity is not None:
+            self.variables["state of charge"].UB = capacity
+        if power is not None:
+            self.variables["power injected"].UB = power
+            self.variables["power drawn"].UB = power
+        if initial_state_of_charge is not None:
+            self.constraints["initial_state_of_charge"].RHS = initial_state_of_charge
+            self.constraints["final_state_of_charge"].RHS = initial_state_of_charge
+
+    def solve(self):
+        """
+        Re-optimizes the model, returns the same as run_model.
+        """
+        return run_model(self.m, self.variables, self.constraints)
 
-    # Affichage des DataFrames
-    print("Prix dans les zones:")
-    print(prices_df)
-    print("\nProduction et demande dans chaque zone:")
-    print(production_demand_df)
-    print("\nFlux entre les zones:")
-    print(flows_between_zones_df)
+################################################################################
+# Decomposition by zone (ADMM)
+################################################################################
 
+def zone_subproblems(zones:list=zones, battery_zone:int=2) -> list:
+    """
+    Data of the local dispatch of each zone, for scripts.admm.solve_admm.
+
+    Parameters:
+        zones (list of Zone): The zones, all the zones of the market.
+        battery_zone (int): Index of the zone of the battery (the third zone, as in build_model).
+
+    Returns:
+        list of dict: One dict per zone, see solve_admm.
+    """
+    capacity = np.array([[zone.compute_capacity_between_zones(other) for other in zones] for zone in zones], dtype=float)
+    capacity = np.minimum(capacity, capacity.T)  # flows of both directions are bounded in build_model
+    np.fill_diagonal(capacity, 0)
+
+    zones_data = []
+    for z, zone in enumerate(zones):
+        generators = zone.get_id_generators()
+        loads = zone.get_id_loads()
+        neighbours = np.flatnonzero(capacity[z] > 0)
+        zones_data.append(
+            {
+                "zone": z,
+                "cost": np.array([zone.generationUnits.get_cost(g) for g in generators], dtype=float),
+                "max production": np.array(
+                    [zone.generationUnits.get_pmax(g) * np.asarray(zone.generationUnits.get_availability(g)[:nbHour]) for g in generators],
+                    dtype=float,
+                ).reshape(len(generators), nbHour).T,
+                "ramp up": np.array([zone.generationUnits.get_ramp_up(g) for g in generators], dtype=float),
+                "ramp down": np.array([zone.generationUnits.get_ramp_down(g) for g in generators], dtype=float),
+                "prod init": np.array([zone.generationUnits.get_prod_init(g) for g in generators], dtype=float),
+                "bid price": np.array([zone.loadUnits.get_bid_price(l) for l in loads], dtype=float),
+                "demand": np.array(
+                    [zone.loadUnits.get_total_needed_demand(l)[:nbHour] for l in loads], dtype=float
+                ).reshape(len(loads), nbHour).T,
+                "neighbours": neighbours,
+                "capacity": capacity[z, neighbours],
+                "battery": dict(
+                    min_SoC=min_SoC, max_SoC=max_SoC, value_init=value_init, P_max=P_max, efficiency=efficiency, delta_t=delta_t
+                ) if z == battery_zone else None,
+            }
+        )
+    return zones_data
+
+def run_model_admm(zones:list=zones, rho:float=0.1, tolerance:float=0.1, price_tolerance:float=0.01, max_iterations:int=1000, processes:int=None):
+    """
+    Clears the zonal market as run_model, but decomposed by zone: each zone solves its own
+    dispatch in a worker process, and the flows between the zones and their prices are
+    coordinated by ADMM (see scripts.admm.solve_admm for the parameters).
+
+    Returns:
+        tuple of pd.DataFrame: The prices in the zones, the production and demand in each zone,
+        the flows between the zones (as zonal_results) and the residuals of each iteration.
+    """
+    from scripts.admm import solve_admm
+
+    run_record.start_phase("run_model_admm", profile=True)
+    zones_data = zone_subproblems(zones)
+    run_record.end_phase("build")
+
+    solution = solve_admm(
+        zones_data, rho=rho, tolerance=tolerance, price_tolerance=price_tolerance, max_iterations=max_iterations, processes=processes
+    )
+    iterations_df = solution["iterations"]
+    run_record.end_phase("solve")
+    if not solution["converged"]:
+        print(f"ADMM did not converge in {max_iterations} iterations")
+    print(f"ADMM: {len(iterations_df)} iterations, welfare {solution['welfare']:.2f} $")
+
+    nbZones = len(zones)
+    prices_df = pd.DataFrame(solution["prices"], columns=[f"Zone_{zone_id+1}" for zone_id in range(nbZones)])
+    production_demand_df = pd.DataFrame(
+        np.stack([solution["production"], solution["demand"]], axis=2).reshape(nbHour, -1),
+        columns=[f"{quantity}_Zone_{zone_id+1}" for zone_id in range(nbZones) for quantity in ("Production", "Demand")],
+    )
+    flows_between_zones_df = pd.DataFrame(solution["flows"].reshape(nbHour, -1))
+    run_record.end_phase("extract")
 
-    return m,prices_df, production_demand_df, flows_between_zones_df
+    return prices_df, production_demand_df, flows_between_zones_df, iterations_df
 
 # Access the results like this:
 # - prices_df[zone_id]: DataFrame of prices in zone_id
@@ -470,3 +694,10 @@ def run_model():
 # from scripts.plot_results import plot_results
 
 # plot_results(nbUnits=nbUnits, results=results)
+
+if __name__ == "__main__":
+    if (zone_labels < 0).any():
+        print("Nodes in no zone:", (np.flatnonzero(zone_labels < 0) + 1).tolist())
+    for zone_id, zone in enumerate(zones):
+        print(f"Zone {zone_id + 1}: nodes {[id_node + 1 for id_node in zone.get_id_nodes()]}")
+    run_model()
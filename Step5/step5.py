@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import gurobipy as gp
 from gurobipy import GRB
@@ -8,8 +9,21 @@ import os
 chemin_dossier_step2 = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Step2'))
 sys.path.insert(0, chemin_dossier_step2)
 
-# Importe maintenant la fonction de step2.py
-from step2 import step2_multiple_hours  
+# Importe maintenant la fonction de step2.py (the day-ahead market is cleared on demand only)
+from step2 import get_day_ahead_solution
+
+# Modules shared by the steps (utils) are at the root of the repository
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.inputStore import load_input_store
+from utils.instrumentation import start_run
+
+# Phases of the run, recorded if INSTRUMENTATION_FILE is set (see utils.instrumentation)
+run_record = start_run("step5")
+
+# Inputs read from the columnar store of inputs/ (converted from the csv files at the first run)
+input_store = load_input_store()
+horizon = input_store.nbRows("load_profile")  # Number of hours of the inputs
+run_record.end_phase("inputs")
 
 # cd C:\Users\julia\OneDrive\DTU\course\S2\46755 - Renewables in Electricity Markets\Assignment1 - git
 
@@ -20,7 +34,7 @@ from step2 import step2_multiple_hours
 from scripts.generationUnits import GenerationUnits
 
 # Parameter units
-generationUnits_parameters = pd.read_csv("inputs/gen_parameters.csv", sep=";")
+generationUnits_parameters = input_store.table("gen_parameters")
 
 nodes = generationUnits_parameters["Node"].values
 costs = generationUnits_parameters["Ci"].values
@@ -46,7 +60,7 @@ for unit_id in range(nbUnitsConventionnal):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=[1] * 24,
+        availability=[1] * horizon,
         ramp_up=ramp_up[unit_id],
         ramp_down=ramp_down[unit_id],
         prod_init=prod_init[unit_id],
@@ -60,7 +74,7 @@ for unit_id in range(nbUnitsConventionnal):
 # Adding of the Wind Generation Units
 ################################################################################
 
-wind_parameters = pd.read_csv("inputs/wind_parameters.csv", index_col="Unit", sep=";")
+wind_parameters = input_store.table("wind_parameters", index_col="Unit")
 nodes = wind_parameters["Node"].values
 pmax = wind_parameters["Pmax"].values
 pmin = wind_parameters["Pmin"].values
@@ -70,11 +84,10 @@ scenario = "V1"  # scenario : from V1 to V100
 
 nbUnitsWind = wind_parameters.shape[0]
 nbUnits = nbUnitsConventionnal + nbUnitsWind
+wind_availability = input_store.scenarios("scen_zoneW", zones=range(nbUnitsWind), hours=horizon, scenarios=[scenario])[:, :, 0]
 for unit_id in range(nbUnitsWind):
 
-    availability = pd.read_csv(f"inputs/data/scen_zoneW{unit_id}.csv", sep=",")[
-        scenario
-    ].values.tolist()
+    availability = wind_availability[unit_id].tolist()
 
     generation_units.add_unit(
         unit_id=unit_id + nbUnitsConventionnal,
@@ -83,7 +96,7 @@ for unit_id in range(nbUnitsWind):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=availability[:24],
+        availability=availability,
         ramp_up=10000,  # big M, for no constraint on rampu_up
         ramp_down=0,
         prod_init=0,
@@ -102,14 +115,12 @@ for unit_id in range(nbUnitsWind):
 from scripts.loadUnits import LoadUnits
 
 # parameter load
-total_needed_demand = pd.read_csv("inputs/load_profile.csv", sep=";")[
+total_needed_demand = input_store.table("load_profile")[
     "total_demand"
 ].values
 nbHour = total_needed_demand.shape[0]
 
-load_location = pd.read_csv(
-    "inputs/load_location.csv", index_col="load_number", sep=";"
-)
+load_location = input_store.table("load_location", index_col="load_number")
 nodes = load_location["node"].values
 load_percentage = load_location["load_percentage"].values
 
@@ -125,6 +136,7 @@ for unit_id in range(nbLoadUnits):
     )
 
 #load_units.export_to_json()
+run_record.end_phase("units")
 
 ################################################################################
 # Balancing bids
@@ -138,119 +150,343 @@ coef_down_regulation = 0.13
 # Model
 ################################################################################
 
-#Import of the model optimised for the day-ahead market from Step 2
-day_ahead_model = step2_multiple_hours(show_plots=False)
+class BalancingMarket:
+    """
+    Balancing market of one hour, built once on a day-ahead solution and updated in place.
+
+    The day-ahead solution is the one of Step 2 (get_day_ahead_solution) by default,
+    read from the result cache with use_cache.
+
+    Every unit has its up and down regulation variables: an outaged generator only
+    gets upper bounds of zero. The setters change bounds, right-hand sides and
+    objective coefficients, so solve() re-optimizes from the previous basis.
+    """
+
+    def __init__(self, day_ahead:dict=None, hour:int=17, output_flag:int=1, use_cache:bool=False):
+        self.day_ahead = get_day_ahead_solution(use_cache=use_cache) if day_ahead is None else day_ahead
+        self.m = gp.Model()
+        self.m.Params.OutputFlag = output_flag
+
+        # Variables
+        self.up_production = self.m.addMVar(shape=(nbUnits,), lb=0, name="up production", vtype=GRB.CONTINUOUS)
+        self.down_production = self.m.addMVar(shape=(nbUnits,), lb=0, name="down production", vtype=GRB.CONTINUOUS)
+        self.down_demand = self.m.addMVar(shape=(nbLoadUnits,), lb=0, name="down demand", vtype=GRB.CONTINUOUS) # Down-regulation load
+        self.down_demand.Obj = load_curtailment_cost
+        self.m.ModelSense = GRB.MINIMIZE
+
+        # Constraints
+        self.balancing_need_constraint = self.m.addConstr(
+            self.up_production.sum() - self.down_production.sum() + self.down_demand.sum() == 0,
+            name='Balancing need constraint'
+        )
+
+        self.outaged_generators = []
+        self.delta_wind_production = np.zeros(nbUnitsWind)
+        self.set_hour(hour)
+
+    def set_hour(self, hour:int):
+        """
+        Reads the day-ahead production, supplied demand and clearing price of the hour.
+        """
+        self.hour = hour
+        self.optimal_production = self.day_ahead["production"][hour] # Production in the day-ahead market clearing
+        self.optimal_demand = self.day_ahead["demand"][hour] # Supplied demand in the day-ahead market clearing
+        self.clearing_price = self.day_ahead["clearing price"][hour]
+
+        cost = generation_units.cost
+        self.up_production.Obj = self.clearing_price + cost * coef_up_regulation # Conventional generators up-regulation price
+        self.down_production.Obj = - (self.clearing_price - cost * coef_down_regulation) # Conventional generators down-regulation price
+        self.down_demand.UB = self.optimal_demand # Upper bound is the demand supplied after day-ahead clearing
+        self.update_bounds()
+
+    def set_outaged_generators(self, outaged_generators:list):
+        self.outaged_generators = list(outaged_generators)
+        self.update_bounds()
+
+    def set_wind_deviation(self, delta_wind_production:list):
+        """
+        delta_wind_production: relative deviation of each wind farm from its day-ahead production.
+        """
+        self.delta_wind_production = np.asarray(delta_wind_production, dtype=float)
+        self.update_bounds()
+
+    def set_curtailment_cost(self, cost:float):
+        self.down_demand.Obj = cost
+
+    def update_bounds(self):
+        # Upper bounds are the minimum between the reserve capacity and the remaining power (up) or the production (down)
+        up_bound = np.minimum(generation_units.pmax - self.optimal_production, generation_units.up_reserve)
+        down_bound = np.minimum(self.optimal_production, generation_units.down_reserve)
+        up_bound[self.outaged_generators] = 0
+        down_bound[self.outaged_generators] = 0
+        self.up_production.UB = up_bound
+        self.down_production.UB = down_bound
+
+        self.delta_total_power = ( # Lack or Surplus of power compared to day-ahead prediction
+            self.optimal_production[nbUnitsConventionnal:] @ self.delta_wind_production
+            - self.optimal_production[self.outaged_generators].sum()
+        )
+        self.balancing_need = - self.delta_total_power # Balancing need is the opposite of the surplus or lack of power
+        self.balancing_need_constraint.RHS = self.balancing_need
+
+    def solve(self) -> float:
+        """
+        Re-optimizes the balancing market and returns the balancing price.
+        """
+        self.m.optimize()
+        return self.balancing_need_constraint.Pi.item()
+
+def clear_balancing_market(
+        balancing_need: np.array,
+        up_price: np.array,
+        up_bound: np.array,
+        down_price: np.array,
+        down_bound: np.array,
+        curtailment_cost: np.array,
+        curtailment_bound: np.array,
+    ):
+    """
+    Clears balancing markets without LP solver, for any number of cases at once.
+
+    The balancing market of BalancingMarket has a single balance constraint and box
+    bounds, so it is solved exactly by sorting the regulation prices: up-regulation
+    and curtailment are offers (bought at their price), down-regulation is a bid (the
+    unit pays back its price, the clearing price minus its down-regulation cost).
+    Sorting all of them by price, the offers are activated and the bids released in
+    this order until the balancing need is met. The last one activated sets the
+    balancing price (the dual of the balance constraint). When the need is met exactly
+    at the end of a regulation (e.g. a zero need), the dual is not unique: the price of
+    the next regulation is taken, as given by Gurobi (see compare_balancing_methods).
+
+    Parameters:
+        balancing_need (np.array): The balancing need of each case, of shape (...).
+        up_price, up_bound (np.array): The up-regulation prices and upper bounds, of shape (..., nbUnits).
+        down_price, down_bound (np.array): The down-regulation prices and upper bounds, of shape (..., nbUnits).
+        curtailment_cost, curtailment_bound (np.array): The curtailment cost and upper bounds, of shape (..., nbLoadUnits).
+
+    Returns:
+        balancing_price (np.array): The balancing price of each case, NaN if the need cannot be met.
+        up_production, down_production (np.array): The activated regulation, of shape (..., nbUnits).
+        down_demand (np.array): The curtailed demand, of shape (..., nbLoadUnits).
+    """
+    balancing_need = np.asarray(balancing_need, dtype=float)
+    shape = np.broadcast_shapes(
+        balancing_need.shape, np.shape(up_price)[:-1], np.shape(up_bound)[:-1], np.shape(down_price)[:-1],
+        np.shape(down_bound)[:-1], np.shape(curtailment_cost)[:-1], np.shape(curtailment_bound)[:-1]
+    )
+    nbUnits = np.shape(up_bound)[-1]
+    nbLoads = np.shape(curtailment_bound)[-1]
+
+    # Regulation sorted by price: up-regulation and curtailment (offers), down-regulation (bids)
+    prices = np.concatenate([
+        np.broadcast_to(up_price, shape + (nbUnits,)),
+        np.broadcast_to(curtailment_cost, shape + (nbLoads,)),
+        np.broadcast_to(down_price, shape + (nbUnits,)),
+    ], axis=-1)
+    bounds = np.concatenate([
+        np.broadcast_to(up_bound, shape + (nbUnits,)),
+        np.broadcast_to(curtailment_bound, shape + (nbLoads,)),
+        np.broadcast_to(down_bound, shape + (nbUnits,)),
+    ], axis=-1).astype(float)
+    order = np.argsort(prices, axis=-1, kind="stable")
+    sorted_prices = np.take_along_axis(prices, order, axis=-1)
+    sorted_bounds = np.take_along_axis(bounds, order, axis=-1)
+
+    # Net regulation (up + curtailment - down) when everything up to a price is taken:
+    # the offers below it are activated and the bids below it are released
+    total_down = np.sum(bounds[..., nbUnits + nbLoads:], axis=-1)
+    net_regulation = np.cumsum(sorted_bounds, axis=-1) - total_down[..., None]
+    filled = np.clip(
+        (balancing_need + total_down)[..., None] - (net_regulation + total_down[..., None] - sorted_bounds),
+        0, sorted_bounds
+    )
+    filled_bounds = np.empty_like(filled)
+    np.put_along_axis(filled_bounds, order, filled, axis=-1)
+
+    up_production = filled_bounds[..., :nbUnits]
+    down_demand = filled_bounds[..., nbUnits:nbUnits + nbLoads]
+    down_production = bounds[..., nbUnits + nbLoads:] - filled_bounds[..., nbUnits + nbLoads:] # Released bids are not activated
+
+    # Balancing price: the first price at which the net regulation exceeds the need. When the
+    # need falls on a breakpoint (e.g. a zero need), both neighbouring prices are duals of the
+    # balance constraint: the next one is taken, as Gurobi does.
+    tolerance = 1e-9 * np.maximum(1, np.abs(balancing_need))
+    marginal = np.minimum(np.sum(net_regulation <= (balancing_need + tolerance)[..., None], axis=-1), prices.shape[-1] - 1)
+    balancing_price = np.take_along_axis(sorted_prices, marginal[..., None], axis=-1)[..., 0]
+    feasible = (net_regulation[..., -1] >= balancing_need - tolerance) & (balancing_need >= - total_down - tolerance)
+    balancing_price = np.where(feasible, balancing_price, np.nan)
+    return balancing_price, up_production, down_production, down_demand
+
+def clear_balancing_cases(
+        production : np.array,
+        demand : np.array,
+        clearing_price : np.array,
+        outaged_generators : np.array,
+        delta_wind_production : np.array,
+        curtailment_cost : float = load_curtailment_cost,
+    ) -> dict:
+    """
+    Clears the balancing markets of all the hours for many imbalance cases, from the
+    arrays of the day-ahead solution, see step5_balancing_cases.
+    """
+    outaged_generators = np.asarray(outaged_generators, dtype=bool)
+    delta_wind_production = np.asarray(delta_wind_production, dtype=float)
+
+    # Bids, as in BalancingMarket
+    cost = generation_units.cost
+    up_price = clearing_price[:, None] + cost * coef_up_regulation
+    down_price = clearing_price[:, None] - cost * coef_down_regulation
+    available = ~outaged_generators[:, None, :]
+    up_bound = np.minimum(generation_units.pmax - production, generation_units.up_reserve) * available
+    down_bound = np.minimum(production, generation_units.down_reserve) * available
+
+    delta_total_power = ( # Lack or Surplus of power compared to day-ahead prediction, (nbCases, nbHour)
+        delta_wind_production @ production[:, nbUnitsConventionnal:].T
+        - outaged_generators @ production.T
+    )
+    balancing_need = - delta_total_power
+
+    balancing_price, up_production, down_production, down_demand = clear_balancing_market(
+        balancing_need, up_price, up_bound, down_price, down_bound, curtailment_cost, demand
+    )
+    return {
+        "balancing price": balancing_price,
+        "balancing need": balancing_need,
+        "up production": up_production,
+        "down production": down_production,
+        "down demand": down_demand,
+        "production": production,
+        "demand": demand,
+        "clearing price": clearing_price,
+    }
+
+def step5_balancing_cases(
+        day_ahead : dict,
+        outaged_generators : np.array,
+        delta_wind_production : np.array,
+        curtailment_cost : float = load_curtailment_cost,
+        use_cache : bool = False,
+    ) -> dict:
+    """
+    Clears the balancing markets of all the hours for many imbalance cases in one
+    vectorized call (clear_balancing_market), with the bids of BalancingMarket.
+
+    Parameters:
+        day_ahead (dict): The day-ahead solution, see get_day_ahead_solution (None for the one of Step 2).
+        outaged_generators (np.array): The outaged generators of each case, a boolean mask of shape (nbCases, nbUnits).
+        delta_wind_production (np.array): The relative deviation of each wind farm in each case, of shape (nbCases, nbUnitsWind).
+        curtailment_cost (float): The curtailment cost of the loads.
+        use_cache (bool): read the day-ahead solution of Step 2 from the result cache, see get_day_ahead_solution.
+
+    Returns:
+        dict: "balancing price" and "balancing need" of shape (nbCases, nbHour), "up production",
+            "down production" of shape (nbCases, nbHour, nbUnits) and "down demand" of shape
+            (nbCases, nbHour, nbLoadUnits), with the day-ahead "production", "demand" and "clearing price".
+    """
+    if day_ahead is None:
+        day_ahead = get_day_ahead_solution(use_cache=use_cache)
+    return clear_balancing_cases(
+        day_ahead["production"], day_ahead["demand"], day_ahead["clearing price"],
+        outaged_generators, delta_wind_production, curtailment_cost
+    )
+
+def balancing_profits(results : dict, outaged_generators : np.array, delta_wind_production : np.array):
+    """
+    Computes the profits of the units (day-ahead and balancing) for the cases of clear_balancing_cases,
+    with a one-price and a two-price settlement of the wind imbalances.
+
+    Returns:
+        profit_one_price, profit_two_price (np.array): shape (nbCases, nbHour, nbUnits).
+    """
+    outaged_generators = np.asarray(outaged_generators, dtype=bool)[:, None, :]
+    delta_wind_production = np.asarray(delta_wind_production, dtype=float)[:, None, :]
+    cost = generation_units.cost
+    production = results["production"][None, :, :]
+    clearing_price = results["clearing price"][None, :, None]
+    balancing_price = results["balancing price"][:, :, None]
+
+    # Regulation of the available units, loss of the production of the outaged ones
+    regulation = results["up production"] - results["down production"]
+    balancing_profit = (balancing_price - cost) * np.where(outaged_generators, - production, regulation)
+
+    # Imbalance of the wind farms: at the balancing price (one price), or at the day-ahead
+    # price when it helps the system (two price)
+    wind_imbalance = production[:, :, nbUnitsConventionnal:] * delta_wind_production
+    wind_cost = cost[nbUnitsConventionnal:]
+    system_imbalance = - results["balancing need"][:, :, None]
+    two_price = np.where(delta_wind_production * system_imbalance > 0, balancing_price, clearing_price)
+
+    profit_day_ahead = (clearing_price - cost) * production
+    profit_one_price = profit_day_ahead + balancing_profit
+    profit_two_price = profit_one_price.copy()
+    profit_one_price[:, :, nbUnitsConventionnal:] = profit_day_ahead[:, :, nbUnitsConventionnal:] + (balancing_price - wind_cost) * wind_imbalance
+    profit_two_price[:, :, nbUnitsConventionnal:] = profit_day_ahead[:, :, nbUnitsConventionnal:] + (two_price - wind_cost) * wind_imbalance
+    return profit_one_price, profit_two_price
 
 def step5_balancing_market(
-        day_ahead_model : gp.Model = day_ahead_model,
+        day_ahead : dict = None,
         hour : int = 17,
         outaged_generators : list = [10],
         delta_wind_production : list = [-0.1,0.15,0.15,-0.1,-0.1,-0.1],
-        show_plots : bool = False
+        show_plots : bool = False,
+        method : str = "lp",
+        use_cache : bool = False
     ):
-    ############################################################################
-    # Day-ahead market clearing
-    ############################################################################    
-
-    print("model", day_ahead_model)
-    production = {
-        t:  {
-                g: day_ahead_model.getVarByName(f'production of generator {g} at time {t}') for g in range(nbUnits)
-            }
-        for t in range(nbHour)
-        }
-    demand_supplied = {
-        t:  {
-                l: day_ahead_model.getVarByName(f'Supplied demand to load {l} at time {t}') for l in range(nbLoadUnits)
-            }
-        for t in range(nbHour)
-        }
+    """
+    Clears the balancing market of one hour and prints the profits of the suppliers.
+
+    day_ahead: the day-ahead solution, the one of Step 2 (get_day_ahead_solution) by default.
+    method: "lp" (Gurobi, BalancingMarket) or "analytic" (step5_balancing_cases, no LP).
+    use_cache: read the day-ahead solution from the result cache, see get_day_ahead_solution.
+    Returns the Gurobi model for "lp", the results of step5_balancing_cases for "analytic".
+    """
+    run_record.start_phase("step5_balancing_market")
+    if day_ahead is None:
+        day_ahead = get_day_ahead_solution(use_cache=use_cache)
+    run_record.end_phase("day_ahead")
+    run_record.start_phase("step5_balancing_market", profile=True)
 
     ############################################################################
     # Balancing market clearing
     ############################################################################
     t = hour # hour chosen for the balancing market clearing 
 
-    # Balancing need calculation
-    optimal_production = { # Production in the day-ahead market clearing
-        g: production[t][g].X for g in range(nbUnits)
-    } 
-    optimal_demand = { # Supplied demand in the day-ahead market clearing
-        l: demand_supplied[t][l].X for l in range(nbLoadUnits)
-    }
-    
-
-    delta_total_power = sum(optimal_production[nbUnitsConventionnal + w]*delta_wind_production[w] for w in range(nbUnitsWind)) - sum(optimal_production[g] for g in outaged_generators) # Lack or Surplus of power compared to day-ahead prediction
-    balancing_need = - delta_total_power # Balancing need is the opposite of the surplus or lack of power
-
-    # Balancing biding
-    balance_constraint = day_ahead_model.getConstrByName(f'GenerationBalance_{t}')
-    clearing_price = balance_constraint.Pi
-
-    price_up_regulation = { # Conventional generators up-regulation price
-        g: clearing_price + generation_units.units[g]["Cost"]*coef_up_regulation for g in range(nbUnits) if g not in outaged_generators
-    } 
-    price_down_regulation = { # Conventional generators down-regulation price
-        g: clearing_price - generation_units.units[g]["Cost"]*coef_down_regulation for g in range(nbUnits) if g not in outaged_generators
-    } 
-
-    # Optimisation
-    m = gp.Model()
-
-    # Cariables
-    up_production =  {g: m.addVar(
-        lb=0, 
-        ub=min(generation_units.units[g]["PMAX"] - optimal_production[g], generation_units.units[g]["Up reserve"]), #  Upper bound is the minimum between the up reserve capacity and the remaining power before reaching the generator's capacity
-        name=f'up production of generator {g}',
-        vtype=GRB.CONTINUOUS,        
-        )
-        for g in range(nbUnits) if g not in outaged_generators
-    }     
-    down_production =  {g: m.addVar(
-        lb=0, 
-        ub=min(optimal_production[g], generation_units.units[g]["Down reserve"]), # Upper bound is the minimum between the down reserve capacity and the production of the day-ahead clearing
-        name=f'down production of generator {g}',
-        vtype=GRB.CONTINUOUS,        
-        )
-        for g in range(nbUnits) if g not in outaged_generators
-    }  
-    down_demand = {l: m.addVar( # Down-regulation load. 
-        lb=0, 
-        ub=optimal_demand[l], # Upper bound is the demand supplied after day-ahead clearing
-        name=f'down production of generator {l}',
-        vtype=GRB.CONTINUOUS,        
-        )
-        for l in range(nbLoadUnits)
-    }  
-    
-    # Objective function
-    objective = gp.quicksum(
-        up_production[g] * price_up_regulation[g] - down_production[g] * price_down_regulation[g] for g in range(nbUnits) if g not in outaged_generators
-    ) + gp.quicksum(
-        load_curtailment_cost * down_demand[l] for l in range(nbLoadUnits)
-    )
-    m.setObjective(objective, GRB.MINIMIZE)
-    
-
-    # Constraints
-    balancing_need_constraint = m.addLConstr(
-        gp.quicksum( up_production[g] - down_production[g] for g in range(nbUnits) if g not in outaged_generators) 
-        + gp.quicksum(down_demand[l] for l in range(nbLoadUnits))
-        == balancing_need,
-        name='Balancing need constraint'
-    ) 
-    
-    # Optimise
-    m.optimize()
+    if method == "lp":
+        market = BalancingMarket(day_ahead, hour=t)
+        market.set_outaged_generators(outaged_generators)
+        market.set_wind_deviation(delta_wind_production)
+        m = market.m
+        run_record.end_phase("build", m)
+
+        optimal_production = dict(enumerate(market.optimal_production))
+        clearing_price = market.clearing_price
+        delta_total_power = market.delta_total_power
+        balancing_need = market.balancing_need
+        # Optimise
+        balancing_price = market.solve()
+        regulation = market.up_production.X - market.down_production.X
+        run_record.end_phase("solve", m)
+    elif method == "analytic":
+        outaged = np.zeros((1, nbUnits), dtype=bool)
+        outaged[0, outaged_generators] = True
+        m = step5_balancing_cases(day_ahead, outaged, [delta_wind_production])
+
+        optimal_production = dict(enumerate(m["production"][t]))
+        clearing_price = m["clearing price"][t]
+        balancing_need = m["balancing need"][0, t]
+        delta_total_power = - balancing_need
+        balancing_price = m["balancing price"][0, t]
+        regulation = m["up production"][0, t] - m["down production"][0, t]
+        run_record.end_phase("solve")
+    else:
+        raise ValueError(f"Unknown method '{method}', use 'lp' or 'analytic'.")
     
     ################################################################################
     # Results
     ################################################################################
-    # Optimal value
-    balancing_price = balancing_need_constraint.Pi 
 
     #nbalancing profits and losses of the generators 
-    balancing_profit = {g: (balancing_price - generation_units.units[g]["Cost"])*(up_production[g].X - down_production[g].X) for g in range(nbUnits) if g not in outaged_generators}
+    balancing_profit = {g: (balancing_price - generation_units.units[g]["Cost"])*regulation[g] for g in range(nbUnits) if g not in outaged_generators}
     balancing_profit.update({g: (balancing_price - generation_units.units[g]["Cost"])*(- optimal_production[g]) for g in outaged_generators})
 
     balancing_profit_one_price = balancing_profit.copy()
@@ -259,7 +495,7 @@ def step5_balancing_market(
 
     balancing_profit_two_price.update({
         w + nbUnitsConventionnal: 
-        (balancing_price if delta_wind_production[w] * delta_total_power > 0 else clearing_price) - generation_units.units[w + nbUnitsConventionnal]["Cost"] * (optimal_production[w + nbUnitsConventionnal] * delta_wind_production[w])
+        ((balancing_price if delta_wind_production[w] * delta_total_power > 0 else clearing_price) - generation_units.units[w + nbUnitsConventionnal]["Cost"]) * (optimal_production[w + nbUnitsConventionnal] * delta_wind_production[w])
         for w in range(nbUnitsWind)})
 
     
@@ -278,8 +514,197 @@ def step5_balancing_market(
 
     print("Suppliers profit one price: ", profit_total_one_price)
     print("Suppliers profit two price: ", profit_total_two_price)
+    run_record.end_phase("extract")
 
     return m
 
 
-step5_balancing_market(show_plots=False)
+def compare_balancing_methods(
+        day_ahead : dict = None,
+        nbOutages : int = 1,
+        wind_deviations : np.array = None,
+        tolerance : float = 1e-6,
+        use_cache : bool = False,
+    ):
+    """
+    Cross-checks the analytic clearing (clear_balancing_cases) against the LP (BalancingMarket) on
+    every hour of every contingency case (see contingency_cases), including the cases whose
+    balancing need falls on a breakpoint of the regulation (e.g. a zero need).
+    With use_cache, the day-ahead solution of Step 2 is read from the result cache.
+
+    Prints the number of cases and the number of balancing prices and profits which differ.
+
+    Returns:
+        bool: True if the balancing prices (NaN when the need cannot be met) and the one-price
+            and two-price profits (in total for each case and hour, and of each wind farm) agree
+            within tolerance (relative to the largest profit for the profits).
+    """
+    if day_ahead is None:
+        day_ahead = get_day_ahead_solution(use_cache=use_cache)
+    outages, outaged_generators, delta_wind_production = contingency_cases(nbOutages, wind_deviations)
+    analytic = clear_balancing_cases(
+        day_ahead["production"], day_ahead["demand"], day_ahead["clearing price"], outaged_generators, delta_wind_production
+    )
+
+    market = BalancingMarket(day_ahead, output_flag=0)
+    lp = {name: np.full_like(analytic[name], np.nan) for name in ("balancing price", "up production", "down production")}
+    for t in range(nbHour):
+        market.set_hour(t)
+        for case, outage in enumerate(outages):
+            market.set_outaged_generators(list(outage))
+            market.set_wind_deviation(delta_wind_production[case])
+            market.m.optimize()
+            if market.m.Status == GRB.OPTIMAL:
+                lp["balancing price"][case, t] = market.balancing_need_constraint.Pi.item()
+                lp["up production"][case, t] = market.up_production.X
+                lp["down production"][case, t] = market.down_production.X
+    lp = dict(analytic, **lp)
+
+    price_gaps = ~np.isclose(lp["balancing price"], analytic["balancing price"], rtol=0, atol=tolerance, equal_nan=True)
+    # Offers at the same price can be shared in any way between their units: the profits of each
+    # case and hour are compared in total, and the wind farms (settled at the prices) one by one
+    profit_gaps = [
+        ~np.isclose(
+            np.concatenate([lp_profit.sum(axis=-1, keepdims=True), lp_profit[..., nbUnitsConventionnal:]], axis=-1),
+            np.concatenate([analytic_profit.sum(axis=-1, keepdims=True), analytic_profit[..., nbUnitsConventionnal:]], axis=-1),
+            rtol=0, atol=tolerance * max(1, np.nanmax(np.abs(analytic_profit))), equal_nan=True,
+        )
+        for lp_profit, analytic_profit in zip(
+            balancing_profits(lp, outaged_generators, delta_wind_production),
+            balancing_profits(analytic, outaged_generators, delta_wind_production),
+        )
+    ]
+    print(f"{len(outages)} cases x {nbHour} hours, {np.isclose(analytic['balancing need'], 0).sum()} with a zero balancing need")
+    print(f"Different balancing prices: {price_gaps.sum()}, one-price profits: {profit_gaps[0].sum()}, two-price profits: {profit_gaps[1].sum()}")
+    return not (price_gaps.any() or any(gaps.any() for gaps in profit_gaps))
+
+
+################################################################################
+# Contingency batch
+################################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+def contingency_cases(nbOutages:int=1, wind_deviations:np.array=None):
+    """
+    Enumerates the imbalance cases: no outage and every outage of up to nbOutages
+    conventional generators (N-1, N-2, ...), combined with every wind deviation.
+
+    Parameters:
+        nbOutages (int): the maximum number of generators out at the same time.
+        wind_deviations (np.array): the relative deviations of the wind farms, of shape
+            (nbDeviations, nbUnitsWind). Uniform deviations from -20% to +20% by default.
+
+    Returns:
+        outages (list of tuple): the outaged generators of each case.
+        outaged_generators (np.array): the same as a boolean mask, shape (nbCases, nbUnits).
+        delta_wind_production (np.array): shape (nbCases, nbUnitsWind).
+    """
+    if wind_deviations is None:
+        wind_deviations = np.linspace(-0.2, 0.2, 5)[:, None] * np.ones(nbUnitsWind)
+    wind_deviations = np.atleast_2d(np.asarray(wind_deviations, dtype=float))
+
+    outage_sets = [
+        outage for n in range(nbOutages + 1) for outage in combinations(range(nbUnitsConventionnal), n)
+    ]
+    outages = [outage for outage in outage_sets for _ in range(len(wind_deviations))]
+    outaged_generators = np.zeros((len(outages), nbUnits), dtype=bool)
+    for case, outage in enumerate(outages):
+        outaged_generators[case, list(outage)] = True
+    delta_wind_production = np.tile(wind_deviations, (len(outage_sets), 1))
+    return outages, outaged_generators, delta_wind_production
+
+# Day-ahead solution of the workers, set by init_contingency_worker
+contingency_day_ahead = None
+
+def init_contingency_worker(production:np.array, demand:np.array, clearing_price:np.array):
+    global contingency_day_ahead
+    contingency_day_ahead = (production, demand, clearing_price)
+
+def clear_contingency_chunk(outaged_generators:np.array, delta_wind_production:np.array):
+    """
+    Clears a chunk of cases on the day-ahead solution of the worker.
+
+    Returns:
+        balancing price, balancing need (nbCases, nbHour), profit one price, profit two price (nbCases, nbHour, nbUnits)
+    """
+    results = clear_balancing_cases(*contingency_day_ahead, outaged_generators, delta_wind_production)
+    profit_one_price, profit_two_price = balancing_profits(results, outaged_generators, delta_wind_production)
+    return results["balancing price"], results["balancing need"], profit_one_price, profit_two_price
+
+def step5_contingency_batch(
+        day_ahead : dict = None,
+        nbOutages : int = 1,
+        wind_deviations : np.array = None,
+        max_workers : int = None,
+        use_cache : bool = False,
+    ) -> pd.DataFrame:
+    """
+    Clears the balancing market of every hour for every contingency: the outage of up
+    to nbOutages conventional generators combined with a grid of wind deviations (see
+    contingency_cases). The cases are split in chunks cleared by a pool of processes
+    with the analytic clearing (clear_balancing_market), without any model build.
+
+    Parameters:
+        day_ahead (dict): the day-ahead solution, the one of Step 2 (get_day_ahead_solution) by default.
+        nbOutages (int): 1 for N-1, 2 for N-2, ...
+        wind_deviations (np.array): shape (nbDeviations, nbUnitsWind), see contingency_cases.
+        max_workers (int): number of processes, the number of CPUs by default. With 1, no pool is started.
+        use_cache (bool): read the day-ahead solution from the result cache, see get_day_ahead_solution.
+
+    Returns:
+        pd.DataFrame: one row per (case, hour, unit), with the outaged generators and the wind
+        deviation of the case, the balancing price and need, and the one-price and
+        two-price profits (day-ahead and balancing) of the unit. The balancing price is NaN
+        when the regulation cannot meet the need.
+    """
+    run_record.start_phase("step5_contingency_batch")
+    if day_ahead is None:
+        day_ahead = get_day_ahead_solution(use_cache=use_cache)
+    day_ahead = (day_ahead["production"], day_ahead["demand"], day_ahead["clearing price"])
+    run_record.end_phase("day_ahead")
+    outages, outaged_generators, delta_wind_production = contingency_cases(nbOutages, wind_deviations)
+    run_record.end_phase("build")
+
+    max_workers = max_workers or os.cpu_count()
+    chunks = np.array_split(np.arange(len(outages)), max_workers)
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    if max_workers == 1:
+        init_contingency_worker(*day_ahead)
+        solutions = [clear_contingency_chunk(outaged_generators[chunk], delta_wind_production[chunk]) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_contingency_worker,
+            initargs=day_ahead,
+        ) as executor:
+            solutions = list(executor.map(
+                clear_contingency_chunk,
+                [outaged_generators[chunk] for chunk in chunks],
+                [delta_wind_production[chunk] for chunk in chunks],
+            ))
+    run_record.end_phase("solve")
+
+    # shapes (nbCases, nbHour) and (nbCases, nbHour, nbUnits)
+    balancing_price, balancing_need, profit_one_price, profit_two_price = (
+        np.concatenate(values) for values in zip(*solutions)
+    )
+
+    nbCases = len(outages)
+    case_index = np.repeat(np.arange(nbCases), nbHour * nbUnits)
+    index = pd.MultiIndex.from_product([range(nbCases), range(nbHour), range(nbUnits)], names=["Case", "Hour", "Unit"])
+    results = pd.DataFrame({
+        "Outaged generators": [outages[case] for case in case_index],
+        "Wind deviation": [tuple(delta_wind_production[case]) for case in case_index],
+        "Balancing price": np.repeat(balancing_price.ravel(), nbUnits),
+        "Balancing need": np.repeat(balancing_need.ravel(), nbUnits),
+        "Profit one price": profit_one_price.ravel(),
+        "Profit two price": profit_two_price.ravel(),
+    }, index=index)
+    run_record.end_phase("extract")
+    return results
+
+
+if __name__ == "__main__":
+    step5_balancing_market(show_plots=False)
@@ -1,11 +1,26 @@
 import numpy as np
 import pandas as pd
-import gurobipy as gp
-from gurobipy import GRB
+import scipy.sparse as sp
 import matplotlib.pyplot as plt
 import sys
 import os
 
+# Modules shared by the steps (utils) are at the root of the repository
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.linearProgram import LinearProgram
+from utils.results import get_values, get_duals, get_objective, market_results
+from utils.cache import optimize, result_cache
+from utils.inputStore import load_input_store
+from utils.instrumentation import start_run
+
+# Phases of the run, recorded if INSTRUMENTATION_FILE is set (see utils.instrumentation)
+run_record = start_run("step6")
+
+# Inputs read from the columnar store of inputs/ (converted from the csv files at the first run)
+input_store = load_input_store()
+horizon = input_store.nbRows("load_profile")  # Number of hours of the inputs
+run_record.end_phase("inputs")
+
 ################################################################################
 # Creation of Conventionnal Generation Units
 ################################################################################
@@ -13,7 +28,7 @@ import os
 from scripts.generationUnits import GenerationUnits
 
 # Parameter units
-generationUnits_parameters = pd.read_csv("inputs/gen_parameters.csv", sep=";")
+generationUnits_parameters = input_store.table("gen_parameters")
 
 nodes = generationUnits_parameters["Node"].values
 costs = generationUnits_parameters["Ci"].values
@@ -39,7 +54,7 @@ for unit_id in range(nbUnitsConventionnal):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=[1] * 24,
+        availability=[1] * horizon,
         ramp_up=ramp_up[unit_id],
         ramp_down=ramp_down[unit_id],
         prod_init=prod_init[unit_id],
@@ -53,7 +68,7 @@ for unit_id in range(nbUnitsConventionnal):
 # Adding of the Wind Generation Units
 ################################################################################
 
-wind_parameters = pd.read_csv("inputs/wind_parameters.csv", index_col="Unit", sep=";")
+wind_parameters = input_store.table("wind_parameters", index_col="Unit")
 nodes = wind_parameters["Node"].values
 pmax = wind_parameters["Pmax"].values
 pmin = wind_parameters["Pmin"].values
@@ -63,11 +78,10 @@ scenario = "V1"  # scenario : from V1 to V100
 
 nbUnitsWind = wind_parameters.shape[0]
 nbUnits = nbUnitsConventionnal + nbUnitsWind
+wind_availability = input_store.scenarios("scen_zoneW", zones=range(nbUnitsWind), hours=horizon, scenarios=[scenario])[:, :, 0]
 for unit_id in range(nbUnitsWind):
 
-    availability = pd.read_csv(f"inputs/data/scen_zoneW{unit_id}.csv", sep=",")[
-        scenario
-    ].values.tolist()
+    availability = wind_availability[unit_id].tolist()
 
     generation_units.add_unit(
         unit_id=unit_id + nbUnitsConventionnal,
@@ -76,7 +90,7 @@ for unit_id in range(nbUnitsWind):
         cost=costs[unit_id],
         pmax=pmax[unit_id],
         pmin=pmin[unit_id],
-        availability=availability[:24],
+        availability=availability,
         ramp_up=10000,  # big M, for no constraint on rampu_up
         ramp_down=0,
         prod_init=0,
@@ -95,14 +109,12 @@ for unit_id in range(nbUnitsWind):
 from scripts.loadUnits import LoadUnits
 
 # parameter load
-total_needed_demand = pd.read_csv("inputs/load_profile.csv", sep=";")[
+total_needed_demand = input_store.table("load_profile")[
     "total_demand"
 ].values
 nbHour = total_needed_demand.shape[0]
 
-load_location = pd.read_csv(
-    "inputs/load_location.csv", index_col="load_number", sep=";"
-)
+load_location = input_store.table("load_location", index_col="load_number")
 nodes = load_location["node"].values
 load_percentage = load_location["load_percentage"].values
 
@@ -118,6 +130,7 @@ for unit_id in range(nbLoadUnits):
     )
 
 #load_units.export_to_json()
+run_record.end_phase("units")
 
 
 ################################################################################
@@ -152,215 +165,290 @@ for t in range(nbHour):
 
 from scripts.plot_results import plot_results
 
-def step6_reserve_market(
-        outaged_generators : list = [10],
-        delta_wind_production : list = [-0.1,0.15,0.15,-0.1,-0.1,-0.1],
-        show_plots : bool = False
-    ):
-    ############################################################################
-    # Reserve market clearing
-    ############################################################################  
-    reserve_model = gp.Model()
-
-    # Variables    
-    up_reserve_generator = {t: {g: reserve_model.addVar(
-        lb=0, 
-        ub=generation_units.units[g]["Up reserve"],
-        name=f'up reserve capacity of generator {g} at time {t}')
-        for g in range(nbUnits)}
-        for t in range(nbHour)
-    } 
-
-    down_reserve_generator = {t: {g: reserve_model.addVar(
-        lb=0, 
-        ub=generation_units.units[g]["Down reserve"],
-        name=f'down reserve capacity of generator {g} at time {t}')
-        for g in range(nbUnits)}
-        for t in range(nbHour)
-    } 
-
-    # Objective function
-    objective = gp.quicksum(
-        gp.quicksum(
-            generation_units.units[g]["Up reserve offer"]*up_reserve_generator[t][g] +
-            generation_units.units[g]["Down reserve offer"]*down_reserve_generator[t][g]
-            for g in range(nbUnits))
-        for t in range(nbHour))  
-
-    reserve_model.setObjective(objective, GRB.MINIMIZE)  # minimize reserve cost
-    
-    # Constraints
-    total_up_reserve = {t: reserve_model.addLConstr(
-        gp.quicksum(up_reserve_generator[t][g] for g in range(nbUnits))
-        == reserve_up_needed[t],
-        name=f'Total of up reserve at time {t}')
-        for t in range(nbHour)
-    }
-    total_down_reserve = {t: reserve_model.addLConstr(
-        sum(down_reserve_generator[t][g] for g in range(nbUnits))
-        ==  reserve_down_needed[t],
-        name=f'Total of down reserve at time {t}')
-        for t in range(nbHour)
-    }
-    # up + down reserve can't exceed capacity 
-    total_reserve = {t: {g: reserve_model.addLConstr(
-        up_reserve_generator[t][g] + down_reserve_generator[t][g]
-        <= generation_units.units[g]["PMAX"],
-        name=f'Maximum reserve capacity for generator {g} at time {t}')
-        for g in range(nbUnits)}
-        for t in range(nbHour)
-    }
-
-    # Clearing reserve market
-    reserve_model.optimize()
+def build_reserve_linear_program():
+    """
+    Builds the reserve market as a LinearProgram, independent of the solver: the up and
+    down reserve requirements of each hour are bought at the least cost.
 
-    ############################################################################
-    # Day-ahead market clearing
-    ############################################################################   
-    
-    m = gp.Model()
+    Returns:
+        LinearProgram: The program. Its blocks of variables are "up_reserve" and "down_reserve"
+            (nbHour, nbUnits); the duals of its "total_up_reserve" and "total_down_reserve"
+            constraints (one per hour) are the reserve prices.
+    """
+    lp = LinearProgram(sense="min")  # minimize reserve cost
 
     # Variables
-    production =  {t: {g: m.addVar(
-        lb=down_reserve_generator[t][g].x, 
-        ub=generation_units.units[g]["PMAX"] * generation_units.units[g]["Availability"][t] - up_reserve_generator[t][g].x,  
-        name=f'production of generator {g} at time {t}',
-        vtype=GRB.CONTINUOUS
-        ) 
-        for g in range(nbUnits)} for t in range(nbHour)}
-  
-
-    demand_supplied = {t: {l: m.addVar(
-        lb=0, 
-        ub=load_units.units[l]["Needed demand"][t],     # Cannot supply more than necessary
-        name=f'Supplied demand to load {l} at time {t}',
-        vtype=GRB.CONTINUOUS        
-        )
-        for l in range(nbLoadUnits)} for t in range(nbHour)
-    }
-    state_of_charge = m.addMVar(
-        shape=(nbHour,),
-        lb=min_SoC,
-        ub=max_SoC,
-        name=f"state_of_charge",
-        vtype=GRB.CONTINUOUS,
+    up_reserve = lp.add_variables(
+        "up_reserve", (nbHour, nbUnits), ub=generation_units.up_reserve, obj=generation_units.up_reserve_offer
     )
-    power_injected = m.addMVar(
-        shape=(nbHour,),
-        lb=0,
-        ub=P_max,
-        name=f"power_injected",
-        vtype=GRB.CONTINUOUS,
+    down_reserve = lp.add_variables(
+        "down_reserve", (nbHour, nbUnits), ub=generation_units.down_reserve, obj=generation_units.down_reserve_offer
     )
-    power_drawn = m.addMVar(
-        shape=(nbHour,),
-        lb=0,
-        ub=P_max,
-        name=f"power_drawn",
-        vtype=GRB.CONTINUOUS,
-    )
-
-    # Objective function
-    objective = gp.quicksum(
-        demand_supplied[t][l] * load_units.units[l]["Bid price"]
-        for t in range(nbHour)
-        for l in range(nbLoadUnits)
-    )  - gp.quicksum(
-        production[t][g] * generation_units.units[g]["Cost"]
-        for t in range(nbHour)
-        for g in range(nbUnits)
-    ) 
-    m.setObjective(objective, GRB.MAXIMIZE)
 
     # Constraints
+    hours = sp.identity(nbHour, format="csr")
+    units = sp.kron(hours, np.ones((1, nbUnits)), format="csr")
+    lp.add_constraints("total_up_reserve", [(units, up_reserve)], "=", np.array([reserve_up_needed[t] for t in range(nbHour)]))
+    lp.add_constraints("total_down_reserve", [(units, down_reserve)], "=", np.array([reserve_down_needed[t] for t in range(nbHour)]))
+
+    # up + down reserve can't exceed capacity, rows (hour, unit)
+    pairs = sp.identity(nbHour * nbUnits, format="csr")
+    lp.add_constraints("total_reserve", [(pairs, up_reserve), (pairs, down_reserve)], "<", np.tile(generation_units.pmax, nbHour))
+    return lp
+
+def build_day_ahead_linear_program(up_reserve:np.array=None, down_reserve:np.array=None):
+    """
+    Builds the day-ahead market as a LinearProgram, independent of the solver, on the capacity
+    left by the reserves: the production of a unit is at least its down reserve and at most its
+    available capacity minus its up reserve.
+
+    Parameters:
+        up_reserve, down_reserve (np.array): The reserves of the units, of shape (nbHour, nbUnits),
+            none by default (set them later as bounds, see ReserveMarket.solve).
+
+    Returns:
+        LinearProgram: The program. Its blocks of variables are "production" (nbHour, nbUnits),
+            "demand_supplied" (nbHour, nbLoadUnits), "state_of_charge", "power_injected" and
+            "power_drawn" (nbHour,); the duals of its "balance" constraints are the clearing prices.
+    """
+    lp = LinearProgram(sense="max")
+
+    max_production = generation_units.get_max_production()[:, :nbHour].T  # shape (nbHour, nbUnits)
+    needed_demand = np.array([unit["Needed demand"][:nbHour] for unit in load_units.units]).T
+    bid_price = np.array([unit["Bid price"] for unit in load_units.units])
+
+    # Variables (the upper bounds hold the P_max and needed demand constraints)
+    production = lp.add_variables(
+        "production",
+        (nbHour, nbUnits),
+        lb=0 if down_reserve is None else down_reserve,
+        ub=max_production if up_reserve is None else max_production - up_reserve,
+        obj=-generation_units.cost,
+    )
+    demand_supplied = lp.add_variables("demand_supplied", (nbHour, nbLoadUnits), ub=needed_demand, obj=bid_price)
+    state_of_charge = lp.add_variables("state_of_charge", (nbHour,), lb=min_SoC, ub=max_SoC)
+    power_injected = lp.add_variables("power_injected", (nbHour,), ub=P_max)
+    power_drawn = lp.add_variables("power_drawn", (nbHour,), ub=P_max)
 
     # Supplied demand match generation
-    balance_constraint = [
-        m.addConstr(
-            sum(demand_supplied[t][l] for l in range(nbLoadUnits)) + power_drawn[t]
-            - gp.quicksum(production[t][g] for g in range(nbUnits)) - power_injected[t] 
-            == 0,
-            name=f"GenerationBalance_{t}",
-        )
-        for t in range(nbHour)
-    ]
-
-    # Ramp-up and ramp-down constraint
-    ramp_up_constraint = []
-    ramp_down_constraint = []
-    for g in range(nbUnits):
-        for t in range(nbHour):
-            if t == 0:  # Apply the special condition for t=0
-                ramp_up_constraint.append(
-                    m.addConstr(
-                        production[t][g]
-                        <= generation_units.units[g]["Initial production"]
-                        + generation_units.units[g]["Ramp up"],
-                    )
-                )
-                ramp_down_constraint.append(
-                    m.addConstr(
-                        production[t][g]
-                        >= generation_units.units[g]["Initial production"]
-                        - generation_units.units[g]["Ramp down"],
-                    )
-                )
-            else:  # Apply the regular ramp-down constraint for t>0
-                ramp_up_constraint.append(
-                    m.addConstr(
-                        production[t][g]
-                        <= production[t-1][g] + generation_units.units[g]["Ramp up"],
-                    )
-                )
-                ramp_down_constraint.append(
-                    m.addConstr(
-                        production[t][g]
-                        >= production[t-1][g] - generation_units.units[g]["Ramp down"],
-                    )
-                )
+    hours = sp.identity(nbHour, format="csr")
+    lp.add_constraints(
+        "balance",
+        [
+            (sp.kron(hours, np.ones((1, nbLoadUnits))), demand_supplied),
+            (hours, power_drawn),
+            (sp.kron(hours, -np.ones((1, nbUnits))), production),
+            (-hours, power_injected),
+        ],
+        "=",
+        0,
+    )
+
+    # Ramp-up and ramp-down constraints, rows (unit, hour)
+    ramp = sp.kron(sp.identity(nbUnits), hours - sp.eye(nbHour, k=-1), format="csr")
+    first_hour = (np.arange(nbHour) == 0)[None, :]
+    prod_init = generation_units.prod_init[:, None]
+    lp.add_constraints("ramp_up", [(ramp, production.T)], "<", (generation_units.ramp_up[:, None] + prod_init * first_hour).ravel())
+    lp.add_constraints("ramp_down", [(ramp, production.T)], ">", (-generation_units.ramp_down[:, None] + prod_init * first_hour).ravel())
 
     # Battery constraints
-    actualise_SoC = [
-        m.addConstr(
-            state_of_charge[t]
-            == state_of_charge[t-1] + (- power_injected[t]/efficiency  + power_drawn[t]*efficiency)* delta_t
-        )
-        for t in range(1,nbHour)
-    ]
-    m.addConstr(state_of_charge[0] == value_init )# - (power_injected[0]/efficiency  - power_drawn[0]*efficiency))
-    m.addConstr(value_init - state_of_charge[-1] <= 0)
+    lp.add_constraints(
+        "battery",
+        [
+            ((hours - sp.eye(nbHour, k=-1)).tocsr()[1:], state_of_charge),
+            (hours[1:] * delta_t / efficiency, power_injected),
+            (-hours[1:] * delta_t * efficiency, power_drawn),
+        ],
+        "=",
+        0,
+    )
+    lp.add_constraints("initial_state_of_charge", [(hours[:1], state_of_charge)], "=", value_init)
+    lp.add_constraints("final_state_of_charge", [(hours[-1:], state_of_charge)], ">", value_init)
+    return lp
+
+def build_reserve_model():
+    """
+    Builds, without solving it, the Gurobi model of build_reserve_linear_program.
+
+    Returns:
+        reserve_model (gp.Model), up_reserve_generator and down_reserve_generator (MVar of shape
+        (nbHour, nbUnits)), total_up_reserve and total_down_reserve (MConstr of shape (nbHour,)).
+    """
+    lp = build_reserve_linear_program()
+    reserve_model, x, constraints = lp.to_gurobi()
+    up_reserve_generator, down_reserve_generator = (
+        x[lp.variables[name].ravel()].reshape(nbHour, nbUnits) for name in ("up_reserve", "down_reserve")
+    )
+    return reserve_model, up_reserve_generator, down_reserve_generator, constraints["total_up_reserve"], constraints["total_down_reserve"]
+
+def build_day_ahead_model():
+    """
+    Builds, without solving it, the Gurobi model of build_day_ahead_linear_program. The bounds of
+    the production are set from the reserves once the reserve market is cleared (see ReserveMarket.solve).
+
+    Returns:
+        m (gp.Model), production, demand_supplied, state_of_charge, power_injected, power_drawn
+        (MVar in the shapes of build_day_ahead_linear_program), balance_constraint, initial_SoC
+        and final_SoC (MConstr).
+    """
+    lp = build_day_ahead_linear_program()
+    m, x, constraints = lp.to_gurobi()
+    production, demand_supplied, state_of_charge, power_injected, power_drawn = (
+        x[lp.variables[name].ravel()].reshape(lp.variables[name].shape)
+        for name in ("production", "demand_supplied", "state_of_charge", "power_injected", "power_drawn")
+    )
+    return (
+        m, production, demand_supplied, state_of_charge, power_injected, power_drawn,
+        constraints["balance"], constraints["initial_state_of_charge"], constraints["final_state_of_charge"],
+    )
 
+class ReserveMarket:
+    """
+    Reserve and day-ahead markets, built once and updated in place.
+
+    The setters only change bounds, right-hand sides and objective coefficients,
+    so solve() re-optimizes both models from the basis of the previous solve
+    (warm start) instead of building them again for every what-if run.
+
+    With use_cache (off by default), a market already cleared is read from the result
+    cache (utils.cache) instead: read the solutions with utils.results. A hit leaves
+    the model unsolved, without a basis, so the next solve() starts cold.
+    """
+
+    def __init__(self, output_flag:int=0, use_cache:bool=False):
+        (
+            self.reserve_model, self.up_reserve_generator, self.down_reserve_generator,
+            self.total_up_reserve, self.total_down_reserve,
+        ) = build_reserve_model()
+        (
+            self.m, self.production, self.demand_supplied, self.state_of_charge, self.power_injected,
+            self.power_drawn, self.balance_constraint, self.initial_SoC, self.final_SoC,
+        ) = build_day_ahead_model()
+        self.reserve_model.Params.OutputFlag = output_flag
+        self.m.Params.OutputFlag = output_flag
+        self.cache = result_cache if use_cache else None
+
+        self.max_production = generation_units.get_max_production()[:, :nbHour].T  # shape (nbHour, nbUnits)
+        self.load_share = np.array([unit["Load percentage"] for unit in load_units.units]) / 100
+        self.total_demand = total_needed_demand.astype(float)
+
+    def set_demand(self, demand:np.array):
+        """
+        Changes the total demand, shape (nbHour,): the demand of the loads (shared as in
+        load_location.csv) and the reserve requirements (15% up and 10% down).
+        """
+        self.total_demand = np.asarray(demand, dtype=float)
+        self.demand_supplied.UB = np.outer(self.total_demand, self.load_share)
+        self.total_up_reserve.RHS = 0.15 * self.total_demand
+        self.total_down_reserve.RHS = 0.1 * self.total_demand
+
+    def set_bid_prices(self, bid_prices):
+        """
+        Changes the bid prices: one price for all the loads, one per load (nbLoadUnits,)
+        or one per load and hour (nbHour, nbLoadUnits).
+        """
+        self.demand_supplied.Obj = np.broadcast_to(bid_prices, (nbHour, nbLoadUnits))
+
+    def set_wind_availability(self, availability:np.array):
+        """
+        Changes the availability of the wind farms, array of shape (nbUnitsWind, nbHour).
+        """
+        wind_pmax = generation_units.pmax[nbUnitsConventionnal:]
+        self.max_production[:, nbUnitsConventionnal:] = (wind_pmax[:, None] * np.asarray(availability)[:, :nbHour]).T
+
+    def set_battery(self, capacity:float=None, power:float=None, initial_state_of_charge:float=None):
+        """
+        Changes the capacity (MWh), the charging and discharging power (MW) and the
+        initial (and final minimum) state of charge of the battery.
+        """
+        if capacity is not None:
+            self.state_of_charge.UB = capacity
+        if power is not None:
+            self.power_injected.UB = power
+            self.power_drawn.UB = power
+        if initial_state_of_charge is not None:
+            self.initial_SoC.RHS = initial_state_of_charge
+            self.final_SoC.RHS = initial_state_of_charge
+
+    def solve(self):
+        """
+        Clears the reserve market, then the day-ahead market on the capacity left by the reserves.
+        """
+        optimize(self.reserve_model, self.cache)
+
+        up_reserve = get_values(self.reserve_model, self.up_reserve_generator)
+        down_reserve = get_values(self.reserve_model, self.down_reserve_generator)
+        self.production.LB = down_reserve
+        self.production.UB = self.max_production - up_reserve
+        optimize(self.m, self.cache)
 
-    m.optimize()
+def step6_reserve_market(
+        outaged_generators : list = [10],
+        delta_wind_production : list = [-0.1,0.15,0.15,-0.1,-0.1,-0.1],
+        show_plots : bool = False,
+        use_cache : bool = False,
+        solver : str = "gurobi"
+    ):
+    """
+    Clears the reserve market, then the day-ahead market on the capacity left by the reserves.
+
+    Parameters:
+        use_cache (bool): with Gurobi, see ReserveMarket.
+        solver (str): "gurobi" (returns the gp.Model of the day-ahead market) or "highs"
+            (no licence needed, returns the LinearProgramSolution of the day-ahead market).
+    """
+    ############################################################################
+    # Reserve and day-ahead market clearing
+    ############################################################################  
+    run_record.start_phase("step6_reserve_market", profile=True)
+    if solver == "gurobi":
+        market = ReserveMarket(output_flag=1, use_cache=use_cache)
+        run_record.end_phase("build", market.reserve_model, market.m)
+        market.solve()
+        run_record.end_phase("solve", market.reserve_model, market.m)
+
+        reserve_model, m = market.reserve_model, market.m
+
+        # One getAttr call per block of variables or constraints
+        up_reserve_values = get_values(reserve_model, market.up_reserve_generator)  # shape (nbHour, nbUnits)
+        down_reserve_values = get_values(reserve_model, market.down_reserve_generator)
+        up_reserve_prices = get_duals(reserve_model, market.total_up_reserve)
+        down_reserve_prices = get_duals(reserve_model, market.total_down_reserve)
+        clearing_price_values = get_duals(m, market.balance_constraint)
+        production_values = get_values(m, market.production)  # shape (nbHour, nbUnits)
+        demand_supplied_values = get_values(m, market.demand_supplied)  # shape (nbHour, nbLoadUnits)
+        power_injected_values = get_values(m, market.power_injected)
+        power_drawn_values = get_values(m, market.power_drawn)
+        state_of_charge_values = get_values(m, market.state_of_charge)
+        reserve_objective, day_ahead_objective = get_objective(reserve_model), get_objective(m)
+    else:
+        reserve_lp = build_reserve_linear_program()
+        run_record.end_phase("build", reserve_lp)
+        reserve_model = reserve_lp.solve(solver)
+        up_reserve_values = reserve_model.get_values("up_reserve")
+        down_reserve_values = reserve_model.get_values("down_reserve")
+        day_ahead_lp = build_day_ahead_linear_program(up_reserve_values, down_reserve_values)
+        m = day_ahead_lp.solve(solver)
+        run_record.end_phase("solve", reserve_model, m)
+
+        up_reserve_prices = reserve_model.get_duals("total_up_reserve")
+        down_reserve_prices = reserve_model.get_duals("total_down_reserve")
+        clearing_price_values = m.get_duals("balance")
+        production_values = m.get_values("production")
+        demand_supplied_values = m.get_values("demand_supplied")
+        power_injected_values = m.get_values("power_injected")
+        power_drawn_values = m.get_values("power_drawn")
+        state_of_charge_values = m.get_values("state_of_charge")
+        reserve_objective, day_ahead_objective = reserve_model.objective, m.objective
 
     ################################################################################
     # Results
     ################################################################################
 
-    clearing_price = [balance_constraint[t].Pi for t in range(nbHour)]
-    clearing_price_values = [
-        price_item.flatten()[0] for price_item in clearing_price
-    ]  # remove the array values
-
     # Print results
 
-    print('Social welfare reserve:', round(reserve_model.ObjVal, 2))
-    print('Social welfare day ahead:', round(m.ObjVal, 2))
-
-    profit = [
-        [
-            production[t][g].X * (clearing_price[t] - generation_units.units[g]["Cost"])
-            for g in range(nbUnits)
-        ]
-        for t in range(nbHour)
-    ]
-
-    
-
-    demand_unsatisfied = [
-        total_needed_demand[t] - np.sum(demand_supplied[t][l].X for l in range(nbLoadUnits))
-        for t in range(nbHour)
-    ]
+    print('Social welfare reserve:', round(reserve_objective, 2))
+    print('Social welfare day ahead:', round(day_ahead_objective, 2))
 
     # print result
     # print(f"Optimal objective value: {m.objVal} $")
@@ -375,22 +463,22 @@ def step6_reserve_market(
     # print("demand unsatisfied:", demand_unsatisfied)
     # print("SoC:", state_of_charge.X)
 
-    results = pd.DataFrame()
-    results["Hour"] = np.arange(nbHour)
-    for g in range(nbUnits):
-        results[f"PU production {g+1} (GW)"] = [production[t][g].X for t in range(nbHour)]
-        results[f"PU profit {g+1} ($)"] = [profit[t][g] for t in range(nbHour)]
-    results["Clearing price"] = clearing_price_values
-    results["Demand"] = total_needed_demand
-    results["Demand satisfied"] = total_needed_demand - demand_unsatisfied
-    results["Demand unsatisfied"] = demand_unsatisfied
-    results["Battery production"] = - power_injected.X + power_drawn.X
-    results["State of charge"] = state_of_charge.X / max_SoC
-    results["Battery profit"] = -results["Clearing price"] * results["Battery production"]
-    results["up reserve price"] = [total_up_reserve[t].Pi for t in range(nbHour)]
-    results["down reserve price"] = [total_down_reserve[t].Pi for t in range(nbHour)]
-    results["up reserve generator"] = {t: {g: up_reserve_generator[t][g].X for g in range(nbUnits)} for t in range(nbHour)}
-    results["down reserve generator"] = {t: {g: down_reserve_generator[t][g].X for g in range(nbUnits)} for t in range(nbHour)}
+    results = market_results(
+        production_values,
+        demand_supplied_values,
+        clearing_price_values,
+        generation_units.cost,
+        total_needed_demand,
+        power_injected_values,
+        power_drawn_values,
+        state_of_charge_values,
+        max_SoC,
+    )
+    results["up reserve price"] = up_reserve_prices
+    results["down reserve price"] = down_reserve_prices
+    results["up reserve generator"] = {t: dict(enumerate(up_reserve_values[t])) for t in range(nbHour)}
+    results["down reserve generator"] = {t: dict(enumerate(down_reserve_values[t])) for t in range(nbHour)}
+    run_record.end_phase("extract")
 
     # if show_plots:
     #     plot_results(nbUnits=nbUnits, results=results)
@@ -421,12 +509,12 @@ def step6_reserve_market(
             ylabel='Down reserve capacity [MW]',
             title='Down reserve market'
             )
-
-    
+    run_record.end_phase("plot")
 
     return m
 
-step6_reserve_market(show_plots=True)
+if __name__ == "__main__":
+    step6_reserve_market(show_plots=True)
 
 
 
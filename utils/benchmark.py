@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.inputStore import load_input_store
+from utils.linearProgram import LinearProgramSolution
+from utils.results import get_duals, get_objective, get_values
+from utils.syntheticGrid import generate_grid, write_grid
+
+repository_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+default_directory = os.path.join(repository_directory, ".cache", "benchmark")
+
+# Formulation: (directory of the step, module)
+formulations = {
+    "step2": ("Step2", "step2"),
+    "step4": ("Step4", "step4"),
+    "step4_zonal": ("Step4_zonal", "step4_zonal"),
+    "step5": ("Step5", "step5"),
+    "step6": ("Step6", "step6"),
+}
+default_sizes = (100, 1000, 10000)
+phases = ("load", "day_ahead", "build", "solve", "extract")
+
+
+################################################################################
+# Phases of each formulation (run in the process of run_formulation)
+################################################################################
+
+
+def solve_linear_program(lp, solver: str, phase) -> LinearProgramSolution:
+    """
+    Solves a LinearProgram. With Gurobi, the model is built in the "build" phase and the solution
+    read in the "extract" phase; HiGHS returns the solution at the end of its "solve" phase.
+    """
+    if solver != "gurobi":
+        with phase("solve"):
+            return lp.solve(solver)
+    with phase("build"):
+        m, x, _ = lp.to_gurobi()
+        m.Params.OutputFlag = 0
+    with phase("solve"):
+        m.optimize()
+    with phase("extract"):
+        return LinearProgramSolution(lp, get_objective(m), get_values(m, x), get_duals(m, m.getConstrs()))
+
+
+def benchmark_step2(step2, solver: str, phase):
+    """
+    Copper plate day-ahead market, matrix form (build_step2_linear_program).
+    """
+    with phase("build"):
+        lp = step2.build_step2_linear_program()
+    solution = solve_linear_program(lp, solver, phase)
+    with phase("extract"):
+        step2.step2_matrix_results(solution.x, lp.variables, solution.get_duals("GenerationBalance"))
+
+
+def benchmark_step4(step4, solver: str, phase):
+    """
+    Nodal day-ahead market, PTDF formulation with all the line limits (build_nodal_ptdf_linear_program).
+    """
+    with phase("build"):
+        lp, _ = step4.build_nodal_ptdf_linear_program()
+    solution = solve_linear_program(lp, solver, phase)
+    with phase("extract"):
+        line_duals = solution.get_duals("flow_upper_limit") + solution.get_duals("flow_lower_limit")
+        lmp = solution.get_duals("balance")[:, None] - line_duals.reshape(step4.nbHour, step4.nbLines) @ step4.ptdf
+        step4.nodal_results(
+            *(solution.get_values(name) for name in ("production", "demand_supplied", "state_of_charge", "power_injected", "power_drawn")),
+            lmp,
+        )
+
+
+def benchmark_step4_zonal(step4_zonal, solver: str, phase):
+    """
+    Zonal day-ahead market, ATC coupling (build_zonal_linear_program).
+    """
+    with phase("build"):
+        lp = step4_zonal.build_zonal_linear_program()
+    solution = solve_linear_program(lp, solver, phase)
+    with phase("extract"):
+        prices = solution.get_duals("balance").reshape(len(step4_zonal.zones), step4_zonal.nbHour).T
+        step4_zonal.zonal_results(prices, *(solution.get_values(name) for name in ("production", "demand_supplied", "flow_interzonal")))
+
+
+def benchmark_step5(step5, solver: str, phase, max_cases: int = 100):
+    """
+    Balancing markets of all the hours for N-1 outages and wind deviations (clear_balancing_cases),
+    on the day-ahead market of Step 2 (matrix form). At most max_cases cases, evenly spread.
+    """
+    import step2
+
+    with phase("day_ahead"):
+        solution = step2.build_step2_linear_program().solve(solver)
+        production = solution.get_values("production")
+        demand = solution.get_values("demand supplied")
+        clearing_price = solution.get_duals("GenerationBalance")
+    with phase("build"):
+        _, outaged_generators, delta_wind_production = step5.contingency_cases(nbOutages=1)
+        cases = np.unique(np.linspace(0, len(outaged_generators) - 1, max_cases).astype(int))
+        outaged_generators, delta_wind_production = outaged_generators[cases], delta_wind_production[cases]
+    with phase("solve"):
+        results = step5.clear_balancing_cases(production, demand, clearing_price, outaged_generators, delta_wind_production)
+    with phase("extract"):
+        step5.balancing_profits(results, outaged_generators, delta_wind_production)
+
+
+def benchmark_step6(step6, solver: str, phase):
+    """
+    Reserve market (build_reserve_linear_program), then day-ahead market on the capacity left
+    by the reserves (build_day_ahead_linear_program).
+    """
+    with phase("build"):
+        reserve_lp = step6.build_reserve_linear_program()
+    reserve = solve_linear_program(reserve_lp, solver, phase)
+    with phase("extract"):
+        up_reserve, down_reserve = reserve.get_values("up_reserve"), reserve.get_values("down_reserve")
+        reserve.get_duals("total_up_reserve")
+        reserve.get_duals("total_down_reserve")
+    with phase("build"):
+        day_ahead_lp = step6.build_day_ahead_linear_program(up_reserve, down_reserve)
+    day_ahead = solve_linear_program(day_ahead_lp, solver, phase)
+    with phase("extract"):
+        day_ahead.get_duals("balance")
+        day_ahead.get_values("production")
+        day_ahead.get_values("demand_supplied")
+
+
+def run_formulation(formulation: str, solver: str = "highs") -> dict:
+    """
+    Times the phases of a formulation on the inputs of $INPUTS_DIR, in the current process: "load"
+    (import of the step, which reads the inputs and creates the units), then "day_ahead" (Step 5
+    only), "build", "solve" and "extract", as in the benchmark_<formulation> functions. A phase
+    entered several times gets the sum of its times.
+
+    Returns:
+        dict: The seconds of each phase.
+    """
+    step_directory, module = formulations[formulation]
+    sys.path.insert(0, os.path.join(repository_directory, step_directory))
+    times = {}
+
+    @contextlib.contextmanager
+    def phase(name):
+        start = time.perf_counter()
+        yield
+        times[name] = times.get(name, 0) + time.perf_counter() - start
+
+    with contextlib.redirect_stdout(sys.stderr):  # The steps print their inputs and results
+        with phase("load"):
+            step = importlib.import_module(module)
+        globals()[f"benchmark_{formulation}"](step, solver, phase)
+    return times
+
+
+################################################################################
+# Benchmark suite
+################################################################################
+
+
+def case_directory(nbNode: int, directory: str = default_directory, seed: int = 0, **grid_options) -> str:
+    """
+    Returns the inputs directory of the synthetic grid of nbNode nodes, generated at the first call
+    (see utils.syntheticGrid.generate_grid for the options) and converted to an input store.
+    """
+    inputs_directory = os.path.join(directory, f"grid{nbNode}_seed{seed}")
+    if not os.path.exists(os.path.join(inputs_directory, "load_profile.csv")):
+        write_grid(generate_grid(nbNode, seed=seed, **grid_options), inputs_directory)
+    load_input_store(inputs_directory)
+    os.makedirs(os.path.join(inputs_directory, "work"), exist_ok=True)
+    return inputs_directory
+
+
+def run_benchmark(
+    sizes=default_sizes,
+    formulation_names=tuple(formulations),
+    solver: str = "highs",
+    directory: str = default_directory,
+    timeout: float = 3600,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Times the phases of the formulations on synthetic grids of several sizes.
+
+    Each formulation runs in its own process (each step has its own scripts package), on the
+    inputs of case_directory, so that the load phase includes the reading of the inputs. A
+    formulation which fails (e.g. a model too large for the Gurobi licence, or out of memory)
+    or runs over timeout seconds gets its error instead of its times.
+
+    Parameters:
+        sizes (list of int): The numbers of nodes of the grids.
+        formulation_names (list of str): Formulations among formulations.
+        solver (str): "highs" or "gurobi", for all the formulations (built as a LinearProgram,
+            step5 for its day-ahead market).
+        directory (str): The directory of the grids.
+        timeout (float): The maximum seconds of a formulation on a grid.
+        seed (int): The seed of the grids.
+
+    Returns:
+        pd.DataFrame: One row per grid and formulation: nodes, formulation, the seconds of each
+            phase, total and error.
+    """
+    rows = []
+    for nbNode in sizes:
+        inputs_directory = case_directory(nbNode, directory, seed)
+        environment = dict(os.environ, INPUTS_DIR=inputs_directory, PYTHONPATH=repository_directory, MPLBACKEND="Agg")
+        for formulation in formulation_names:
+            row = {"nodes": nbNode, "formulation": formulation, "error": None}
+            try:
+                process = subprocess.run(
+                    [sys.executable, "-m", "utils.benchmark", "--run", formulation, "--solver", solver],
+                    cwd=os.path.join(inputs_directory, "work"),
+                    env=environment,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                )
+                if process.returncode == 0:
+                    row.update(json.loads(process.stdout.strip().splitlines()[-1]))
+                elif process.returncode < 0:
+                    row["error"] = f"killed by signal {-process.returncode} (e.g. out of memory)"
+                else:
+                    row["error"] = (process.stderr.strip().splitlines() or [f"exit code {process.returncode}"])[-1]
+            except subprocess.TimeoutExpired:
+                row["error"] = f"timeout after {timeout} s"
+            rows.append(row)
+            print(f"{nbNode} nodes, {formulation}: {row['error'] or ', '.join(f'{name} {row[name]:.3f} s' for name in phases if name in row)}")
+
+    results = pd.DataFrame(rows, columns=["nodes", "formulation", *phases, "error"])
+    results.insert(len(phases) + 2, "total", results[list(phases)].sum(axis=1, min_count=1))
+    return results
+
+
+def find_regressions(results: pd.DataFrame, baseline: pd.DataFrame, tolerance: float = 0.25, min_seconds: float = 0.05) -> pd.DataFrame:
+    """
+    Compares the results of run_benchmark with a baseline (e.g. of the previous commit).
+
+    A phase regressed when it is more than (1 + tolerance) times slower than in the baseline, and
+    slower by more than min_seconds (to ignore the noise of the short phases). A formulation which
+    ran in the baseline but fails now also regressed.
+
+    Returns:
+        pd.DataFrame: One row per regression: nodes, formulation, phase, baseline, seconds and ratio.
+    """
+    merged = results.merge(baseline, on=["nodes", "formulation"], suffixes=("", "_baseline"))
+    rows = []
+    for _, row in merged.iterrows():
+        if pd.notna(row["error"]) and pd.isna(row["error_baseline"]):
+            rows.append({"nodes": row["nodes"], "formulation": row["formulation"], "phase": "failed", "baseline": row["total_baseline"], "seconds": np.nan, "ratio": np.inf})
+            continue
+        for name in (*phases, "total"):
+            seconds, seconds_baseline = row[name], row[f"{name}_baseline"]
+            if pd.isna(seconds) or pd.isna(seconds_baseline):
+                continue
+            if seconds > (1 + tolerance) * seconds_baseline and seconds - seconds_baseline > min_seconds:
+                rows.append(
+                    {"nodes": row["nodes"], "formulation": row["formulation"], "phase": name, "baseline": seconds_baseline, "seconds": seconds, "ratio": seconds / seconds_baseline}
+                )
+    return pd.DataFrame(rows, columns=["nodes", "formulation", "phase", "baseline", "seconds", "ratio"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Times the build, solve and result extraction of the formulations on synthetic grids."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(default_sizes))
+    parser.add_argument("--formulations", nargs="+", default=list(formulations), choices=list(formulations))
+    parser.add_argument("--solver", default="highs", choices=["highs", "gurobi"])
+    parser.add_argument("--directory", default=default_directory)
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Writes the results to this json file.")
+    parser.add_argument("--baseline", help="Reports the regressions against this json file (of --output).")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--run", choices=list(formulations), help=argparse.SUPPRESS)  # One formulation, see run_benchmark
+    arguments = parser.parse_args()
+
+    if arguments.run is not None:
+        print(json.dumps(run_formulation(arguments.run, arguments.solver)))
+        sys.exit(0)
+
+    results = run_benchmark(arguments.sizes, arguments.formulations, arguments.solver, arguments.directory, arguments.timeout, arguments.seed)
+    print(results.to_string(index=False))
+    if arguments.output:
+        results.to_json(arguments.output, orient="records", indent=1)
+    if arguments.baseline:
+        regressions = find_regressions(results, pd.read_json(arguments.baseline, orient="records"), arguments.tolerance)
+        if len(regressions) > 0:
+            print("\nRegressions:")
+            print(regressions.to_string(index=False))
+            sys.exit(1)
+        print("\nNo regression.")
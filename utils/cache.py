@@ -0,0 +1,157 @@
+import hashlib
+import os
+
+import numpy as np
+
+default_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".cache", "results"))
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of solved linear programs.
+
+    The key of a model is a hash of everything that defines it: the constraint matrix, the senses and
+    right-hand sides, the bounds and objective coefficients (so all the input data, scenario, bid prices
+    and battery parameters it was built from) and the given options. The primal values, the duals and
+    the objective are stored in a compressed .npz file named after the key. When the files exceed
+    max_size bytes, the least recently used ones are deleted.
+
+    Attributes:
+        directory (str): The directory of the files.
+        max_size (int): The maximum total size of the files, in bytes.
+    """
+
+    def __init__(self, directory: str = None, max_size: int = 512 * 2**20):
+        """
+        Parameters:
+            directory (str): The directory of the files, $RESULT_CACHE_DIR or .cache/results at the root of the repository by default.
+            max_size (int): The maximum total size of the files, in bytes.
+        """
+        self.directory = directory or os.environ.get("RESULT_CACHE_DIR", default_directory)
+        self.max_size = max_size
+
+    @staticmethod
+    def model_key(m, options=None) -> str:
+        """
+        Returns the key of a Gurobi model (hexadecimal SHA-256).
+
+        Parameters:
+            m (gp.Model): The model, solved or not.
+            options: Anything else the solution depends on, hashed through its repr.
+        """
+        m.update()
+        variables, constraints = m.getVars(), m.getConstrs()
+        A = m.getA().tocsr()
+        A.sort_indices()
+
+        digest = hashlib.sha256()
+        digest.update(repr((A.shape, m.ModelSense, m.ObjCon, options)).encode())
+        for array in (
+            A.indptr,
+            A.indices,
+            A.data,
+            m.getAttr("Sense", constraints),
+            m.getAttr("RHS", constraints),
+            m.getAttr("LB", variables),
+            m.getAttr("UB", variables),
+            m.getAttr("Obj", variables),
+        ):
+            array = np.asarray(array)
+            if array.dtype.kind == "U":
+                array = array.astype("S1")
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key: str) -> dict:
+        """
+        Returns the solution stored under key ("x", "pi" and "objective"), None if there is none.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                solution = {name: data[name] for name in ("x", "pi", "objective")}
+        except (OSError, KeyError, ValueError):
+            return None
+        os.utime(path)  # Most recently used
+        return solution
+
+    def store(self, key: str, x: np.array, pi: np.array, objective: float):
+        """
+        Stores a solution under key, then deletes the least recently used files beyond max_size.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self.path(key) + f".{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez_compressed(file, x=x, pi=pi, objective=objective)
+        os.replace(temporary_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used files until their total size is at most max_size.
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total_size <= self.max_size:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total_size -= size
+
+    def clear(self):
+        """
+        Deletes all the files of the cache.
+        """
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+
+result_cache = ResultCache()
+
+
+def optimize(m, cache: ResultCache = result_cache, options=None):
+    """
+    Optimizes a Gurobi model, unless its solution is in the cache.
+
+    On a hit, the model is not solved: the solution is kept in m._cached_solution, where the helpers
+    of utils.results (get_values, get_duals, get_objective) read it. On a miss, the model is solved
+    and its optimal solution stored. The same model must then be optimized through this function
+    only, so that a solution of the cache never outlives a change of the model.
+
+    Parameters:
+        m (gp.Model): The model.
+        cache (ResultCache): The cache, None to always solve.
+        options: Anything else the solution depends on, see ResultCache.model_key.
+
+    Returns:
+        bool: True if the solution comes from the cache.
+    """
+    m._cached_solution = None
+    if cache is None:
+        m.optimize()
+        return False
+
+    key = cache.model_key(m, options)
+    solution = cache.load(key)
+    if solution is not None:
+        m._cached_solution = solution
+        return True
+
+    m.optimize()
+    if m.Status == 2:  # GRB.OPTIMAL
+        cache.store(
+            key,
+            np.array(m.getAttr("X", m.getVars())),
+            np.array(m.getAttr("Pi", m.getConstrs())),
+            m.ObjVal,
+        )
+    return False
@@ -0,0 +1,177 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+default_inputs_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "inputs"))
+
+# Tables of inputs/ (csv files separated by ;)
+tables = ("gen_parameters", "wind_parameters", "load_location", "load_profile", "transmission_parameters")
+# Tables of inputs/ that a case may not have: zones.csv (node;zone) assigns the nodes to the zones of Step4_zonal
+optional_tables = ("zones",)
+
+# Scenario files of inputs/data/ (prefix, zone id): scen_zoneW0.csv, ..., scen_zone8.csv, ...
+scenario_file_pattern = re.compile(r"^(scen_zoneW|scen_zone)(\d+)\.csv$")
+
+
+def source_files(inputs_directory: str) -> list:
+    """
+    Returns the csv files of the inputs, relative to inputs_directory.
+    """
+    files = [f"{table}.csv" for table in tables]
+    files += [f"{table}.csv" for table in optional_tables if os.path.exists(os.path.join(inputs_directory, f"{table}.csv"))]
+    data_directory = os.path.join(inputs_directory, "data")
+    if os.path.isdir(data_directory):
+        files += [os.path.join("data", name) for name in sorted(os.listdir(data_directory)) if scenario_file_pattern.match(name)]
+    return files
+
+
+def source_signature(inputs_directory: str) -> dict:
+    """
+    Returns the size and modification time of each csv file, to know if a store is up to date.
+    """
+    signature = {}
+    for file in source_files(inputs_directory):
+        stat = os.stat(os.path.join(inputs_directory, file))
+        signature[file] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def convert_inputs(inputs_directory: str = default_inputs_directory, store_directory: str = None) -> str:
+    """
+    Converts the csv files of the inputs, once, into a columnar binary store: one .npy file per column
+    of each table, and one (zones x hours x scenarios) array per family of scenario files, described
+    by a manifest.json. See InputStore to read it.
+
+    Parameters:
+        inputs_directory (str): The directory of the csv files (inputs/ by default).
+        store_directory (str): The directory of the store, inputs_directory/store by default.
+
+    Returns:
+        str: The directory of the store.
+    """
+    store_directory = store_directory or os.path.join(inputs_directory, "store")
+    os.makedirs(store_directory, exist_ok=True)
+    manifest = {"tables": {}, "scenarios": {}, "sources": source_signature(inputs_directory)}
+
+    table_files = [file for file in source_files(inputs_directory) if not file.startswith("data")]
+    for table in [file[: -len(".csv")] for file in table_files]:
+        data = pd.read_csv(os.path.join(inputs_directory, f"{table}.csv"), sep=";")
+        data.columns = [column.lstrip("\ufeff") for column in data.columns]
+        manifest["tables"][table] = list(data.columns)
+        for index, column in enumerate(data.columns):
+            np.save(os.path.join(store_directory, f"{table}.{index}.npy"), data[column].to_numpy())
+
+    scenario_files = {}
+    for file in source_files(inputs_directory)[len(table_files):]:
+        prefix, zone_id = scenario_file_pattern.match(os.path.basename(file)).groups()
+        scenario_files.setdefault(prefix, []).append((int(zone_id), file))
+    for prefix, files in scenario_files.items():
+        files.sort()
+        data = [pd.read_csv(os.path.join(inputs_directory, file), sep=",", index_col=0) for _, file in files]
+        scenarios = list(data[0].columns)
+        np.save(
+            os.path.join(store_directory, f"{prefix}.npy"),
+            np.stack([zone_data[scenarios].to_numpy(dtype=float) for zone_data in data]),
+        )
+        manifest["scenarios"][prefix] = {"zones": [zone_id for zone_id, _ in files], "scenarios": scenarios}
+
+    with open(os.path.join(store_directory, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=1)
+    return store_directory
+
+
+class InputStore:
+    """
+    Reader of the store of convert_inputs.
+
+    The arrays are memory-mapped: opening the store reads only its manifest, and a slice of the
+    scenarios (some zones, hours or scenarios) only reads these values from the disk.
+    """
+
+    def __init__(self, store_directory: str, mmap: bool = True):
+        """
+        Parameters:
+            store_directory (str): The directory of the store.
+            mmap (bool): Memory-map the arrays (True) or load them in memory.
+        """
+        self.store_directory = store_directory
+        self.mmap_mode = "r" if mmap else None
+        with open(os.path.join(store_directory, "manifest.json")) as file:
+            self.manifest = json.load(file)
+
+    def column(self, table: str, column: str) -> np.array:
+        """
+        Returns a column of a table (e.g. column("gen_parameters", "Pmax")).
+        """
+        index = self.manifest["tables"][table].index(column)
+        return np.load(os.path.join(self.store_directory, f"{table}.{index}.npy"), mmap_mode=self.mmap_mode)
+
+    def nbRows(self, table: str) -> int:
+        """
+        Returns the number of rows of a table (e.g. nbRows("load_profile") is the number of hours).
+        """
+        return len(self.column(table, self.manifest["tables"][table][0]))
+
+    def has_table(self, table: str) -> bool:
+        """
+        Returns True if the inputs have the table (see optional_tables).
+        """
+        return table in self.manifest["tables"]
+
+    def table(self, table: str, index_col: str = None) -> pd.DataFrame:
+        """
+        Returns a table, as pd.read_csv would read its csv file.
+
+        Parameters:
+            table (str): The name of the table, one of tables or optional_tables (e.g. "gen_parameters").
+            index_col (str): The column to use as index.
+        """
+        data = pd.DataFrame({column: np.asarray(self.column(table, column)) for column in self.manifest["tables"][table]})
+        return data.set_index(index_col) if index_col is not None else data
+
+    def scenario_names(self, prefix: str = "scen_zoneW") -> list:
+        """
+        Returns the names of the scenarios (V1 to V100).
+        """
+        return self.manifest["scenarios"][prefix]["scenarios"]
+
+    def scenarios(self, prefix: str = "scen_zoneW", zones=None, hours=None, scenarios=None) -> np.array:
+        """
+        Returns the scenarios of a family of files (scen_zoneW or scen_zone), of shape (zones x hours x scenarios).
+
+        Parameters:
+            prefix (str): The family of files, "scen_zoneW" (wind farms) or "scen_zone".
+            zones (list of int): The zone ids (the number in the file names), all by default.
+            hours (int or slice): The number of first hours, or a slice of hours, all by default.
+            scenarios (list of str): The scenario names (e.g. ["V1"]), all by default.
+        """
+        description = self.manifest["scenarios"][prefix]
+        values = np.load(os.path.join(self.store_directory, f"{prefix}.npy"), mmap_mode=self.mmap_mode)
+        zone_index = slice(None) if zones is None else [description["zones"].index(zone) for zone in zones]
+        hour_index = slice(hours) if isinstance(hours, int) or hours is None else hours
+        scenario_index = slice(None) if scenarios is None else [description["scenarios"].index(name) for name in scenarios]
+        values = values[:, hour_index]  # Basic slice first: still a view of the memory-mapped file
+        return np.asarray(values[zone_index][:, :, scenario_index])
+
+
+def load_input_store(inputs_directory: str = None, store_directory: str = None, mmap: bool = True) -> InputStore:
+    """
+    Opens the store of the inputs, after converting the csv files if the store does not exist
+    or if a csv file changed since the conversion.
+
+    The inputs are $INPUTS_DIR, or inputs/ by default: the steps run on another case (e.g. a grid of
+    utils.syntheticGrid) when this variable is set.
+    """
+    inputs_directory = inputs_directory or os.environ.get("INPUTS_DIR", default_inputs_directory)
+    store_directory = store_directory or os.path.join(inputs_directory, "store")
+    manifest_path = os.path.join(store_directory, "manifest.json")
+    up_to_date = False
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            up_to_date = json.load(file)["sources"] == source_signature(inputs_directory)
+    if not up_to_date:
+        convert_inputs(inputs_directory, store_directory)
+    return InputStore(store_directory, mmap=mmap)
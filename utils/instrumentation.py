@@ -0,0 +1,156 @@
+import atexit
+import cProfile
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: no peak memory
+    resource = None
+
+
+def peak_memory() -> float:
+    """
+    Returns the peak resident memory of the process so far, in MB (None on Windows).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, kB on Linux
+
+
+def model_statistics(model) -> dict:
+    """
+    Returns the size of a model and, once solved, the statistics of the solver.
+
+    Parameters:
+        model: A Gurobi model, a LinearProgram or a LinearProgramSolution (utils.linearProgram).
+
+    Returns:
+        dict: "variables", "constraints" and "nonzeros", and "solver": the status, runtime (s),
+            simplex and barrier iterations and objective of a solved Gurobi model, "cached" if its
+            solution comes from the result cache (utils.cache), the objective of a LinearProgramSolution.
+    """
+    if hasattr(model, "linear_program"):  # LinearProgramSolution
+        statistics = model_statistics(model.linear_program)
+        statistics["solver"] = {"objective": float(model.objective)}
+        return statistics
+    if hasattr(model, "blocks"):  # LinearProgram
+        return {
+            "variables": model.nbVariables,
+            "constraints": model.nbConstraints,
+            "nonzeros": int(sum(matrix.nnz for _, matrix, _, _ in model.blocks)),
+        }
+
+    model.update()
+    statistics = {"variables": model.NumVars, "constraints": model.NumConstrs, "nonzeros": model.NumNZs}
+    if getattr(model, "_cached_solution", None) is not None:
+        statistics["solver"] = {"cached": True}
+    elif model.Status != 1:  # GRB.LOADED: not solved yet
+        statistics["solver"] = {
+            "status": model.Status,
+            "runtime": model.Runtime,
+            "iterations": model.IterCount,
+            "barrier_iterations": model.BarIterCount,
+            "objective": model.ObjVal if model.SolCount > 0 else None,
+        }
+    return statistics
+
+
+class RunRecord:
+    """
+    Opt-in record of the phases of a run of a step, appended as one JSON line to a file at the end
+    of the run (or by write).
+
+    The phases follow each other: end_phase closes the phase started by the previous end_phase
+    (or by start_phase, or at the creation of the record) and records its wall and CPU times, the
+    peak memory of the process, and the statistics of the given models (see model_statistics).
+    When the record is disabled (no file), these methods return at once.
+
+    Attributes:
+        run (str): The name of the run (e.g. "step4").
+        path (str): The JSON lines file, None to disable the record.
+        profile_directory (str): The directory of the cProfile dumps of start_phase(profile=True),
+            None to never profile.
+        phases (list of dict): The phases recorded since the last write.
+    """
+
+    def __init__(self, run: str, path: str = None, profile_directory: str = None):
+        self.run = run
+        self.path = path
+        self.profile_directory = profile_directory
+        self.enabled = path is not None
+        self.phases = []
+        self.group = None
+        self.profiler = None
+        self.start_time = time.time()
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        if self.enabled:
+            atexit.register(self.write)
+
+    def start_phase(self, group: str = None, profile: bool = False):
+        """
+        Starts the next phase now, e.g. at the beginning of a function.
+
+        Parameters:
+            group (str): The group of the next phases (e.g. the name of the function), recorded with them.
+            profile (bool): Profile the next phase with cProfile, if there is a profile_directory
+                (e.g. for the build of a model).
+        """
+        if not self.enabled:
+            return
+        self.group = group
+        if profile and self.profile_directory is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+
+    def end_phase(self, name: str, *models):
+        """
+        Records the phase which ends now, and starts the next one.
+
+        Parameters:
+            name (str): The name of the phase (e.g. "inputs", "build", "solve", "extract", "plot").
+            models: The models built or solved in the phase (see model_statistics).
+        """
+        if not self.enabled:
+            return
+        wall, cpu = time.perf_counter() - self.wall, time.process_time() - self.cpu
+        phase = {"phase": name, "group": self.group, "wall": wall, "cpu": cpu, "peak_memory_mb": peak_memory()}
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(self.profile_directory, exist_ok=True)
+            phase["profile"] = os.path.join(self.profile_directory, f"{self.run}-{os.getpid()}-{len(self.phases)}-{name}.prof")
+            self.profiler.dump_stats(phase["profile"])
+            self.profiler = None
+        if models:
+            phase["models"] = [model_statistics(model) for model in models]
+        self.phases.append(phase)
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+
+    def write(self):
+        """
+        Appends the record of the phases so far to the file, as one JSON line, and empties it.
+        """
+        if not self.enabled or not self.phases:
+            return
+        record = {
+            "run": self.run,
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_time)),
+            "pid": os.getpid(),
+            "command": sys.argv,
+            "phases": self.phases,
+        }
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        self.phases = []
+
+
+def start_run(run: str) -> RunRecord:
+    """
+    Returns the record of a run, enabled by the environment variable INSTRUMENTATION_FILE (the
+    JSON lines file). INSTRUMENTATION_PROFILE_DIR also dumps a cProfile of the build phases.
+    """
+    return RunRecord(run, os.environ.get("INSTRUMENTATION_FILE"), os.environ.get("INSTRUMENTATION_PROFILE_DIR"))
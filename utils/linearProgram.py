@@ -0,0 +1,219 @@
+import numpy as np
+import scipy.sparse as sp
+
+solvers = ("gurobi", "highs")
+
+
+class LinearProgram:
+    """
+    Linear program in matrix form, independent of the solver.
+
+    Variables and constraints are added by named blocks: a block of variables is a set of indices in the vector of all the variables, and a block of constraints is a sparse matrix with its senses and right-hand sides. The same program can then be solved by Gurobi or by HiGHS (through scipy.optimize.linprog, no licence needed), with the primal values and the duals returned in the same shapes.
+
+    The duals follow the Gurobi convention (Pi): the derivative of the objective with respect to the right-hand side. For a welfare maximisation, the duals of the balance constraints are therefore the clearing prices whichever the solver.
+
+    Attributes:
+        sense (str): "max" or "min".
+        variables (dict): name of a block -> indices of its variables (np.array of the shape of the block).
+        constraints (dict): name of a block -> indices of its rows.
+    """
+
+    def __init__(self, sense: str = "max"):
+        """
+        Initializes an empty linear program.
+
+        Parameters:
+            sense (str): "max" to maximise the objective, "min" to minimise it.
+        """
+        if sense not in ("max", "min"):
+            raise ValueError(f"Unknown sense '{sense}', use 'max' or 'min'.")
+        self.sense = sense
+        self.variables = {}
+        self.constraints = {}
+        self.nbVariables = 0
+        self.nbConstraints = 0
+        self.lb, self.ub, self.obj = [], [], []
+        self.blocks = []  # (name, matrix, senses, rhs) of each block of constraints
+
+    def add_variables(self, name: str, shape, lb=0, ub=np.inf, obj=0) -> np.array:
+        """
+        Adds a block of variables.
+
+        Parameters:
+            name (str): The name of the block.
+            shape (int or tuple): The shape of the block.
+            lb, ub, obj (float or np.array): The bounds and objective coefficients, broadcast to shape.
+
+        Returns:
+            np.array: The indices of the new variables, of the given shape.
+        """
+        indices = self.nbVariables + np.arange(int(np.prod(shape))).reshape(shape)
+        self.lb.append(np.broadcast_to(np.asarray(lb, dtype=float), indices.shape).ravel())
+        self.ub.append(np.broadcast_to(np.asarray(ub, dtype=float), indices.shape).ravel())
+        self.obj.append(np.broadcast_to(np.asarray(obj, dtype=float), indices.shape).ravel())
+        self.variables[name] = indices
+        self.nbVariables += indices.size
+        return indices
+
+    def add_constraints(self, name: str, terms: list, sense, rhs) -> np.array:
+        """
+        Adds a block of constraints: sum of matrix @ variables[indices] (sense) rhs.
+
+        Parameters:
+            name (str): The name of the block.
+            terms (list of tuple): (matrix, indices) pairs, where matrix is of shape (nbRows, indices.size) (sparse or dense) and indices are the variables it multiplies (in their flattened order).
+            sense (str or np.array): "=", "<" or ">", for all the rows or row by row.
+            rhs (float or np.array): The right-hand sides.
+
+        Returns:
+            np.array: The indices of the new rows.
+        """
+        rows, cols, data = [], [], []
+        nbRows = None
+        for matrix, indices in terms:
+            matrix = sp.coo_matrix(matrix)
+            if nbRows is not None and matrix.shape[0] != nbRows:
+                raise ValueError(f"All the terms of '{name}' must have {nbRows} rows, got {matrix.shape[0]}.")
+            nbRows = matrix.shape[0]
+            rows.append(matrix.row)
+            cols.append(np.asarray(indices).ravel()[matrix.col])
+            data.append(matrix.data)
+        matrix = sp.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(nbRows, self.nbVariables),
+        )
+        senses = np.broadcast_to(np.asarray(sense), (nbRows,))
+        rhs = np.broadcast_to(np.asarray(rhs, dtype=float), (nbRows,))
+        self.blocks.append((name, matrix, senses, rhs))
+
+        indices = self.nbConstraints + np.arange(nbRows)
+        self.constraints[name] = indices
+        self.nbConstraints += nbRows
+        return indices
+
+    def get_matrices(self):
+        """
+        Returns the whole program as arrays: the constraint matrix (sp.csr_matrix of shape (nbConstraints, nbVariables)), the senses, the right-hand sides, the lower and upper bounds and the objective coefficients.
+        """
+        matrices = []
+        for _, matrix, _, _ in self.blocks:
+            matrix = matrix.copy()
+            matrix.resize((matrix.shape[0], self.nbVariables))  # variables added after the block
+            matrices.append(matrix)
+        A = sp.vstack(matrices, format="csr") if matrices else sp.csr_matrix((0, self.nbVariables))
+        senses = np.concatenate([block[2] for block in self.blocks]) if self.blocks else np.array([], dtype=str)
+        rhs = np.concatenate([block[3] for block in self.blocks]) if self.blocks else np.array([])
+        return A, senses, rhs, np.concatenate(self.lb), np.concatenate(self.ub), np.concatenate(self.obj)
+
+    def to_gurobi(self):
+        """
+        Builds the Gurobi model of the program, e.g. to update it in place and re-solve it.
+
+        Returns:
+            m (gp.Model): The model.
+            x (MVar): All the variables, ordered as in `variables`.
+            constraints (dict): name of a block -> its MConstr.
+        """
+        import gurobipy as gp
+        from gurobipy import GRB
+
+        m = gp.Model()
+        _, _, _, lb, ub, obj = self.get_matrices()
+        x = m.addMVar(shape=(self.nbVariables,), lb=lb, ub=ub, obj=obj, name="x", vtype=GRB.CONTINUOUS)
+        m.ModelSense = GRB.MAXIMIZE if self.sense == "max" else GRB.MINIMIZE
+
+        constraints = {}
+        for name, matrix, senses, rhs in self.blocks:
+            matrix = matrix.copy()
+            matrix.resize((matrix.shape[0], self.nbVariables))
+            constraints[name] = m.addMConstr(matrix, x, senses, rhs, name=name)
+        return m, x, constraints
+
+    def solve(self, solver: str = "highs", output_flag: int = 0):
+        """
+        Solves the program.
+
+        Parameters:
+            solver (str): "gurobi" or "highs".
+            output_flag (int): 1 to print the log of the solver.
+
+        Returns:
+            LinearProgramSolution: The objective, primal values and duals.
+
+        Raises:
+            ValueError: If the solver is unknown.
+            RuntimeError: If no optimal solution is found.
+        """
+        if solver == "gurobi":
+            m, x, constraints = self.to_gurobi()
+            m.Params.OutputFlag = output_flag
+            m.optimize()
+            if m.Status != 2:  # GRB.OPTIMAL
+                raise RuntimeError(f"Gurobi did not find an optimal solution (status {m.Status}).")
+            duals = np.zeros(self.nbConstraints)
+            for name, constraint in constraints.items():
+                duals[self.constraints[name]] = constraint.Pi
+            return LinearProgramSolution(self, m.ObjVal, x.X, duals)
+
+        if solver == "highs":
+            from scipy.optimize import linprog
+
+            A, senses, rhs, lb, ub, obj = self.get_matrices()
+            sign = -1 if self.sense == "max" else 1  # linprog minimises
+            equal = senses == "="
+            lower = senses == "<"
+            greater = senses == ">"
+            A_ub = sp.vstack([A[lower], -A[greater]], format="csr")
+            b_ub = np.concatenate([rhs[lower], -rhs[greater]])
+            result = linprog(
+                sign * obj,
+                A_ub=A_ub if A_ub.shape[0] else None,
+                b_ub=b_ub if A_ub.shape[0] else None,
+                A_eq=A[equal] if equal.any() else None,
+                b_eq=rhs[equal] if equal.any() else None,
+                bounds=np.column_stack([lb, ub]),
+                method="highs",
+                options={"disp": bool(output_flag)},
+            )
+            if result.status != 0:
+                raise RuntimeError(f"HiGHS did not find an optimal solution: {result.message}")
+
+            # Marginals are derivatives of the minimised objective
+            duals = np.zeros(self.nbConstraints)
+            if equal.any():
+                duals[equal] = sign * result.eqlin.marginals
+            ineqlin = result.ineqlin.marginals if A_ub.shape[0] else np.array([])
+            duals[lower] = sign * ineqlin[: lower.sum()]
+            duals[greater] = -sign * ineqlin[lower.sum():]
+            return LinearProgramSolution(self, sign * result.fun, result.x, duals)
+
+        raise ValueError(f"Unknown solver '{solver}', use one of {solvers}.")
+
+
+class LinearProgramSolution:
+    """
+    Solution of a LinearProgram.
+
+    Attributes:
+        objective (float): The optimal value of the objective.
+        x (np.array): The primal values of all the variables.
+        pi (np.array): The duals of all the constraints (Gurobi convention, see LinearProgram).
+    """
+
+    def __init__(self, linear_program: LinearProgram, objective: float, x: np.array, pi: np.array):
+        self.linear_program = linear_program
+        self.objective = objective
+        self.x = x
+        self.pi = pi
+
+    def get_values(self, name: str) -> np.array:
+        """
+        Returns the primal values of a block of variables, in the shape of the block.
+        """
+        return self.x[self.linear_program.variables[name]]
+
+    def get_duals(self, name: str) -> np.array:
+        """
+        Returns the duals of a block of constraints.
+        """
+        return self.pi[self.linear_program.constraints[name]]
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+
+def flatten(items) -> tuple:
+    """
+    Flattens nested dictionaries or lists (e.g. production[t][g]) into a list.
+
+    Parameters:
+        items (dict, list, MVar, MConstr or element): The nested container, rectangular. Dictionaries are read in their insertion order.
+
+    Returns:
+        tuple: The list of the elements and the shape of the container.
+    """
+    if isinstance(items, dict):
+        items = list(items.values())
+    elif hasattr(items, "tolist") and not isinstance(items, np.ndarray):  # MVar, MConstr
+        items = items.tolist()
+    if not isinstance(items, (list, tuple)):
+        return [items], ()
+    elements, shape = [], ()
+    for item in items:
+        item_elements, shape = flatten(item)
+        elements.extend(item_elements)
+    return elements, (len(items),) + shape
+
+
+def get_values(m, items, attribute: str = "X") -> np.array:
+    """
+    Reads an attribute of many Gurobi variables or constraints with a single getAttr call.
+
+    If the solution of the model comes from the cache (utils.cache.optimize), "X" and "Pi" are read from it.
+
+    Parameters:
+        m (gp.Model): The solved model.
+        items: Variables or constraints in nested dictionaries or lists (e.g. production[t][g]), MVar or MConstr.
+        attribute (str): The attribute to read ("X" for the variables, "Pi" for the constraints, ...).
+
+    Returns:
+        np.array: The values, in the shape of the nested container.
+    """
+    elements, shape = flatten(items)
+    cached_solution = getattr(m, "_cached_solution", None)
+    if cached_solution is not None and attribute in ("X", "Pi"):
+        values = cached_solution["x" if attribute == "X" else "pi"]
+        return values[[element.index for element in elements]].reshape(shape)
+    return np.array(m.getAttr(attribute, elements), dtype=float).reshape(shape)
+
+
+def get_duals(m, constraints) -> np.array:
+    """
+    Reads the duals (Pi) of many constraints with a single getAttr call, see get_values.
+    """
+    return get_values(m, constraints, "Pi")
+
+
+def get_objective(m) -> float:
+    """
+    Returns the objective value of a solved model, from the cache if its solution comes from it (see get_values).
+    """
+    cached_solution = getattr(m, "_cached_solution", None)
+    if cached_solution is not None:
+        return float(cached_solution["objective"])
+    return m.ObjVal
+
+
+def market_results(
+    production: np.array,
+    demand_supplied: np.array,
+    clearing_price: np.array,
+    cost: np.array,
+    total_demand: np.array,
+    power_injected: np.array,
+    power_drawn: np.array,
+    state_of_charge: np.array,
+    battery_capacity: float,
+) -> pd.DataFrame:
+    """
+    Computes the results of a day-ahead market clearing with vector operations.
+
+    Parameters:
+        production (np.array): The production of the units, of shape (nbHour, nbUnits).
+        demand_supplied (np.array): The supplied demand of the loads, of shape (nbHour, nbLoadUnits).
+        clearing_price (np.array): The clearing prices, of shape (nbHour,).
+        cost (np.array): The costs of the units, of shape (nbUnits,).
+        total_demand (np.array): The needed demand, of shape (nbHour,).
+        power_injected, power_drawn, state_of_charge (np.array): The battery variables, of shape (nbHour,).
+        battery_capacity (float): The capacity of the battery, to give the state of charge in %.
+
+    Returns:
+        pd.DataFrame: One row per hour with the production and the profit of each unit, the clearing price, the demand (satisfied and unsatisfied), the battery production, state of charge and profit.
+    """
+    nbHour, nbUnits = production.shape
+    profit = production * (clearing_price[:, None] - cost[None, :])
+    demand_unsatisfied = total_demand - demand_supplied.sum(axis=1)
+    battery_production = - power_injected + power_drawn
+
+    columns = {"Hour": np.arange(nbHour)}
+    for g in range(nbUnits):
+        columns[f"PU production {g+1} (GW)"] = production[:, g]
+        columns[f"PU profit {g+1} ($)"] = profit[:, g]
+    columns["Clearing price"] = clearing_price
+    columns["Demand"] = total_demand
+    columns["Demand satisfied"] = total_demand - demand_unsatisfied
+    columns["Demand unsatisfied"] = demand_unsatisfied
+    columns["Battery production"] = battery_production
+    columns["State of charge"] = state_of_charge / battery_capacity
+    columns["Battery profit"] = - clearing_price * battery_production
+    return pd.DataFrame(columns)
@@ -0,0 +1,171 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from utils.inputStore import default_inputs_directory, load_input_store
+
+
+def generate_grid(
+    nbNode: int = 100,
+    nbGenerators: int = None,
+    nbWind: int = None,
+    nbLoads: int = None,
+    nbHour: int = 24,
+    nbScenarios: int = 10,
+    peak_load: float = 0.75,
+    seed: int = 0,
+) -> dict:
+    """
+    Generates a synthetic meshed grid, with the tables of inputs/ (same columns).
+
+    The nodes are drawn in a unit square. The lines form a ring around the center, meshed by a line
+    from every node to its nearest neighbour, with a reactance proportional to their length. The
+    conventional generators are copies of the ones of the 24-bus system (gen_parameters.csv), the
+    wind farms have a capacity of 200 MW, and the load profile repeats the daily profile of the
+    24-bus system with some noise. The nodes are split into 3 contiguous zones (for Step4_zonal).
+
+    Parameters:
+        nbNode (int): The number of nodes (e.g. 100, 1000 or 10000).
+        nbGenerators (int): The number of conventional generators, nbNode // 2 by default.
+        nbWind (int): The number of wind farms, nbNode // 4 by default.
+        nbLoads (int): The number of loads, 2 * nbNode // 3 by default.
+        nbHour (int): The number of hours of the load profile and of the wind scenarios.
+        nbScenarios (int): The number of wind scenarios (V1, V2, ...).
+        peak_load (float): The peak of the total demand, as a share of the conventional capacity.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        dict: The tables as pd.DataFrame ("gen_parameters", "wind_parameters", "load_location",
+            "load_profile", "transmission_parameters" and "zones") and "scen_zoneW", the wind
+            availability of shape (nbWind, nbHour, nbScenarios).
+    """
+    nbGenerators = nbGenerators if nbGenerators is not None else max(nbNode // 2, 1)
+    nbWind = nbWind if nbWind is not None else max(nbNode // 4, 1)
+    nbLoads = nbLoads if nbLoads is not None else max(2 * nbNode // 3, 1)
+    if nbNode < 3:
+        raise ValueError("A meshed grid needs at least 3 nodes.")
+    rng = np.random.default_rng(seed)
+    reference = load_input_store(default_inputs_directory)
+
+    # Network: a ring sorted by angle around the center, and a line to the nearest neighbour
+    position = rng.random((nbNode, 2))
+    angle = np.arctan2(position[:, 1] - 0.5, position[:, 0] - 0.5)
+    ring = np.argsort(angle)
+    lines = np.column_stack([ring, np.roll(ring, -1)])
+    _, neighbour = cKDTree(position).query(position, k=2)
+    lines = np.vstack([lines, np.column_stack([np.arange(nbNode), neighbour[:, 1]])])
+    lines = np.unique(np.sort(lines, axis=1), axis=0)
+    lines = lines[lines[:, 0] != lines[:, 1]]
+    length = np.linalg.norm(position[lines[:, 0]] - position[lines[:, 1]], axis=1)
+    adjacency = sp.csr_matrix((np.ones(len(lines)), (lines[:, 0], lines[:, 1])), shape=(nbNode, nbNode))
+    assert connected_components(adjacency, directed=False)[0] == 1
+
+    transmission_parameters = pd.DataFrame(
+        {
+            "from": lines[:, 0] + 1,
+            "to": lines[:, 1] + 1,
+            "reactance": np.round(0.005 + length * np.sqrt(nbNode) * 0.05, 4),
+            "capacity": rng.choice([175, 350, 500], size=len(lines)),
+        }
+    )
+
+    # 3 zones of consecutive nodes on the ring
+    zone = np.empty(nbNode, dtype=int)
+    zone[ring] = np.arange(nbNode) * 3 // nbNode + 1
+    zones = pd.DataFrame({"node": np.arange(1, nbNode + 1), "zone": zone})
+
+    # Fleet
+    templates = reference.table("gen_parameters").drop(columns=["Unit", "Node"])
+    gen_parameters = templates.iloc[rng.integers(len(templates), size=nbGenerators)].reset_index(drop=True)
+    gen_parameters.insert(0, "Node", rng.integers(1, nbNode + 1, size=nbGenerators))
+    gen_parameters.insert(0, "Unit", np.arange(1, nbGenerators + 1))
+
+    wind_parameters = pd.DataFrame(
+        {
+            "Unit": np.arange(1, nbWind + 1),
+            "Node": rng.integers(1, nbNode + 1, size=nbWind),
+            "Pmax": 200,
+            "Pmin": 0,
+            "Ci": 0,
+        }
+    )
+
+    share = rng.dirichlet(np.ones(nbLoads))
+    load_location = pd.DataFrame(
+        {
+            "load_number": np.arange(1, nbLoads + 1),
+            "node": rng.choice(nbNode, size=nbLoads, replace=nbLoads > nbNode) + 1,
+            "load_percentage": 100 * share,
+        }
+    )
+
+    # Daily profile of the 24-bus system, scaled to the conventional capacity
+    daily_profile = reference.column("load_profile", "total_demand")
+    daily_profile = daily_profile / daily_profile.max()
+    profile = np.resize(daily_profile, nbHour) * (1 + 0.03 * rng.standard_normal(nbHour))
+    load_profile = pd.DataFrame(
+        {
+            "hour": np.arange(1, nbHour + 1),
+            "total_demand": np.round(profile * peak_load * gen_parameters["Pmax"].sum(), 3),
+        }
+    )
+
+    # Wind availability: a random walk around a mean availability of each farm, between 0 and 1
+    mean_availability = rng.uniform(0.3, 0.6, size=(nbWind, 1, 1))
+    steps = 0.08 * rng.standard_normal((nbWind, nbHour, nbScenarios))
+    scen_zoneW = np.clip(mean_availability + np.cumsum(steps, axis=1), 0, 1)
+
+    return {
+        "gen_parameters": gen_parameters,
+        "wind_parameters": wind_parameters,
+        "load_location": load_location,
+        "load_profile": load_profile,
+        "transmission_parameters": transmission_parameters,
+        "zones": zones,
+        "scen_zoneW": scen_zoneW,
+    }
+
+
+def write_grid(grid: dict, directory: str) -> str:
+    """
+    Writes a grid of generate_grid as an inputs directory: the tables as csv files separated by ;
+    and the wind scenarios as data/scen_zoneW0.csv, scen_zoneW1.csv, ... Run the steps on it
+    with the environment variable INPUTS_DIR=directory (see utils.inputStore.load_input_store).
+
+    Returns:
+        str: The directory.
+    """
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    for table, data in grid.items():
+        if table != "scen_zoneW":
+            data.to_csv(os.path.join(directory, f"{table}.csv"), sep=";", index=False)
+
+    scenarios = grid["scen_zoneW"]
+    columns = [f"V{i + 1}" for i in range(scenarios.shape[2])]
+    index = np.arange(1, scenarios.shape[1] + 1)
+    for zone_id, availability in enumerate(scenarios):
+        pd.DataFrame(availability, index=index, columns=columns).to_csv(os.path.join(directory, "data", f"scen_zoneW{zone_id}.csv"))
+    return directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a synthetic grid as an inputs directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--generators", type=int)
+    parser.add_argument("--wind", type=int)
+    parser.add_argument("--loads", type=int)
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--scenarios", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    grid = generate_grid(
+        arguments.nodes, arguments.generators, arguments.wind, arguments.loads, arguments.hours, arguments.scenarios, seed=arguments.seed
+    )
+    print(write_grid(grid, arguments.directory))